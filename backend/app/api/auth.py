@@ -2,42 +2,33 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta
+from typing import List, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import hashlib
 import base64
 import secrets
-import smtplib
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from app.models.models import User, Chat
-from app.models.database import get_db
+from app.models.database import get_db, get_async_db
+from app.services.principal_cache import UserPrincipal, principal_cache
+from app.services.password_hasher import password_hasher
+from app.services.email_outbox import enqueue_email, smtp_configured, email_outbox_worker
+from app.services.chat_analytics import subtract_chat_rollups
 from app.config import (
     SECRET_KEY,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     BACKEND_BASE_URL,
     APP_BASE_URL,
     VERIFY_TOKEN_EXPIRE_HOURS,
-    SMTP_HOST,
-    SMTP_PORT,
-    SMTP_USER,
-    SMTP_PASS,
-    SMTP_FROM,
 )
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# Gmail app passwords are often copied with spaces for readability.
-SMTP_PASS_NORMALIZED = SMTP_PASS.replace(" ", "") if SMTP_PASS else ""
-
-# Password hashing - support argon2 + bcrypt for backward compatibility
-pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
-
 # JWT settings
 ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
@@ -79,14 +70,20 @@ class Token(BaseModel):
 class RegisterResponse(BaseModel):
     message: str
 
-# Helper functions
-def hash_password(password: str) -> str:
-    # Hash password using argon2 (no byte length limit)
-    return pwd_context.hash(password)
+class BulkDeleteWarning(BaseModel):
+    user_ids: Optional[List[int]] = None
+    inactive_days: Optional[int] = None  # เลือกผู้ใช้ที่ไม่ได้ใช้งานเกินจำนวนวันนี้
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Verify password against argon2 hash
-    return pwd_context.verify(plain_password, hashed_password)
+# Helper functions
+async def verify_password_and_rehash(db: AsyncSession, user: User, plain_password: str) -> bool:
+    """Verify off the event loop; upgrade bcrypt / outdated argon2 hashes to the current settings."""
+    valid, new_hash = await password_hasher.verify_and_update(plain_password, user.hashed_password)
+    if valid and new_hash:
+        user.hashed_password = new_hash
+        db.add(user)
+        await db.commit()
+        logger.info("Rehashed password for user %s with current settings", user.id)
+    return valid
 
 
 def is_email_allowed(email: str) -> bool:
@@ -96,10 +93,7 @@ def is_email_allowed(email: str) -> bool:
 def hash_verification_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
-def send_verification_email(to_email: str, verify_url: str):
-    if not SMTP_HOST or not SMTP_USER or not SMTP_PASS_NORMALIZED:
-        raise RuntimeError("SMTP is not configured. Set SMTP_HOST/SMTP_USER/SMTP_PASS.")
-
+def queue_verification_email(db: Session, to_email: str, verify_url: str):
     subject = "Verify your ChatCPE account"
     html_body = f"""
     <div style=\"font-family: Arial, sans-serif; line-height: 1.6;\">
@@ -111,22 +105,21 @@ def send_verification_email(to_email: str, verify_url: str):
       <p>This link expires in {VERIFY_TOKEN_EXPIRE_HOURS} hours.</p>
     </div>
     """
+    enqueue_email(db, "verification", to_email, subject, html_body)
 
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = SMTP_FROM
-    msg["To"] = to_email
-    msg.attach(MIMEText(html_body, "html"))
-
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS_NORMALIZED)
-            server.sendmail(SMTP_FROM, to_email, msg.as_string())
-        logger.info(f"Verification email sent to {to_email}")
-    except Exception as e:
-        logger.error(f"Failed to send verification email to {to_email}: {str(e)}")
-        raise
+
+def build_delete_warning_html(name: str) -> str:
+    return f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; color: #333; line-height: 1.6;">
+                <h2>แจ้งเตือนสำคัญ</h2>
+                <p>เรียนคุณ {name},</p>
+                <p>บัญชีผู้ใช้งานของคุณกำลังจะถูกลบออก เนื่องจากระบบได้ทำการตรวจสอบว่าคุณไม่ได้เข้าใช้งานเว็บไซต์นี้เป็นเวลานาน</p>
+                <p>หากคุณยังต้องการใช้งานบัญชีนี้ กรุณาเข้าสู่ระบบหรือติดต่อผู้ดูแลระบบโดยเร็วที่สุด</p>
+                <p style="margin-top: 20px; color: #666; font-size: 12px;">This message was sent automatically by ChatCPE.</p>
+            </body>
+        </html>
+        """
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -138,40 +131,47 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    import sys
-    print(f"DEBUG: Received token: {token[:20]}...", file=sys.stderr)
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"DEBUG: JWT payload: {payload}", file=sys.stderr)
-        user_id_raw = payload.get("sub")
-        if user_id_raw is None:
-            raise HTTPException(status_code=401, detail="Invalid token: missing subject")
-        # Convert to int in case JWT decoding returns string
-        user_id: int = int(user_id_raw) if isinstance(user_id_raw, str) else user_id_raw
-        print(f"DEBUG: Extracted user_id: {user_id}", file=sys.stderr)
-    except JWTError as e:
-        print(f"DEBUG: JWTError: {str(e)}", file=sys.stderr)
-        raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
-    except (ValueError, TypeError) as e:
-        print(f"DEBUG: ValueError/TypeError: {str(e)}", file=sys.stderr)
-        raise HTTPException(status_code=401, detail="Invalid token: malformed user ID")
-    
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> UserPrincipal:
+    user_id = principal_cache.get_user_id(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id_raw = payload.get("sub")
+            if user_id_raw is None:
+                raise HTTPException(status_code=401, detail="Invalid token: missing subject")
+            # Convert to int in case JWT decoding returns string
+            user_id = int(user_id_raw) if isinstance(user_id_raw, str) else user_id_raw
+        except JWTError as e:
+            logger.debug("Rejected token: %s", e)
+            raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
+        except (ValueError, TypeError):
+            logger.debug("Rejected token: malformed subject")
+            raise HTTPException(status_code=401, detail="Invalid token: malformed user ID")
+        principal_cache.set_user_id(token, user_id, payload.get("exp"))
+
+    principal = principal_cache.get_principal(user_id)
+    if principal is not None:
+        return principal
+
+    user = await db.get(User, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    principal = UserPrincipal.from_user(user)
+    principal_cache.set_principal(principal)
+    return principal
 
 
-def get_current_user_optional(token: str = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)):
+async def get_current_user_optional(
+    token: str = Depends(oauth2_scheme_optional), db: AsyncSession = Depends(get_async_db)
+) -> Optional[UserPrincipal]:
     if not token:
         return None
-    return get_current_user(token=token, db=db)
+    return await get_current_user(token=token, db=db)
 
 
 def require_roles(allowed_roles: list[str]):
     """Dependency factory to enforce role-based access control."""
-    def _checker(current_user: User = Depends(get_current_user)):
+    async def _checker(current_user: UserPrincipal = Depends(get_current_user)):
         if current_user.role not in allowed_roles:
             raise HTTPException(status_code=403, detail="Insufficient permissions")
         return current_user
@@ -202,26 +202,28 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     new_user = User(
         name=user_data.name,
         email=user_data.email,
-        hashed_password=hash_password(user_data.password),
+        hashed_password=await password_hasher.hash(user_data.password),
         role="user",
         is_verified=False,
         verification_token=token_hash,
         verification_sent_at=sent_at
     )
     db.add(new_user)
+    verify_url = f"{BACKEND_BASE_URL}/auth/verify?token={raw_token}"
+    # Queued in the same transaction as the user; the outbox worker sends it.
+    queue_verification_email(db, new_user.email, verify_url)
     db.commit()
     db.refresh(new_user)
 
-    verify_url = f"{BACKEND_BASE_URL}/auth/verify?token={raw_token}"
-    send_verification_email(new_user.email, verify_url)
-
+    if not smtp_configured():
+        return {"message": "Account created, but email delivery is not configured so the verification email has not been sent. Please contact an administrator."}
     return {"message": f"Verification email sent to {new_user.email}. Please verify to sign in."}
 
 @router.post("/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_async_db)):
     # Find user by email
-    user = db.query(User).filter(User.email == user_data.email).first()
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    user = (await db.execute(select(User).where(User.email == user_data.email))).scalars().first()
+    if not user or not await verify_password_and_rehash(db, user, user_data.password):
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     if not user.is_verified:
@@ -237,13 +239,13 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 
 
 @router.post("/token", response_model=Token)
-async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """
     OAuth2-compatible token endpoint using form data (username=email, password).
     Keeps existing /auth/login (JSON) while enabling Swagger "Authorize" and standard clients.
     """
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = (await db.execute(select(User).where(User.email == form_data.username))).scalars().first()
+    if not user or not await verify_password_and_rehash(db, user, form_data.password):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
     access_token = create_access_token(
@@ -253,7 +255,7 @@ async def token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     return {"access_token": access_token, "token_type": "bearer", "user_id": user.id}
 
 @router.get("/profile", response_model=UserProfile)
-async def get_profile(current_user: User = Depends(get_current_user)):
+async def get_profile(current_user: UserPrincipal = Depends(get_current_user)):
     return UserProfile(name=current_user.name, email=current_user.email, role=current_user.role)
 
 @router.get("/verify", response_class=HTMLResponse)
@@ -351,6 +353,7 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
     user.verification_sent_at = None
     db.add(user)
     db.commit()
+    principal_cache.invalidate_user(user.id)
 
     html = """
     <!DOCTYPE html>
@@ -382,14 +385,18 @@ async def verify_email(token: str, db: Session = Depends(get_db)):
 @router.put("/profile")
 async def update_profile(
     profile_data: UserProfileUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: UserPrincipal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    current_user.name = profile_data.name
-    db.add(current_user)
+    user = db.query(User).filter(User.id == current_user.id).first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.name = profile_data.name
+    db.add(user)
     db.commit()
-    db.refresh(current_user)
-    return {"message": "Profile updated successfully", "user": {"name": current_user.name, "email": current_user.email, "role": current_user.role}}
+    db.refresh(user)
+    principal_cache.invalidate_user(user.id)
+    return {"message": "Profile updated successfully", "user": {"name": user.name, "email": user.email, "role": user.role}}
 
 @router.post("/logout")
 async def logout():
@@ -414,6 +421,7 @@ async def update_user_role(
     db.add(user)
     db.commit()
     db.refresh(user)
+    principal_cache.invalidate_user(user.id)
     return {"message": "Role updated", "user_id": user.id, "role": user.role}
 
 
@@ -460,6 +468,11 @@ async def forgot_password(
     email = payload.get("email", "").strip()
     if not email:
         raise HTTPException(status_code=400, detail="Email is required")
+
+    # ตรวจก่อนค้นหาผู้ใช้ เพื่อไม่ให้คำตอบบอกได้ว่าอีเมลมีอยู่หรือไม่
+    if not smtp_configured():
+        logger.error("Password reset requested but SMTP is not configured")
+        raise HTTPException(status_code=503, detail="Email delivery is not configured. Please contact an administrator.")
     
     user = db.query(User).filter(User.email == email).first()
     if not user:
@@ -471,44 +484,28 @@ async def forgot_password(
     user.reset_password_token = reset_token
     user.reset_password_sent_at = datetime.utcnow()
     db.add(user)
+
+    # ส่ง email (ผ่าน outbox เบื้องหลัง)
+    reset_link = f"{APP_BASE_URL}/reset-password?token={reset_token}"
+    subject = "ChatCPE - Reset Your Password"
+    html_body = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif; color: #333;">
+            <h2>Password Reset Request</h2>
+            <p>Click the link below to reset your password. This link is valid for 15 minutes only.</p>
+            <a href="{reset_link}" style="background-color: #6277ac; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">
+                Reset Password
+            </a>
+            <p style="margin-top: 20px; font-size: 12px; color: #999;">
+                If you didn't request this, please ignore this email.
+            </p>
+        </body>
+    </html>
+    """
+    enqueue_email(db, "password_reset", email, subject, html_body)
     db.commit()
-    
-    # ส่ง email
-    try:
-        reset_link = f"{APP_BASE_URL}/reset-password?token={reset_token}"
-        subject = "ChatCPE - Reset Your Password"
-        html_body = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; color: #333;">
-                <h2>Password Reset Request</h2>
-                <p>Click the link below to reset your password. This link is valid for 15 minutes only.</p>
-                <a href="{reset_link}" style="background-color: #6277ac; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">
-                    Reset Password
-                </a>
-                <p style="margin-top: 20px; font-size: 12px; color: #999;">
-                    If you didn't request this, please ignore this email.
-                </p>
-            </body>
-        </html>
-        """
-        
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = SMTP_FROM
-        msg["To"] = email
-        
-        msg.attach(MIMEText(html_body, "html"))
-        
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS_NORMALIZED)
-            server.send_message(msg)
-        
-        logger.info(f"Password reset email sent to {email}")
-        return {"message": "If email exists, reset link has been sent"}
-    except Exception as e:
-        logger.error(f"Failed to send reset email to {email}: {str(e)}")
-        return {"message": "If email exists, reset link has been sent"}
+
+    return {"message": "If email exists, reset link has been sent"}
 
 
 @router.post("/reset-password")
@@ -544,7 +541,7 @@ async def reset_password(
             raise HTTPException(status_code=400, detail="Token has expired. Request a new one.")
     
     # อัปเดตรหัสผ่าน
-    user.hashed_password = pwd_context.hash(new_password)
+    user.hashed_password = await password_hasher.hash(new_password)
     user.reset_password_token = None  # ลบ token หลังใช้
     user.reset_password_sent_at = None
     db.add(user)
@@ -576,9 +573,11 @@ async def delete_user(
     if user_to_delete.role == "admin":
         raise HTTPException(status_code=403, detail="Cannot delete admin user")
     
-    # ลบ user และข้อมูลที่เกี่ยวข้อง
+    # ลบ user และข้อมูลที่เกี่ยวข้อง (รวมถึงยอดใน analytics rollup)
+    subtract_chat_rollups(db, Chat.user_id == user_id)
     db.delete(user_to_delete)
     db.commit()
+    principal_cache.invalidate_user(user_id)
     
     logger.info(f"User {user_to_delete.email} (ID: {user_id}) deleted by admin {current_user.email}")
     return {"message": f"User {user_to_delete.email} deleted successfully"}
@@ -603,36 +602,74 @@ async def notify_user_before_delete(
     if user_to_notify.role == "admin":
         raise HTTPException(status_code=403, detail="Cannot send delete warning to admin user")
 
-    if not SMTP_HOST or not SMTP_USER or not SMTP_PASS_NORMALIZED:
+    if not smtp_configured():
         raise HTTPException(status_code=500, detail="SMTP is not configured")
 
-    try:
-        subject = "ChatCPE - Account Deletion Warning"
-        html_body = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; color: #333; line-height: 1.6;">
-                <h2>แจ้งเตือนสำคัญ</h2>
-                <p>เรียนคุณ {user_to_notify.name},</p>
-                <p>บัญชีผู้ใช้งานของคุณกำลังจะถูกลบออก เนื่องจากระบบได้ทำการตรวจสอบว่าคุณไม่ได้เข้าใช้งานเว็บไซต์นี้เป็นเวลานาน</p>
-                <p>หากคุณยังต้องการใช้งานบัญชีนี้ กรุณาเข้าสู่ระบบหรือติดต่อผู้ดูแลระบบโดยเร็วที่สุด</p>
-                <p style="margin-top: 20px; color: #666; font-size: 12px;">This message was sent automatically by ChatCPE.</p>
-            </body>
-        </html>
-        """
+    enqueue_email(
+        db,
+        "delete_warning",
+        user_to_notify.email,
+        "ChatCPE - Account Deletion Warning",
+        build_delete_warning_html(user_to_notify.name),
+    )
+    db.commit()
+
+    logger.info(f"Delete warning email queued for user {user_to_notify.id} by admin {current_user.id}")
+    return {"message": f"Notification sent to {user_to_notify.email}"}
+
+
+@router.post("/users/notify-delete/bulk")
+async def notify_users_before_delete_bulk(
+    payload: BulkDeleteWarning,
+    current_user=Depends(require_roles(["admin"])),
+    db: Session = Depends(get_db)
+):
+    """
+    Admin ส่งการแจ้งเตือนก่อนลบให้ผู้ใช้หลายคนพร้อมกัน
+    ระบุ user_ids หรือ inactive_days (ผู้ใช้ที่ไม่ได้ใช้งานเกินจำนวนวัน) อีเมลจะถูกส่งเบื้องหลังผ่าน outbox
+    """
+    if not payload.user_ids and not payload.inactive_days:
+        raise HTTPException(status_code=400, detail="user_ids or inactive_days is required")
 
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = SMTP_FROM
-        msg["To"] = user_to_notify.email
-        msg.attach(MIMEText(html_body, "html"))
-
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS_NORMALIZED)
-            server.send_message(msg)
-
-        logger.info(f"Delete warning email sent to {user_to_notify.email} by {current_user.email}")
-        return {"message": f"Notification sent to {user_to_notify.email}"}
-    except Exception as e:
-        logger.error(f"Failed to send delete warning to {user_to_notify.email}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to send notification email")
\ No newline at end of file
+    if not smtp_configured():
+        raise HTTPException(status_code=500, detail="SMTP is not configured")
+
+    query = db.query(User).filter(User.role != "admin")
+    if payload.user_ids:
+        query = query.filter(User.id.in_(payload.user_ids))
+    if payload.inactive_days:
+        cutoff = datetime.utcnow() - timedelta(days=payload.inactive_days)
+        last_active = (
+            db.query(Chat.user_id, func.max(Chat.created_at).label("last_active_at"))
+            .group_by(Chat.user_id)
+            .subquery()
+        )
+        query = (
+            query.outerjoin(last_active, last_active.c.user_id == User.id)
+            .filter(User.created_at < cutoff)
+            .filter((last_active.c.last_active_at.is_(None)) | (last_active.c.last_active_at < cutoff))
+        )
+
+    queued = 0
+    for user in query.all():
+        enqueue_email(
+            db,
+            "delete_warning",
+            user.email,
+            "ChatCPE - Account Deletion Warning",
+            build_delete_warning_html(user.name),
+        )
+        queued += 1
+    db.commit()
+
+    logger.info(f"Queued {queued} delete warning emails by admin {current_user.id}")
+    return {"message": f"Queued {queued} notification emails", "queued": queued}
+
+
+@router.get("/email-outbox/stats")
+async def get_email_outbox_stats(
+    current_user=Depends(require_roles(["admin"])),
+    db: Session = Depends(get_db)
+):
+    """สถานะคิวอีเมล (pending / sent / failed) สำหรับแอดมิน"""
+    return email_outbox_worker.stats(db)
@@ -1,17 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import tuple_, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 import requests
+import httpx
 import uuid
 from datetime import datetime, timedelta
-from collections import Counter
-import csv
-import io
-import re
+import json
+import base64
 import time
 import asyncio
-from app.models.models import Chat, Answer, User
-from app.models.database import get_db
+from app.models.models import Chat, Answer, User, Thread
+from app.models.database import get_db, get_async_db, AsyncSessionLocal
 from app.config import (
     OPENWEBUI_URL,
     OPENWEBUI_API_KEY,
@@ -20,15 +21,69 @@ from app.config import (
     RAG_MAX_RETRIES,
     RAG_RETRY_DELAY_SECONDS,
     RAG_MAX_TOTAL_WAIT_SECONDS,
+    RAG_MAX_CONCURRENT_REQUESTS,
+    RAG_ADMISSION_QUEUE_SIZE,
+    RAG_ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    RAG_BREAKER_FAILURE_THRESHOLD,
+    RAG_BREAKER_RECOVERY_SECONDS,
+    RAG_BREAKER_HALF_OPEN_MAX_CALLS,
+    ANALYTICS_USE_ROLLUPS,
+    LOCAL_RETRIEVAL_PRERETRIEVE,
+    LOCAL_RETRIEVAL_FALLBACK,
+    LOCAL_RETRIEVAL_TOP_K,
 )
 from app.api.auth import get_current_user, get_current_user_optional, require_roles
+from app.services.principal_cache import UserPrincipal, principal_cache
+from app.logging_config import logging_stats
+from app.services.db_pool import db_pool_stats
+from app.services.vector_index import vector_index
+from app.services.local_retrieval import Passage, category_for_domain, chunk_retriever, retrieve_passages
+from app.services.rag_client import get_rag_client
+from app.services.answer_cache import answer_cache
+from app.services.single_flight import SingleFlight
+from app.services.circuit_breaker import STATE_OPEN, CircuitBreaker
+from app.services.admission import AdmissionController, AdmissionRejected
+from app.services.faq_matcher import faq_matcher, FAQMatch, FAQ_LLM_PROVIDER
+from app.api.faq import faq_index_refresh_due, refresh_faq_index_if_stale
+from app.services.thread_summary import make_thread_title, touch_thread
+from app.services.thai_text import normalize_question_text
+from app.services.chat_export import iter_chat_logs_csv, iter_chat_logs_ndjson_gzip, iter_chat_logs_parquet
+from app.services.chat_analytics import (
+    chat_rollups,
+    compute_chat_analytics,
+    compute_rollup_analytics,
+    record_chat_rollup,
+    subtract_chat_rollups,
+)
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, AsyncIterator
+from dataclasses import asdict, dataclass
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+RAG_STREAM_PATH = "/rag/answer/stream"
+STREAM_FALLBACK_CHUNK_CHARS = 24
+STREAM_DONE = object()
+RETRIEVAL_FALLBACK_EXCERPT_CHARS = 400
+RAG_LLM_PROVIDER = "rag_service"
+LOCAL_RETRIEVAL_LLM_PROVIDER = "local_retrieval"
+
+rag_single_flight = SingleFlight("rag_answer")
+rag_breaker = CircuitBreaker(
+    "rag_service",
+    failure_threshold=RAG_BREAKER_FAILURE_THRESHOLD,
+    recovery_timeout=RAG_BREAKER_RECOVERY_SECONDS,
+    half_open_max_calls=RAG_BREAKER_HALF_OPEN_MAX_CALLS,
+)
+rag_admission = AdmissionController(
+    "rag_service",
+    max_concurrent=RAG_MAX_CONCURRENT_REQUESTS,
+    max_queue=RAG_ADMISSION_QUEUE_SIZE,
+    queue_timeout=RAG_ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
 class ChatMessage(BaseModel):
     message: str
     thread_id: str  
@@ -37,6 +92,12 @@ class ChatMessage(BaseModel):
     domain: Optional[str] = None
     messages: Optional[List[Dict[str, str]]] = None
 
+@dataclass
+class RagAnswer:
+    text: str
+    provider: str = RAG_LLM_PROVIDER  # stored as Answer.llm_provider
+
+
 class ChatResponse(BaseModel):
     chat_id: Optional[int]
     message: str
@@ -49,11 +110,35 @@ class ThreadData(BaseModel):
     created_at: str
     messages: List[dict]
 
+class ThreadSummary(BaseModel):
+    id: str
+    title: str
+    created_at: Optional[str]
+    last_activity_at: Optional[str]
+    message_count: int
+
+class ThreadPage(BaseModel):
+    threads: List[ThreadSummary]
+    next_cursor: Optional[str]
+
+class MessagePage(BaseModel):
+    thread_id: str
+    messages: List[dict]
+    next_cursor: Optional[str]
 
-def normalize_question_text(text: str) -> str:
-    normalized = (text or "").strip().lower()
-    normalized = re.sub(r"\s+", " ", normalized)
-    return normalized
+
+def encode_cursor(created_at: Optional[datetime], key: object) -> str:
+    raw = json.dumps({"t": created_at.isoformat() if created_at else None, "k": key})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        created_at = datetime.fromisoformat(data["t"]) if data.get("t") else datetime.min
+        return created_at, data["k"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 def extract_rag_answer(payload: object) -> Optional[str]:
@@ -123,36 +208,167 @@ def build_contextual_question(question: str, messages: Optional[List[Dict[str, s
     )
 
 
-async def request_rag_answer(
+def build_rag_payload(
     question: str,
     messages: Optional[List[Dict[str, str]]] = None,
     session_id: Optional[str] = None,
     domain: Optional[str] = None,
-) -> Optional[str]:
-    headers = {"Content-Type": "application/json"}
-    
-    logger.info(f"RAG INPUT - Raw messages count: {len(messages) if messages else 0}")
-    if messages:
-        for i, m in enumerate(messages[:3]):
-            content_preview = str(m.get('content', ''))[:80]
-            logger.info(f"RAG INPUT - Message {i}: role={m.get('role')}, content={content_preview}")
-    
+) -> Dict[str, object]:
     normalized_messages = normalize_context_messages(messages)
-    contextual_question = build_contextual_question(question, normalized_messages)
-    payload = {"question": contextual_question}
+    payload: Dict[str, object] = {"question": build_contextual_question(question, normalized_messages)}
     if session_id:
         payload["session_id"] = session_id
     if domain:
         payload["domain"] = domain
     if normalized_messages:
         payload["messages"] = normalized_messages
+    return payload
+
+
+def build_unavailable_answer(question: str) -> str:
+    return f"ขอบคุณสำหรับคำถาม: '{question}'\n\nขณะนี้ระบบ AI กำลังอยู่ในช่วงปรับปรุง ดังนั้นจึงไม่สามารถตอบคำถามได้ในขณะนี้\n\nกรุณาติดต่อเจ้าหน้าที่เพื่อขอความช่วยเหลือ หรือลองใหม่อีกครั้งในภายหลัง"
+
+
+def build_retrieval_fallback_answer(question: str, passages: List[Passage]) -> str:
+    """คำตอบสำรองเมื่อ RAG ใช้งานไม่ได้: แสดงข้อความจากเอกสารที่เกี่ยวข้องที่สุดแทน"""
+    lines = [
+        f"ขณะนี้ระบบ AI ไม่สามารถสรุปคำตอบสำหรับคำถาม: '{question}' ได้",
+        "ข้อมูลที่เกี่ยวข้องจากเอกสารของภาควิชามีดังนี้",
+        "",
+    ]
+    for index, passage in enumerate(passages, start=1):
+        source = passage.filename or "เอกสาร"
+        if passage.page:
+            source += f" หน้า {passage.page}"
+        excerpt = passage.text.strip()
+        if len(excerpt) > RETRIEVAL_FALLBACK_EXCERPT_CHARS:
+            excerpt = excerpt[:RETRIEVAL_FALLBACK_EXCERPT_CHARS].rstrip() + "…"
+        lines.append(f"{index}. [{source}]\n{excerpt}\n")
+    lines.append("กรุณาตรวจสอบรายละเอียดกับเอกสารต้นฉบับหรือเจ้าหน้าที่อีกครั้ง")
+    return "\n".join(lines)
+
+
+def passage_context(passage: Passage) -> Dict[str, object]:
+    return {
+        "chunk_id": passage.chunk_id,
+        "text": passage.text,
+        "filename": passage.filename,
+        "page": passage.page,
+        "score": passage.score,
+    }
 
-    # Debug logging 
-    logger.info(f"RAG PAYLOAD - Normalized messages count: {len(normalized_messages) if normalized_messages else 0}")
-    if normalized_messages:
-        logger.info(f"RAG PAYLOAD - Messages: {normalized_messages}")
-    logger.info(f"RAG PAYLOAD - Question length: {len(contextual_question)} chars")
-    logger.info(f"RAG PAYLOAD - Full contextual question:\n{contextual_question[:500]}")
+
+async def find_local_passages(question: str, domain: Optional[str] = None) -> List[Passage]:
+    try:
+        return await retrieve_passages(question, domain=domain, k=LOCAL_RETRIEVAL_TOP_K)
+    except Exception as e:
+        logger.warning(f"Local retrieval failed: {str(e)}")
+        return []
+
+
+def save_chat_exchange(
+    db: Session,
+    user_id: Optional[int],
+    thread_id: str,
+    message: str,
+    answer_text: str,
+    llm_provider: str = RAG_LLM_PROVIDER,
+) -> Optional[int]:
+    """บันทึก chat และ answer ลง database เฉพาะเมื่อมี user_id (guest จะไม่ถูกบันทึก)"""
+    if not user_id:
+        logger.debug("Guest mode - not saving chat history")
+        return None
+
+    normalized_message = normalize_question_text(message)
+    chat = Chat(
+        user_id=user_id,
+        thread_id=thread_id,
+        message=message,
+        normalized_message=normalized_message,
+    )
+    db.add(chat)
+    db.flush()
+    touch_thread(db, user_id, thread_id, message, chat.created_at)
+
+    answer = Answer(
+        chat_id=chat.id,
+        llm_provider=llm_provider,
+        answer=answer_text
+    )
+    db.add(answer)
+    # Read before commit so nothing is reloaded if the session expires on commit.
+    chat_id, created_at = chat.id, chat.created_at
+    db.commit()
+    record_chat_rollup(user_id, normalized_message, created_at)
+    logger.debug("Saved chat %s and answer", chat_id)
+    return chat_id
+
+
+async def request_rag_answer(
+    question: str,
+    messages: Optional[List[Dict[str, str]]] = None,
+    session_id: Optional[str] = None,
+    domain: Optional[str] = None,
+) -> Optional[RagAnswer]:
+    payload = build_rag_payload(question, messages, session_id=session_id, domain=domain)
+    normalized_messages = payload.get("messages", [])
+    contextual_question = payload["question"]
+
+    # Near-duplicate matching only applies to questions without conversation context.
+    cache_question = normalize_question_text(contextual_question)
+    cached_answer = answer_cache.get(cache_question, domain, allow_similar=not normalized_messages)
+    if cached_answer:
+        logger.debug("RAG answer served from cache")
+        return RagAnswer(cached_answer)
+
+    async def answer_locally(passages: List[Passage], reason: str) -> Optional[RagAnswer]:
+        # Degraded mode: answer with the best local passages (never cached).
+        if not LOCAL_RETRIEVAL_FALLBACK:
+            return None
+        passages = passages or await find_local_passages(question, domain)
+        if not passages:
+            return None
+        logger.info("RAG %s, answering from %s local passages", reason, len(passages))
+        return RagAnswer(build_retrieval_fallback_answer(question, passages), LOCAL_RETRIEVAL_LLM_PROVIDER)
+
+    async def fetch_and_cache() -> Optional[RagAnswer]:
+        passages: List[Passage] = []
+        if LOCAL_RETRIEVAL_PRERETRIEVE:
+            # Pre-retrieval: the RAG service gets our top passages as extra context.
+            passages = await find_local_passages(question, domain)
+            if passages:
+                payload["contexts"] = [passage_context(passage) for passage in passages]
+        if rag_breaker.state == STATE_OPEN:
+            # RAG would be skipped anyway; don't take an admission slot to find that out.
+            return await answer_locally(passages, "circuit open")
+        try:
+            async with rag_admission.slot():
+                answer = await _post_rag_answer(payload)
+        except AdmissionRejected:
+            # Backlog full: answer locally if possible, otherwise callers turn it into a 429.
+            fallback = await answer_locally(passages, "backlog full")
+            if fallback is None:
+                raise
+            return fallback
+        if answer:
+            answer_cache.set(cache_question, answer, domain, allow_similar=not normalized_messages)
+            return RagAnswer(answer)
+        return await answer_locally(passages, "unavailable")
+
+    # Identical concurrent questions share one upstream call (the leader's session_id is sent).
+    inflight_key = (contextual_question, (domain or "").strip().lower())
+    return await rag_single_flight.do(inflight_key, fetch_and_cache)
+
+
+async def _post_rag_answer(payload: Dict[str, object]) -> Optional[str]:
+    # Sizes only: question and answer text stay out of the logs.
+    logger.debug(
+        "RAG payload prepared",
+        extra={
+            "context_messages": len(payload.get("messages", [])),
+            "question_chars": len(payload["question"]),
+        },
+    )
 
     attempts = max(1, int(RAG_MAX_RETRIES))
     raw_timeout = float(RAG_REQUEST_TIMEOUT_SECONDS)
@@ -166,7 +382,7 @@ async def request_rag_answer(
     started_at = time.monotonic()
 
     if timeout_disabled:
-        logger.info(
+        logger.debug(
             "RAG config: url=%s timeout=disabled attempts=%s retry_delay=%.1fs max_total_wait=%s",
             RAG_SERVICE_URL,
             attempts,
@@ -174,7 +390,7 @@ async def request_rag_answer(
             "disabled" if total_timeout_budget is None else f"{total_timeout_budget:.1f}s",
         )
     else:
-        logger.info(
+        logger.debug(
             "RAG config: url=%s timeout_per_attempt=%.1fs attempts=%s retry_delay=%.1fs budget=%s",
             RAG_SERVICE_URL,
             timeout_per_attempt,
@@ -184,6 +400,16 @@ async def request_rag_answer(
         )
 
     for attempt in range(1, attempts + 1):
+        # Fail fast while the circuit is open instead of burning the retry budget.
+        if not rag_breaker.allow_request():
+            logger.warning(
+                "RAG circuit %s, skipping attempt %s (retry after %.1fs)",
+                rag_breaker.state,
+                attempt,
+                rag_breaker.retry_after_seconds(),
+            )
+            break
+
         remaining_budget = None
         if total_timeout_budget is not None:
             elapsed = time.monotonic() - started_at
@@ -201,14 +427,14 @@ async def request_rag_answer(
             per_attempt_timeout = min(scaled_timeout, max(0.1, remaining_budget))
 
         try:
-            response = requests.post(
-                f"{RAG_SERVICE_URL}/rag/answer",
-                headers=headers,
+            client = await get_rag_client()
+            response = await client.post(
+                "/rag/answer",
                 json=payload,
-                timeout=per_attempt_timeout,
+                timeout=httpx.Timeout(per_attempt_timeout, connect=client.timeout.connect),
             )
 
-            logger.info(
+            logger.debug(
                 "RAG attempt %s/%s status=%s timeout=%s",
                 attempt,
                 attempts,
@@ -216,9 +442,11 @@ async def request_rag_answer(
                 "disabled" if per_attempt_timeout is None else f"{per_attempt_timeout:.1f}s",
             )
 
-            if not response.ok:
+            if not response.is_success:
                 logger.warning("RAG returned non-OK status on attempt %s", attempt)
+                rag_breaker.record_failure()
             else:
+                rag_breaker.record_success()
                 try:
                     parsed = response.json()
                 except ValueError:
@@ -226,14 +454,14 @@ async def request_rag_answer(
 
                 answer = extract_rag_answer(parsed)
                 if answer:
-                    logger.info("RAG answered successfully on attempt %s", attempt)
-                    logger.info(f"RAG RESPONSE - Length: {len(answer)} chars, Preview: {answer[:150]}")
+                    logger.debug("RAG answered successfully on attempt %s", attempt)
+                    logger.debug("RAG response received", extra={"answer_chars": len(answer)})
                     return answer
 
                 logger.warning("RAG response on attempt %s had no usable answer", attempt)
-                logger.info(f"RAG RESPONSE - Full payload: {str(parsed)[:500]}")
+                logger.debug("RAG response keys: %s", sorted(parsed) if isinstance(parsed, dict) else type(parsed).__name__)
 
-        except requests.exceptions.Timeout as err:
+        except httpx.TimeoutException as err:
             timeout_label = "disabled" if per_attempt_timeout is None else f"{per_attempt_timeout:.1f}s"
             budget_label = "disabled" if remaining_budget is None else f"{remaining_budget:.1f}s"
             logger.warning(
@@ -244,8 +472,10 @@ async def request_rag_answer(
                 budget_label,
                 str(err),
             )
-        except requests.exceptions.RequestException as err:
+            rag_breaker.record_failure()
+        except httpx.HTTPError as err:
             logger.warning("RAG request error on attempt %s/%s: %s", attempt, attempts, str(err))
+            rag_breaker.record_failure()
 
         if attempt < attempts:
             backoff = retry_delay * attempt
@@ -262,10 +492,139 @@ async def request_rag_answer(
 
     return None
 
+async def match_faq_answer(question: str, messages: Optional[List[Dict[str, str]]] = None) -> Optional[FAQMatch]:
+    # A follow-up ("แล้วปี 2 ล่ะ") depends on earlier turns, so it never short-circuits to a FAQ.
+    if normalize_context_messages(messages):
+        return None
+    try:
+        # Only the staleness query and rebuild leave the event loop, at most once per refresh interval.
+        if faq_index_refresh_due():
+            await asyncio.get_running_loop().run_in_executor(None, refresh_faq_index_if_stale)
+    except Exception as e:
+        logger.warning(f"FAQ index refresh failed: {str(e)}")
+    match = faq_matcher.match(question)
+    if match:
+        logger.debug("Answered from FAQ %s (confidence=%.2f)", match.faq_id, match.confidence)
+    return match
+
+
+def parse_rag_stream_line(line: str) -> object:
+    """แปลงหนึ่งบรรทัดจาก stream ของ RAG (SSE/NDJSON/ข้อความล้วน) เป็น token"""
+    text = (line or "").strip()
+    if not text or text.startswith((":", "event:", "id:", "retry:")):
+        return None
+    if text.startswith("data:"):
+        text = text[len("data:"):].strip()
+    if text == "[DONE]":
+        return STREAM_DONE
+
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return text
+
+    if isinstance(parsed, dict):
+        if parsed.get("done") is True:
+            return STREAM_DONE
+        for key in ("token", "delta", "content", "text", "answer"):
+            value = parsed.get(key)
+            if isinstance(value, str):
+                return value
+        return None
+    if isinstance(parsed, str):
+        return parsed
+    return None
+
+
+async def stream_rag_answer(
+    question: str,
+    messages: Optional[List[Dict[str, str]]] = None,
+    session_id: Optional[str] = None,
+    domain: Optional[str] = None,
+    meta: Optional[Dict[str, str]] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream partial tokens from the RAG service.
+    Falls back to request_rag_answer and replays the full answer in small chunks
+    when the upstream has no streaming endpoint, is busy, or fails before the first token.
+    `meta["llm_provider"]` is set to where the answer came from.
+    """
+    meta = meta if meta is not None else {}
+    meta["llm_provider"] = RAG_LLM_PROVIDER
+    payload = build_rag_payload(question, messages, session_id=session_id, domain=domain)
+    cache_question = normalize_question_text(payload["question"])
+    allow_similar = "messages" not in payload
+    cached_answer = answer_cache.get(cache_question, domain, allow_similar=allow_similar)
+    if cached_answer:
+        logger.debug("RAG stream served from cache")
+        for start in range(0, len(cached_answer), STREAM_FALLBACK_CHUNK_CHARS):
+            yield cached_answer[start:start + STREAM_FALLBACK_CHUNK_CHARS]
+        return
+
+    raw_timeout = float(RAG_REQUEST_TIMEOUT_SECONDS)
+    read_timeout = None if raw_timeout <= 0 else max(2.0, raw_timeout)
+    produced = False
+    parts: List[str] = []
+
+    if not rag_breaker.allow_request():
+        logger.warning("RAG circuit %s, skipping upstream stream", rag_breaker.state)
+    else:
+        try:
+            client = await get_rag_client()
+            async with rag_admission.slot(), client.stream(
+                "POST",
+                RAG_STREAM_PATH,
+                json=payload,
+                timeout=httpx.Timeout(read_timeout, connect=client.timeout.connect),
+            ) as response:
+                if response.is_success:
+                    rag_breaker.record_success()
+                    async for line in response.aiter_lines():
+                        token = parse_rag_stream_line(line)
+                        if token is STREAM_DONE:
+                            break
+                        if token:
+                            produced = True
+                            parts.append(token)
+                            yield token
+                    if produced:
+                        answer_cache.set(cache_question, "".join(parts).strip(), domain, allow_similar=allow_similar)
+                else:
+                    # 4xx means the host is up but has no streaming endpoint; only 5xx counts against the circuit.
+                    if response.status_code >= 500:
+                        rag_breaker.record_failure()
+                    else:
+                        rag_breaker.record_success()
+                    logger.warning("RAG stream returned status %s, using non-streaming fallback", response.status_code)
+        except httpx.HTTPError as err:
+            if produced:
+                logger.warning("RAG stream interrupted after partial answer: %s", str(err))
+                return
+            rag_breaker.record_failure()
+            logger.warning("RAG stream error, using non-streaming fallback: %s", str(err))
+        except AdmissionRejected:
+            # The non-streaming path answers from local passages or re-raises for the 429.
+            logger.warning("RAG backlog full, using non-streaming fallback")
+
+    if produced:
+        return
+
+    answer = await request_rag_answer(question, messages=messages, session_id=session_id, domain=domain)
+    if not answer:
+        return
+    meta["llm_provider"] = answer.provider
+    for start in range(0, len(answer.text), STREAM_FALLBACK_CHUNK_CHARS):
+        yield answer.text[start:start + STREAM_FALLBACK_CHUNK_CHARS]
+
+
+def format_sse_event(event: str, data: Dict[str, object]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @router.post("/send", response_model=ChatResponse)
 async def send_message(
     chat_msg: ChatMessage, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
     """
@@ -276,53 +635,47 @@ async def send_message(
     try:
         user_id_from_msg = chat_msg.user_id or (current_user.id if current_user else None)
         thread_id = chat_msg.thread_id
-        logger.info(f"Received message: {chat_msg.message} from user/guest: {user_id_from_msg}, thread: {thread_id}")
+        logger.debug(
+            "Received message",
+            extra={
+                "user_id": user_id_from_msg,
+                "thread_id": thread_id,
+                "question_chars": len(chat_msg.message),
+                "context_messages": len(chat_msg.messages or []),
+            },
+        )
         
-        # Log if messages are being received
-        if chat_msg.messages:
-            logger.info(f"Received context messages count: {len(chat_msg.messages)}")
-            for i, msg in enumerate(chat_msg.messages):
-                logger.info(f"  Message {i}: role={msg.get('role')}, content_length={len(str(msg.get('content', '')))} chars")
+        # ตอบจาก FAQ ทันทีถ้าคำถามตรงกับ FAQ ที่มีอยู่มากพอ
+        llm_provider = RAG_LLM_PROVIDER
+        llm_response = None
+        faq_match = await match_faq_answer(chat_msg.message, chat_msg.messages)
+        if faq_match:
+            llm_response = faq_match.answer
+            llm_provider = FAQ_LLM_PROVIDER
         else:
-            logger.info("No context messages received")
-        
-        logger.info(f"Calling RAG Service at: {RAG_SERVICE_URL}")
-        llm_response = await request_rag_answer(
-            chat_msg.message,
-            messages=chat_msg.messages,
-            session_id=chat_msg.session_id or thread_id,
-            domain=chat_msg.domain,
-        )
+            rag_answer = await request_rag_answer(
+                chat_msg.message,
+                messages=chat_msg.messages,
+                session_id=chat_msg.session_id or thread_id,
+                domain=chat_msg.domain,
+            )
+            if rag_answer:
+                llm_response, llm_provider = rag_answer.text, rag_answer.provider
         
         # If RAG Service failed, use a mock response
         if not llm_response:
-            llm_response = f"ขอบคุณสำหรับคำถาม: '{chat_msg.message}'\n\nขณะนี้ระบบ AI กำลังอยู่ในช่วงปรับปรุง ดังนั้นจึงไม่สามารถตอบคำถามได้ในขณะนี้\n\nกรุณาติดต่อเจ้าหน้าที่เพื่อขอความช่วยเหลือ หรือลองใหม่อีกครั้งในภายหลัง"
+            llm_response = build_unavailable_answer(chat_msg.message)
             logger.info("Using mock response due to RAG Service unavailability")
         
         # บันทึก chat ลง database เฉพาะเมื่อมี user_id
-        chat_id = None
-        if user_id_from_msg:
-            chat = Chat(
-                user_id=user_id_from_msg,
-                thread_id=thread_id,
-                message=chat_msg.message,
-            )
-            db.add(chat)
-            db.flush() 
-            
-            answer = Answer(
-                chat_id=chat.id,
-                llm_provider="rag_service",
-                answer=llm_response
-            )
-            db.add(answer)
-            db.commit()
-            db.refresh(chat)
-            db.refresh(answer)
-            chat_id = chat.id
-            logger.info(f"Saved chat {chat.id} and answer successfully")
-        else:
-            logger.info("Guest mode - not saving chat history")
+        chat_id = await db.run_sync(
+            save_chat_exchange,
+            user_id_from_msg,
+            thread_id,
+            chat_msg.message,
+            llm_response,
+            llm_provider=llm_provider,
+        )
         
         return ChatResponse(
             chat_id=chat_id or 0,
@@ -333,6 +686,12 @@ async def send_message(
         
     except HTTPException:
         raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail="AI service is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -340,9 +699,107 @@ async def send_message(
             detail=f"Server error: {str(e)}"
         )
 
+@router.post("/stream")
+async def stream_message(
+    chat_msg: ChatMessage,
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """
+    ส่ง message ไปให้ RAG แบบ streaming (Server-Sent Events)
+    ส่ง token ทีละส่วนระหว่างสร้างคำตอบ และบันทึก chat/answer เมื่อ stream จบ
+    หาก client ตัดการเชื่อมต่อ จะยกเลิกการเรียก RAG และไม่บันทึกคำตอบ
+    """
+    # With the local fallback enabled a full backlog can still be answered from local passages.
+    if rag_admission.is_saturated() and not LOCAL_RETRIEVAL_FALLBACK:
+        raise HTTPException(
+            status_code=429,
+            detail="AI service is busy, please retry shortly",
+            headers={"Retry-After": str(rag_admission.retry_after_seconds())}
+        )
+
+    user_id_from_msg = chat_msg.user_id or (current_user.id if current_user else None)
+    thread_id = chat_msg.thread_id
+    logger.debug(
+        "Received streaming message",
+        extra={"user_id": user_id_from_msg, "thread_id": thread_id, "question_chars": len(chat_msg.message)},
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        parts: List[str] = []
+        llm_provider = RAG_LLM_PROVIDER
+        yield format_sse_event("start", {"thread_id": thread_id})
+
+        faq_match = await match_faq_answer(chat_msg.message, chat_msg.messages)
+        if faq_match:
+            llm_provider = FAQ_LLM_PROVIDER
+            parts.append(faq_match.answer)
+            yield format_sse_event("token", {"token": faq_match.answer})
+        else:
+            stream_meta: Dict[str, str] = {}
+            try:
+                async for token in stream_rag_answer(
+                    chat_msg.message,
+                    messages=chat_msg.messages,
+                    session_id=chat_msg.session_id or thread_id,
+                    domain=chat_msg.domain,
+                    meta=stream_meta,
+                ):
+                    parts.append(token)
+                    yield format_sse_event("token", {"token": token})
+                llm_provider = stream_meta.get("llm_provider", llm_provider)
+            except asyncio.CancelledError:
+                logger.info(f"Client disconnected from stream, thread: {thread_id}")
+                raise
+            except AdmissionRejected as e:
+                yield format_sse_event("error", {
+                    "status": 429,
+                    "detail": "AI service is busy, please retry shortly",
+                    "retry_after": e.retry_after,
+                })
+                return
+
+        llm_response = "".join(parts).strip()
+        if not llm_response:
+            llm_response = build_unavailable_answer(chat_msg.message)
+            logger.info("Using mock response due to RAG Service unavailability")
+            yield format_sse_event("token", {"token": llm_response})
+
+        chat_id = None
+        async with AsyncSessionLocal() as db:
+            try:
+                chat_id = await db.run_sync(
+                    save_chat_exchange,
+                    user_id_from_msg,
+                    thread_id,
+                    chat_msg.message,
+                    llm_response,
+                    llm_provider=llm_provider,
+                )
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Error saving streamed chat: {str(e)}", exc_info=True)
+
+        yield format_sse_event("done", {
+            "chat_id": chat_id or 0,
+            "message": chat_msg.message,
+            "answer": llm_response,
+            "thread_id": thread_id,
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Disable nginx response buffering so tokens are flushed immediately.
+            "X-Accel-Buffering": "no",
+        },
+    )
+
 @router.get("/health")
 async def chat_health():
-    """ตรวจสอบการเชื่อมต่อ Open WebUI"""
+    """ตรวจสอบการเชื่อมต่อ Open WebUI และสถานะ circuit breaker ของ RAG service"""
+    rag_circuit = rag_breaker.stats()
     try:
         response = requests.get(
             f"{OPENWEBUI_URL}/api/status",
@@ -350,29 +807,87 @@ async def chat_health():
         )
         if response.ok:
             return {
-                "status": "healthy",
+                "status": "healthy" if rag_circuit["state"] == "closed" else "degraded",
                 "openwebui_url": OPENWEBUI_URL,
-                "openwebui_status": response.status_code
+                "openwebui_status": response.status_code,
+                "rag_circuit": rag_circuit
             }
         else:
             return {
                 "status": "warning",
                 "openwebui_url": OPENWEBUI_URL,
                 "openwebui_status": response.status_code,
-                "message": "Open WebUI responding but with error"
+                "message": "Open WebUI responding but with error",
+                "rag_circuit": rag_circuit
             }
     except Exception as e:
         return {
             "status": "unhealthy",
             "openwebui_url": OPENWEBUI_URL,
             "error": str(e),
-            "message": "Cannot connect to Open WebUI"
+            "message": "Cannot connect to Open WebUI",
+            "rag_circuit": rag_circuit
         }
 
 
+@router.get("/cache/stats")
+async def get_answer_cache_stats(
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
+):
+    """สถิติ hit/miss ของ answer cache ที่อยู่หน้า RAG service"""
+    return answer_cache.stats()
+
+
+@router.get("/rag/metrics")
+async def get_rag_metrics(
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
+):
+    """ตัวชี้วัดการเรียก RAG service เช่น จำนวนคำถามที่ถูกรวม (coalesced) เข้ากับคำขอที่กำลังทำงานอยู่"""
+    return {
+        "coalescing": rag_single_flight.stats(),
+        "circuit_breaker": rag_breaker.stats(),
+        "admission": rag_admission.stats(),
+        "faq_index": faq_matcher.stats(),
+        "answer_cache": answer_cache.stats(),
+        "analytics_rollups": chat_rollups.stats(),
+        "auth_principal_cache": principal_cache.stats(),
+        "logging": logging_stats(),
+        "db_pool": db_pool_stats(),
+        "vector_index": vector_index.stats(),
+        "local_retrieval": chunk_retriever.stats(),
+    }
+
+
+@router.get("/retrieve")
+async def retrieve_local_passages(
+    q: str = Query(..., min_length=1, max_length=2000),
+    domain: Optional[str] = None,
+    k: int = Query(default=LOCAL_RETRIEVAL_TOP_K, ge=1, le=50),
+    current_user = Depends(get_current_user)
+):
+    """
+    ค้นหาข้อความจากเอกสารที่อัปโหลดด้วย hybrid retrieval ภายใน backend (BM25 + vector, รวมอันดับด้วย RRF)
+    กรองตามหมวดเอกสารได้ด้วย `domain` (เช่น curriculum, regulation, course_structure)
+    """
+    passages = await retrieve_passages(q, domain=domain, k=k)
+    return {
+        "query": q,
+        "category": category_for_domain(domain),
+        "passages": [asdict(passage) for passage in passages],
+    }
+
+
+@router.delete("/cache")
+async def clear_answer_cache(
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
+):
+    """ล้าง answer cache ทั้งหมด (ทุก worker)"""
+    await asyncio.get_running_loop().run_in_executor(None, answer_cache.invalidate_all)
+    return {"message": "Answer cache cleared"}
+
+
 @router.post("/threads/create")
 async def create_thread(
-    db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
@@ -390,19 +905,20 @@ async def create_thread(
 
 @router.get("/history")
 async def get_chat_history(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
     """
     ดึงประวัติการสนทนาของผู้ใช้ แยกเป็น threads
     """
     try:
-        chats = (
-            db.query(Chat)
-            .filter(Chat.user_id == current_user.id)
+        result = await db.execute(
+            select(Chat)
+            .options(selectinload(Chat.answers))
+            .where(Chat.user_id == current_user.id)
             .order_by(Chat.created_at.asc(), Chat.id.asc())
-            .all()
         )
+        chats = result.scalars().all()
         
         # จัดกลุ่มข้อความตามแต่ละ thread
         threads_dict = {}
@@ -452,7 +968,7 @@ async def get_chat_history(
         threads_list = []
         for thread_id, thread_data in threads_dict.items():
             first_message = next((msg for msg in thread_data["messages"] if msg["role"] == "user"), None)
-            title = first_message["text"][:50] + "..." if first_message and len(first_message["text"]) > 50 else (first_message["text"] if first_message else "Untitled")
+            title = make_thread_title(first_message["text"] if first_message else None)
             
             threads_list.append({
                 "id": thread_id,
@@ -469,6 +985,115 @@ async def get_chat_history(
         logger.error(f"Error getting chat history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/threads", response_model=ThreadPage)
+async def list_chat_threads(
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    รายการ threads ของผู้ใช้ (เฉพาะหัวข้อ ไม่รวมข้อความ) เรียงจากล่าสุด
+    แบ่งหน้าแบบ keyset ด้วย `cursor` ที่ได้จาก `next_cursor` ของหน้าก่อน
+    """
+    query = select(Thread).where(Thread.user_id == current_user.id)
+    if cursor:
+        cursor_time, cursor_thread = decode_cursor(cursor)
+        query = query.where(tuple_(Thread.created_at, Thread.thread_id) < tuple_(cursor_time, cursor_thread))
+
+    result = await db.execute(
+        query.order_by(Thread.created_at.desc(), Thread.thread_id.desc())
+        .limit(limit + 1)
+    )
+    rows = result.scalars().all()
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit and page:
+        next_cursor = encode_cursor(page[-1].created_at, page[-1].thread_id)
+
+    return {
+        "threads": [
+            {
+                "id": thread.thread_id,
+                "title": thread.title,
+                "created_at": thread.created_at.isoformat() if thread.created_at else None,
+                "last_activity_at": thread.last_activity_at.isoformat() if thread.last_activity_at else None,
+                "message_count": thread.message_count,
+            }
+            for thread in page
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@router.get("/threads/{thread_id}/messages", response_model=MessagePage)
+async def get_thread_messages(
+    thread_id: str,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    ข้อความใน thread แบ่งหน้าแบบ cursor เริ่มจากข้อความล่าสุด
+    `next_cursor` ใช้ดึงข้อความที่เก่ากว่า (ข้อความในแต่ละหน้าเรียงตามเวลา)
+    """
+    chat_page = (
+        select(Chat.id, Chat.created_at)
+        .where(Chat.user_id == current_user.id, Chat.thread_id == thread_id)
+    )
+    if cursor:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        chat_page = chat_page.where(tuple_(Chat.created_at, Chat.id) < tuple_(cursor_time, cursor_id))
+    chat_page = (
+        chat_page.order_by(Chat.created_at.desc(), Chat.id.desc())
+        .limit(limit + 1)
+        .subquery()
+    )
+
+    result = await db.execute(
+        select(Chat, Answer)
+        .join(chat_page, Chat.id == chat_page.c.id)
+        .outerjoin(Answer, Answer.chat_id == Chat.id)
+        .order_by(Chat.created_at.desc(), Chat.id.desc(), Answer.created_at.asc(), Answer.id.asc())
+    )
+    rows = result.all()
+
+    chats_in_order: List[Chat] = []
+    answers_by_chat: Dict[int, List[Answer]] = {}
+    for chat, answer in rows:
+        if chat.id not in answers_by_chat:
+            chats_in_order.append(chat)
+            answers_by_chat[chat.id] = []
+        if answer is not None:
+            answers_by_chat[chat.id].append(answer)
+
+    has_more = len(chats_in_order) > limit
+    chats_in_order = chats_in_order[:limit]
+    next_cursor = None
+    if has_more and chats_in_order:
+        oldest = chats_in_order[-1]
+        next_cursor = encode_cursor(oldest.created_at, oldest.id)
+
+    messages = []
+    for chat in reversed(chats_in_order):
+        messages.append({
+            "id": chat.id,
+            "role": "user",
+            "text": chat.message,
+            "created_at": chat.created_at.isoformat() if chat.created_at else None
+        })
+        for answer in answers_by_chat[chat.id]:
+            messages.append({
+                "id": answer.id,
+                "role": "bot",
+                "text": answer.answer,
+                "created_at": answer.created_at.isoformat() if answer.created_at else None
+            })
+
+    return {"thread_id": thread_id, "messages": messages, "next_cursor": next_cursor}
+
 @router.get("/test-openwebui")
 async def test_openwebui():
     """ทดสอบการเชื่อมต่อและเรียก Open WebUI"""
@@ -486,7 +1111,7 @@ async def test_openwebui():
         )
         
         logger.info(f"Response status: {response.status_code}")
-        logger.info(f"Response: {response.text}")
+        logger.debug("Response: %s", response.text[:500])
         
         return {
             "success": response.ok,
@@ -504,24 +1129,25 @@ async def test_openwebui():
 
 @router.delete("/history")
 async def delete_chat_history(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
     """
     ลบประวัติการสนทนาของผู้ใช้ (ทั้ง Chat และ Answer)
     """
     try:
-        chats = db.query(Chat).filter(Chat.user_id == current_user.id).all()
-        if not chats:
+        user_chat_ids = select(Chat.id).where(Chat.user_id == current_user.id)
+        if (await db.execute(user_chat_ids.limit(1))).first() is None:
             return {"message": "No chat history to delete"}
 
-        chat_ids = [c.id for c in chats]
-        db.query(Answer).filter(Answer.chat_id.in_(chat_ids)).delete(synchronize_session=False)
-        db.query(Chat).filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
-        db.commit()
+        await db.run_sync(subtract_chat_rollups, Chat.user_id == current_user.id)
+        await db.execute(delete(Answer).where(Answer.chat_id.in_(user_chat_ids)))
+        await db.execute(delete(Chat).where(Chat.user_id == current_user.id))
+        await db.execute(delete(Thread).where(Thread.user_id == current_user.id))
+        await db.commit()
         return {"message": "Chat history deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting chat history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -529,28 +1155,28 @@ async def delete_chat_history(
 @router.delete("/threads/{thread_id}")
 async def delete_chat_thread(
     thread_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user = Depends(get_current_user)
 ):
     """
     ลบประวัติการสนทนาเฉพาะ thread_id ของผู้ใช้
     """
     try:
-        chats = (
-            db.query(Chat)
-            .filter(Chat.user_id == current_user.id, Chat.thread_id == thread_id)
-            .all()
+        deleted_threads = await db.execute(
+            delete(Thread).where(Thread.user_id == current_user.id, Thread.thread_id == thread_id)
         )
-        if not chats:
+        thread_chat_ids = select(Chat.id).where(Chat.user_id == current_user.id, Chat.thread_id == thread_id)
+        if not deleted_threads.rowcount and (await db.execute(thread_chat_ids.limit(1))).first() is None:
+            await db.rollback()
             return {"message": "Thread not found"}
 
-        chat_ids = [c.id for c in chats]
-        db.query(Answer).filter(Answer.chat_id.in_(chat_ids)).delete(synchronize_session=False)
-        db.query(Chat).filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
-        db.commit()
+        await db.run_sync(subtract_chat_rollups, Chat.user_id == current_user.id, Chat.thread_id == thread_id)
+        await db.execute(delete(Answer).where(Answer.chat_id.in_(thread_chat_ids)))
+        await db.execute(delete(Chat).where(Chat.user_id == current_user.id, Chat.thread_id == thread_id))
+        await db.commit()
         return {"message": "Thread deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting chat thread: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -559,7 +1185,7 @@ async def delete_chat_thread(
 async def get_chat_analytics(
     db: Session = Depends(get_db),
     days: Optional[int] = Query(default=None, ge=1, le=365),
-    current_user: User = Depends(require_roles(["admin"]))
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
 ):
     """
     Dashboard analytics สำหรับแอดมิน:
@@ -567,99 +1193,16 @@ async def get_chat_analytics(
     - ช่วงเวลาที่มีการใช้งานสูงสุด
     - รองรับ filter ตามจำนวนวันย้อนหลังด้วย query param `days`
     """
-    try:
-        chats_query = db.query(Chat)
-        if days is not None:
-            cutoff = datetime.utcnow() - timedelta(days=days)
-            chats_query = chats_query.filter(Chat.created_at >= cutoff)
-
-        chats = chats_query.order_by(Chat.created_at.asc()).all()
-        daily_window_days = days if days is not None else 30
+    def compute() -> Dict[str, object]:
+        if ANALYTICS_USE_ROLLUPS:
+            # This worker's buffered counts are written first; other workers lag by at most one flush interval.
+            chat_rollups.flush()
+            return compute_rollup_analytics(db, days)
+        return compute_chat_analytics(db, days)
 
-        if not chats:
-            return {
-                "total_questions": 0,
-                "unique_users": 0,
-                "top_questions": [],
-                "hourly_usage": [{"hour": h, "count": 0} for h in range(24)],
-                "daily_usage": [],
-                "weekday_usage": [
-                    {"day": day, "count": 0}
-                    for day in ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-                ],
-                "peak_hour": {"hour": 0, "count": 0, "label": "00:00 - 00:59"},
-                "peak_day": {"date": None, "count": 0},
-                "generated_at": datetime.utcnow().isoformat(),
-                "applied_range_days": days
-            }
-
-        question_counter: Counter[str] = Counter()
-        hour_counter: Counter[int] = Counter()
-        day_counter: Counter[str] = Counter()
-        weekday_counter: Counter[int] = Counter()
-        distinct_users = set()
-
-        for chat in chats:
-            normalized = normalize_question_text(chat.message)
-            if normalized:
-                question_counter[normalized] += 1
-
-            if chat.created_at:
-                hour_counter[chat.created_at.hour] += 1
-                day_counter[chat.created_at.date().isoformat()] += 1
-                weekday_counter[chat.created_at.weekday()] += 1
-
-            if chat.user_id is not None:
-                distinct_users.add(chat.user_id)
-
-        top_questions = [
-            {"question": question, "count": count}
-            for question, count in question_counter.most_common(10)
-        ]
-
-        hourly_usage = [
-            {"hour": hour, "count": hour_counter.get(hour, 0)}
-            for hour in range(24)
-        ]
-
-        today = datetime.utcnow().date()
-        daily_usage = []
-        for offset in range(daily_window_days - 1, -1, -1):
-            date_value = today - timedelta(days=offset)
-            date_key = date_value.isoformat()
-            daily_usage.append({
-                "date": date_key,
-                "count": day_counter.get(date_key, 0)
-            })
-
-        weekday_labels = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        weekday_usage = [
-            {"day": weekday_labels[idx], "count": weekday_counter.get(idx, 0)}
-            for idx in range(7)
-        ]
-
-        peak_hour, peak_hour_count = max(hour_counter.items(), key=lambda item: item[1], default=(0, 0))
-        peak_day, peak_day_count = max(day_counter.items(), key=lambda item: item[1], default=(None, 0))
-
-        return {
-            "total_questions": len(chats),
-            "unique_users": len(distinct_users),
-            "top_questions": top_questions,
-            "hourly_usage": hourly_usage,
-            "daily_usage": daily_usage,
-            "weekday_usage": weekday_usage,
-            "peak_hour": {
-                "hour": peak_hour,
-                "count": peak_hour_count,
-                "label": f"{peak_hour:02d}:00 - {peak_hour:02d}:59"
-            },
-            "peak_day": {
-                "date": peak_day,
-                "count": peak_day_count
-            },
-            "generated_at": datetime.utcnow().isoformat(),
-            "applied_range_days": days
-        }
+    try:
+        # Sync Session queries: keep them off the event loop.
+        return await asyncio.get_running_loop().run_in_executor(None, compute)
     except Exception as e:
         logger.error(f"Error getting chat analytics: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -667,77 +1210,59 @@ async def get_chat_analytics(
 
 @router.get("/analytics/export-csv")
 async def export_chat_logs_csv(
-    db: Session = Depends(get_db),
     days: Optional[int] = Query(default=None, ge=1, le=365),
-    current_user: User = Depends(require_roles(["admin"]))
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
 ):
     """
     Export คำถาม-คำตอบของผู้ใช้ทั้งหมด (ที่บันทึกในระบบ) เป็น CSV
     รองรับ filter ช่วงวันย้อนหลังด้วย query param `days`
     """
-    try:
-        def normalize_text(value: Optional[str]) -> str:
-            if not value:
-                return ""
-            cleaned = re.sub(r"[\r\n\t]+", " ", value)
-            cleaned = re.sub(r"\s{2,}", " ", cleaned).strip()
-            return cleaned
-
-        def safe_csv_cell(value: Optional[str]) -> str:
-            text = normalize_text(value)
-            if text.startswith(("=", "+", "-", "@")):
-                return f"'{text}"
-            return text
-
-        query = (
-            db.query(Chat, User, Answer)
-            .outerjoin(User, Chat.user_id == User.id)
-            .outerjoin(Answer, Answer.chat_id == Chat.id)
-        )
+    cutoff = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    generated = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    filename = f"chat_logs_{generated}.csv"
+
+    return StreamingResponse(
+        iter_chat_logs_csv(cutoff),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
-        if days is not None:
-            cutoff = datetime.utcnow() - timedelta(days=days)
-            query = query.filter(Chat.created_at >= cutoff)
-
-        rows = query.order_by(Chat.created_at.desc(), Answer.created_at.asc()).all()
-
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        writer.writerow([
-            "user_id",
-            "user_name",
-            "user_email",
-            "question",
-            "answer"
-        ])
-
-        def to_utc_iso(value: Optional[datetime]) -> str:
-            if not value:
-                return ""
-            return value.replace(microsecond=0).isoformat() + "Z"
-
-        for chat, user, answer in rows:
-            writer.writerow([
-                chat.user_id or "",
-                safe_csv_cell(user.name if user else ""),
-                safe_csv_cell(user.email if user else ""),
-                safe_csv_cell(chat.message),
-                safe_csv_cell(answer.answer if answer else "")
-            ])
-
-        # Prefix UTF-8 BOM so Excel on Windows detects Thai text correctly.
-        content = "\ufeff" + output.getvalue()
-        output.close()
-
-        generated = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        filename = f"chat_logs_{generated}.csv"
-
-        return StreamingResponse(
-            iter([content]),
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-    except Exception as e:
-        logger.error(f"Error exporting chat logs csv: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+
+@router.get("/analytics/export-ndjson")
+async def export_chat_logs_ndjson(
+    days: Optional[int] = Query(default=None, ge=1, le=365),
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
+):
+    """
+    Export chat logs เป็น NDJSON บีบอัด gzip (1 บรรทัดต่อ 1 คู่คำถาม-คำตอบ)
+    มี thread_id, เวลาถาม/ตอบ และ llm_provider ครบ เหมาะกับ notebook (pandas.read_json(..., lines=True))
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    generated = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    filename = f"chat_logs_{generated}.ndjson.gz"
+
+    return StreamingResponse(
+        iter_chat_logs_ndjson_gzip(cutoff),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+@router.get("/analytics/export-parquet")
+async def export_chat_logs_parquet(
+    days: Optional[int] = Query(default=None, ge=1, le=365),
+    current_user: UserPrincipal = Depends(require_roles(["admin"]))
+):
+    """
+    Export chat logs เป็นไฟล์ Parquet (columnar, timestamp มี type จริง)
+    ส่งออกทีละ row group เพื่อไม่ต้องเก็บข้อมูลทั้งหมดไว้ใน memory
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days) if days is not None else None
+    generated = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    filename = f"chat_logs_{generated}.parquet"
+
+    return StreamingResponse(
+        iter_chat_logs_parquet(cutoff),
+        media_type="application/vnd.apache.parquet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
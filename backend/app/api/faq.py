@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from app.models.models import FAQ
-from app.models.database import get_db, SessionLocal
+from app.models.database import get_db, get_async_db, SessionLocal
 from pydantic import BaseModel
 from typing import Optional
 from app.api.auth import require_roles
+from app.config import FAQ_INDEX_REFRESH_SECONDS
+from app.services.faq_matcher import faq_matcher
 import logging
+import time
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -78,6 +83,66 @@ def seed_sample_faqs() -> None:
     finally:
         db.close()
 
+_faq_index_checked_at = 0.0
+
+
+def _faq_index_signature(db: Session):
+    count, last_updated = db.query(func.count(FAQ.id), func.max(FAQ.updated_at)).one()
+    return (count, last_updated.isoformat() if last_updated else None)
+
+
+def load_faq_index() -> None:
+    """โหลด FAQ ที่ active ทั้งหมดเข้า faq_matcher"""
+    global _faq_index_checked_at
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(FAQ.id, FAQ.question, FAQ.answer, FAQ.category)
+            .filter(FAQ.is_active == True)
+            .all()
+        )
+        faq_matcher.rebuild(
+            [(row.id, row.question, row.answer, row.category) for row in rows],
+            signature=_faq_index_signature(db),
+        )
+        _faq_index_checked_at = time.monotonic()
+    finally:
+        db.close()
+
+
+def faq_index_refresh_due() -> bool:
+    """Cheap in-memory check, safe on the event loop; refresh_faq_index_if_stale does the DB work."""
+    return time.monotonic() - _faq_index_checked_at >= FAQ_INDEX_REFRESH_SECONDS
+
+
+def refresh_faq_index_if_stale() -> None:
+    """
+    ตรวจสอบว่า FAQ ในฐานข้อมูลเปลี่ยนไปหรือไม่ (เช่นถูกแก้ไขผ่าน worker อื่น)
+    ทำอย่างมากหนึ่งครั้งต่อ FAQ_INDEX_REFRESH_SECONDS
+    """
+    global _faq_index_checked_at
+    now = time.monotonic()
+    if now - _faq_index_checked_at < FAQ_INDEX_REFRESH_SECONDS:
+        return
+    _faq_index_checked_at = now
+
+    db = SessionLocal()
+    try:
+        signature = _faq_index_signature(db)
+    finally:
+        db.close()
+    if signature != faq_matcher.signature:
+        load_faq_index()
+
+
+def _sync_faq_index(faq: FAQ, db: Session) -> None:
+    if faq.is_active:
+        faq_matcher.upsert(faq.id, faq.question, faq.answer, faq.category)
+    else:
+        faq_matcher.remove(faq.id)
+    faq_matcher.signature = _faq_index_signature(db)
+
+
 class FAQCreate(BaseModel):
     question: str
     answer: str
@@ -96,17 +161,17 @@ class FAQUpdate(BaseModel):
 @router.get("/")
 async def get_all_faqs(
     active: Optional[bool] = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    query = db.query(FAQ)
+    query = select(FAQ)
     if active is not None:
-        query = query.filter(FAQ.is_active == active)
-    faqs = query.order_by(FAQ.display_order.asc(), FAQ.created_at.asc()).all()
-    return faqs
+        query = query.where(FAQ.is_active == active)
+    result = await db.execute(query.order_by(FAQ.display_order.asc(), FAQ.created_at.asc()))
+    return result.scalars().all()
 
 @router.get("/{faq_id}")
-async def get_faq(faq_id: int, db: Session = Depends(get_db)):
-    faq = db.query(FAQ).filter(FAQ.id == faq_id).first()
+async def get_faq(faq_id: int, db: AsyncSession = Depends(get_async_db)):
+    faq = await db.get(FAQ, faq_id)
     if not faq:
         raise HTTPException(status_code=404, detail="FAQ not found")
     return faq
@@ -128,6 +193,7 @@ async def create_faq(
     db.add(new_faq)
     db.commit()
     db.refresh(new_faq)
+    _sync_faq_index(new_faq, db)
     return new_faq
 
 
@@ -155,6 +221,7 @@ async def update_faq(
 
     db.commit()
     db.refresh(faq)
+    _sync_faq_index(faq, db)
     return faq
 
 @router.delete("/{faq_id}")
@@ -168,4 +235,6 @@ async def delete_faq(
         raise HTTPException(status_code=404, detail="FAQ not found")
     db.delete(faq)
     db.commit()
+    faq_matcher.remove(faq_id)
+    faq_matcher.signature = _faq_index_signature(db)
     return {"message": "FAQ deleted"}
\ No newline at end of file
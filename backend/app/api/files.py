@@ -1,8 +1,14 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
-from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Query
+from typing import List, Optional
 import os
+import aiofiles
 from dotenv import load_dotenv
-from app.services.pdf_processor import process_pdf
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.database import get_async_db
+from app.models.models import DocumentJob, File as StoredFile
+from app.services.document_ingest import TRAINING_CATEGORIES, register_uploaded_file
+from app.services.document_jobs import enqueue_document_job, job_progress, document_job_worker
 from app.api.auth import require_roles
 
 load_dotenv() 
@@ -12,15 +18,11 @@ router = APIRouter()
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-TRAINING_CATEGORIES = {
-    "curriculum": "หลักสูตร",
-    "regulation": "ระเบียบ",
-    "course_structure": "โครงสร้างรายวิชา",
-}
-
 for folder_name in TRAINING_CATEGORIES.values():
     os.makedirs(os.path.join(UPLOAD_DIR, folder_name), exist_ok=True)
 
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
 
 @router.get("/categories")
 async def get_categories(current_user=Depends(require_roles(["admin"]))):
@@ -35,6 +37,7 @@ async def get_categories(current_user=Depends(require_roles(["admin"]))):
 async def upload_files(
     category: str = Form(...),
     files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db),
     current_user=Depends(require_roles(["admin"])),
 ):
     if category not in TRAINING_CATEGORIES:
@@ -47,23 +50,69 @@ async def upload_files(
     target_dir = os.path.join(UPLOAD_DIR, category_folder)
     os.makedirs(target_dir, exist_ok=True)
 
-    file_paths = []
-    for upload in files:
-        if upload.content_type != "application/pdf":
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    if any(upload.content_type != "application/pdf" for upload in files):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
+    jobs = []
+    for upload in files:
         filename = os.path.basename(upload.filename)
         file_location = os.path.join(target_dir, filename)
-        with open(file_location, "wb") as file_object:
-            file_object.write(await upload.read())
-        file_paths.append(file_location)
-
-    # Process the uploaded PDF files
-    for file_path in file_paths:
-        process_pdf(file_path)
+        async with aiofiles.open(file_location, "wb") as file_object:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                await file_object.write(chunk)
+        stored = await register_uploaded_file(db, file_location, current_user.id)
+        job = await enqueue_document_job(db, stored.id)
+        jobs.append({"job_id": job.id, "file_id": stored.id, "filename": filename})
+    # Text extraction is queued; the worker starts once this commits and the response doesn't wait for it.
+    await db.commit()
 
     return {
         "category": category,
         "category_label": category_folder,
-        "filenames": [f.filename for f in files]
-    }
\ No newline at end of file
+        "filenames": [f.filename for f in files],
+        "jobs": jobs,
+    }
+
+
+@router.get("/jobs")
+async def list_document_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(require_roles(["admin"])),
+):
+    """รายการงานประมวลผลเอกสารล่าสุด พร้อมความคืบหน้าเป็นรายหน้า (filter ด้วย `status` ได้)"""
+    query = select(DocumentJob, StoredFile.filename).join(StoredFile, StoredFile.id == DocumentJob.file_id)
+    if status:
+        query = query.where(DocumentJob.status == status)
+    rows = (await db.execute(query.order_by(DocumentJob.id.desc()).limit(limit))).all()
+    return {"jobs": [{**job_progress(job), "filename": filename} for job, filename in rows]}
+
+
+@router.get("/jobs/stats")
+async def get_document_job_stats(
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(require_roles(["admin"])),
+):
+    """สถานะคิวงานประมวลผลเอกสาร"""
+    return await document_job_worker.stats(db)
+
+
+@router.get("/jobs/{job_id}")
+async def get_document_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(require_roles(["admin"])),
+):
+    """สถานะและความคืบหน้า (จำนวนหน้าที่ประมวลผลแล้ว) ของงานเดียว"""
+    row = (
+        await db.execute(
+            select(DocumentJob, StoredFile.filename)
+            .join(StoredFile, StoredFile.id == DocumentJob.file_id)
+            .where(DocumentJob.id == job_id)
+        )
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job, filename = row
+    return {**job_progress(job), "filename": filename}
\ No newline at end of file
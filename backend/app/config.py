@@ -5,8 +5,21 @@ from pydantic_settings import BaseSettings
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/chatcpe")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")  # empty = DATABASE_URL with the asyncpg/aiosqlite driver
+# Applied to both the sync and the async engine, so one process holds up to 2 * (size + overflow) connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))  # -1 disables recycling
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # postgres only; 0 disables
 SECRET_KEY = os.getenv("SECRET_KEY", "change_this_to_a_secure_random_value")
 DEBUG = os.getenv("DEBUG", "True").lower() in ("1", "true", "yes")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING")  # per-module overrides, e.g. "app.api.chat=DEBUG,httpx=WARNING"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
 MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50"))
@@ -17,6 +30,34 @@ RAG_REQUEST_TIMEOUT_SECONDS = int(os.getenv("RAG_REQUEST_TIMEOUT_SECONDS", "45")
 RAG_MAX_RETRIES = int(os.getenv("RAG_MAX_RETRIES", "3"))
 RAG_RETRY_DELAY_SECONDS = float(os.getenv("RAG_RETRY_DELAY_SECONDS", "1.5"))
 RAG_MAX_TOTAL_WAIT_SECONDS = float(os.getenv("RAG_MAX_TOTAL_WAIT_SECONDS", "300"))
+RAG_POOL_MAX_CONNECTIONS = int(os.getenv("RAG_POOL_MAX_CONNECTIONS", "200"))
+RAG_POOL_MAX_KEEPALIVE = int(os.getenv("RAG_POOL_MAX_KEEPALIVE", "50"))
+RAG_POOL_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("RAG_POOL_KEEPALIVE_EXPIRY_SECONDS", "30"))
+RAG_CONNECT_TIMEOUT_SECONDS = float(os.getenv("RAG_CONNECT_TIMEOUT_SECONDS", "5"))
+RAG_MAX_CONCURRENT_REQUESTS = int(os.getenv("RAG_MAX_CONCURRENT_REQUESTS", "16"))
+RAG_ADMISSION_QUEUE_SIZE = int(os.getenv("RAG_ADMISSION_QUEUE_SIZE", "200"))
+RAG_ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RAG_ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+RAG_BREAKER_FAILURE_THRESHOLD = int(os.getenv("RAG_BREAKER_FAILURE_THRESHOLD", "5"))
+RAG_BREAKER_RECOVERY_SECONDS = float(os.getenv("RAG_BREAKER_RECOVERY_SECONDS", "30"))
+RAG_BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("RAG_BREAKER_HALF_OPEN_MAX_CALLS", "1"))
+FAQ_MATCH_ENABLED = os.getenv("FAQ_MATCH_ENABLED", "True").lower() in ("1", "true", "yes")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.8"))
+FAQ_INDEX_REFRESH_SECONDS = float(os.getenv("FAQ_INDEX_REFRESH_SECONDS", "60"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() in ("1", "true", "yes")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_FUZZY_ENABLED = os.getenv("ANSWER_CACHE_FUZZY_ENABLED", "True").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.85"))
+ANSWER_CACHE_NGRAM_SIZE = int(os.getenv("ANSWER_CACHE_NGRAM_SIZE", "3"))
+ANSWER_CACHE_STAMP_FILE = os.getenv("ANSWER_CACHE_STAMP_FILE", "answer_cache.stamp")  # shared by every worker; empty = per-process only
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", "3"))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", "65536"))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", "4"))
+AUTH_PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("AUTH_PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+AUTH_PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+ANALYTICS_USE_ROLLUPS = os.getenv("ANALYTICS_USE_ROLLUPS", "True").lower() in ("1", "true", "yes")
+ANALYTICS_ROLLUP_FLUSH_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_FLUSH_SECONDS", "5"))
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8000")
 APP_BASE_URL = os.getenv("APP_BASE_URL", "http://localhost:8080")
 VERIFY_TOKEN_EXPIRE_HOURS = int(os.getenv("VERIFY_TOKEN_EXPIRE_HOURS", "24"))
@@ -25,11 +66,100 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASS = os.getenv("SMTP_PASS", "")
 SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "True").lower() in ("1", "true", "yes")
+SMTP_AUTH_ENABLED = os.getenv("SMTP_AUTH_ENABLED", "True").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "20"))
+SMTP_CONNECTION_IDLE_SECONDS = float(os.getenv("SMTP_CONNECTION_IDLE_SECONDS", "60"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_RETRY_BASE_SECONDS", "30"))
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "300"))
+
+PDF_INGEST_WORKERS = int(os.getenv("PDF_INGEST_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+PDF_OCR_ENABLED = os.getenv("PDF_OCR_ENABLED", "True").lower() in ("1", "true", "yes")
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))  # pages with less extracted text are OCR'd
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+PDF_OCR_LANG = os.getenv("PDF_OCR_LANG", "tha+eng")
+
+DOCUMENT_JOB_CONCURRENCY = int(os.getenv("DOCUMENT_JOB_CONCURRENCY", "1"))  # each job already uses every PDF worker
+DOCUMENT_JOB_POLL_SECONDS = float(os.getenv("DOCUMENT_JOB_POLL_SECONDS", "5"))
+DOCUMENT_JOB_MAX_ATTEMPTS = int(os.getenv("DOCUMENT_JOB_MAX_ATTEMPTS", "3"))
+DOCUMENT_JOB_RETRY_BASE_SECONDS = float(os.getenv("DOCUMENT_JOB_RETRY_BASE_SECONDS", "30"))
+DOCUMENT_JOB_LEASE_SECONDS = float(os.getenv("DOCUMENT_JOB_LEASE_SECONDS", "600"))  # renewed on every page batch
+
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "1000"))
+CHUNK_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP_CHARS", "200"))
+CHUNK_SECTION_MIN_CHARS = int(os.getenv("CHUNK_SECTION_MIN_CHARS", "300"))  # start a new chunk at a heading once this full
+CHUNK_INSERT_BATCH_SIZE = int(os.getenv("CHUNK_INSERT_BATCH_SIZE", "500"))
+
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")  # "float32" or "int8" (4x smaller, ~1% recall loss)
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")  # shared by every worker on the host
+VECTOR_INDEX_EMBEDDING_API = os.getenv("VECTOR_INDEX_EMBEDDING_API", "")  # empty = every embedding_api
+VECTOR_INDEX_REFRESH_SECONDS = float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "30"))
+VECTOR_INDEX_BUILD_BATCH_SIZE = int(os.getenv("VECTOR_INDEX_BUILD_BATCH_SIZE", "5000"))
+
+LOCAL_RETRIEVAL_ENABLED = os.getenv("LOCAL_RETRIEVAL_ENABLED", "True").lower() in ("1", "true", "yes")
+LOCAL_RETRIEVAL_PRERETRIEVE = os.getenv("LOCAL_RETRIEVAL_PRERETRIEVE", "False").lower() in ("1", "true", "yes")  # send passages to RAG as "contexts"
+LOCAL_RETRIEVAL_FALLBACK = os.getenv("LOCAL_RETRIEVAL_FALLBACK", "True").lower() in ("1", "true", "yes")  # answer with passages when RAG is down
+LOCAL_RETRIEVAL_TOP_K = int(os.getenv("LOCAL_RETRIEVAL_TOP_K", "5"))
+LOCAL_RETRIEVAL_CANDIDATES = int(os.getenv("LOCAL_RETRIEVAL_CANDIDATES", "50"))  # depth of each ranked list fed to RRF
+LOCAL_RETRIEVAL_RRF_K = int(os.getenv("LOCAL_RETRIEVAL_RRF_K", "60"))
+LOCAL_RETRIEVAL_REFRESH_SECONDS = float(os.getenv("LOCAL_RETRIEVAL_REFRESH_SECONDS", "60"))
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")  # query embeddings; empty = BM25 only
+EMBEDDING_SERVICE_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT_SECONDS", "5"))
+EMBEDDING_POOL_MAX_CONNECTIONS = int(os.getenv("EMBEDDING_POOL_MAX_CONNECTIONS", "20"))  # separate from the RAG pool
+EMBEDDING_POOL_MAX_KEEPALIVE = int(os.getenv("EMBEDDING_POOL_MAX_KEEPALIVE", "10"))
 
 class Settings(BaseSettings):
     database_url: str = DATABASE_URL
+    async_database_url: str = ASYNC_DATABASE_URL
+    db_pool_size: int = DB_POOL_SIZE
+    db_max_overflow: int = DB_MAX_OVERFLOW
+    db_pool_timeout_seconds: float = DB_POOL_TIMEOUT_SECONDS
+    db_pool_pre_ping: bool = DB_POOL_PRE_PING
+    db_pool_recycle_seconds: int = DB_POOL_RECYCLE_SECONDS
+    db_statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS
+    pdf_ingest_workers: int = PDF_INGEST_WORKERS
+    pdf_pages_per_task: int = PDF_PAGES_PER_TASK
+    pdf_ocr_enabled: bool = PDF_OCR_ENABLED
+    pdf_ocr_min_chars: int = PDF_OCR_MIN_CHARS
+    pdf_ocr_dpi: int = PDF_OCR_DPI
+    pdf_ocr_lang: str = PDF_OCR_LANG
+    document_job_concurrency: int = DOCUMENT_JOB_CONCURRENCY
+    document_job_poll_seconds: float = DOCUMENT_JOB_POLL_SECONDS
+    document_job_max_attempts: int = DOCUMENT_JOB_MAX_ATTEMPTS
+    document_job_retry_base_seconds: float = DOCUMENT_JOB_RETRY_BASE_SECONDS
+    document_job_lease_seconds: float = DOCUMENT_JOB_LEASE_SECONDS
+    chunk_max_chars: int = CHUNK_MAX_CHARS
+    chunk_overlap_chars: int = CHUNK_OVERLAP_CHARS
+    chunk_section_min_chars: int = CHUNK_SECTION_MIN_CHARS
+    chunk_insert_batch_size: int = CHUNK_INSERT_BATCH_SIZE
+    embedding_storage_dtype: str = EMBEDDING_STORAGE_DTYPE
+    vector_index_dir: str = VECTOR_INDEX_DIR
+    vector_index_embedding_api: str = VECTOR_INDEX_EMBEDDING_API
+    vector_index_refresh_seconds: float = VECTOR_INDEX_REFRESH_SECONDS
+    vector_index_build_batch_size: int = VECTOR_INDEX_BUILD_BATCH_SIZE
+    local_retrieval_enabled: bool = LOCAL_RETRIEVAL_ENABLED
+    local_retrieval_preretrieve: bool = LOCAL_RETRIEVAL_PRERETRIEVE
+    local_retrieval_fallback: bool = LOCAL_RETRIEVAL_FALLBACK
+    local_retrieval_top_k: int = LOCAL_RETRIEVAL_TOP_K
+    local_retrieval_candidates: int = LOCAL_RETRIEVAL_CANDIDATES
+    local_retrieval_rrf_k: int = LOCAL_RETRIEVAL_RRF_K
+    local_retrieval_refresh_seconds: float = LOCAL_RETRIEVAL_REFRESH_SECONDS
+    embedding_service_url: str = EMBEDDING_SERVICE_URL
+    embedding_service_timeout_seconds: float = EMBEDDING_SERVICE_TIMEOUT_SECONDS
+    embedding_pool_max_connections: int = EMBEDDING_POOL_MAX_CONNECTIONS
+    embedding_pool_max_keepalive: int = EMBEDDING_POOL_MAX_KEEPALIVE
     secret_key: str = SECRET_KEY
     debug: bool = DEBUG
+    log_level: str = LOG_LEVEL
+    log_levels: str = LOG_LEVELS
+    log_format: str = LOG_FORMAT
+    log_queue_size: int = LOG_QUEUE_SIZE
+    log_debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE
     access_token_expire_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES
     upload_dir: str = UPLOAD_DIR
     max_upload_size_mb: int = MAX_UPLOAD_SIZE_MB
@@ -40,6 +170,34 @@ class Settings(BaseSettings):
     rag_max_retries: int = RAG_MAX_RETRIES
     rag_retry_delay_seconds: float = RAG_RETRY_DELAY_SECONDS
     rag_max_total_wait_seconds: float = RAG_MAX_TOTAL_WAIT_SECONDS
+    rag_pool_max_connections: int = RAG_POOL_MAX_CONNECTIONS
+    rag_pool_max_keepalive: int = RAG_POOL_MAX_KEEPALIVE
+    rag_pool_keepalive_expiry_seconds: float = RAG_POOL_KEEPALIVE_EXPIRY_SECONDS
+    rag_connect_timeout_seconds: float = RAG_CONNECT_TIMEOUT_SECONDS
+    rag_max_concurrent_requests: int = RAG_MAX_CONCURRENT_REQUESTS
+    rag_admission_queue_size: int = RAG_ADMISSION_QUEUE_SIZE
+    rag_admission_queue_timeout_seconds: float = RAG_ADMISSION_QUEUE_TIMEOUT_SECONDS
+    rag_breaker_failure_threshold: int = RAG_BREAKER_FAILURE_THRESHOLD
+    rag_breaker_recovery_seconds: float = RAG_BREAKER_RECOVERY_SECONDS
+    rag_breaker_half_open_max_calls: int = RAG_BREAKER_HALF_OPEN_MAX_CALLS
+    faq_match_enabled: bool = FAQ_MATCH_ENABLED
+    faq_match_threshold: float = FAQ_MATCH_THRESHOLD
+    faq_index_refresh_seconds: float = FAQ_INDEX_REFRESH_SECONDS
+    answer_cache_enabled: bool = ANSWER_CACHE_ENABLED
+    answer_cache_max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    answer_cache_ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS
+    answer_cache_fuzzy_enabled: bool = ANSWER_CACHE_FUZZY_ENABLED
+    answer_cache_similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD
+    answer_cache_ngram_size: int = ANSWER_CACHE_NGRAM_SIZE
+    answer_cache_stamp_file: str = ANSWER_CACHE_STAMP_FILE
+    password_hash_workers: int = PASSWORD_HASH_WORKERS
+    password_argon2_time_cost: int = PASSWORD_ARGON2_TIME_COST
+    password_argon2_memory_cost: int = PASSWORD_ARGON2_MEMORY_COST
+    password_argon2_parallelism: int = PASSWORD_ARGON2_PARALLELISM
+    auth_principal_cache_ttl_seconds: float = AUTH_PRINCIPAL_CACHE_TTL_SECONDS
+    auth_principal_cache_max_entries: int = AUTH_PRINCIPAL_CACHE_MAX_ENTRIES
+    analytics_use_rollups: bool = ANALYTICS_USE_ROLLUPS
+    analytics_rollup_flush_seconds: float = ANALYTICS_ROLLUP_FLUSH_SECONDS
     backend_base_url: str = BACKEND_BASE_URL
     app_base_url: str = APP_BASE_URL
     verify_token_expire_hours: int = VERIFY_TOKEN_EXPIRE_HOURS
@@ -48,6 +206,16 @@ class Settings(BaseSettings):
     smtp_user: str = SMTP_USER
     smtp_pass: str = SMTP_PASS
     smtp_from: str = SMTP_FROM
+    smtp_starttls: bool = SMTP_STARTTLS
+    smtp_auth_enabled: bool = SMTP_AUTH_ENABLED
+    smtp_timeout_seconds: float = SMTP_TIMEOUT_SECONDS
+    smtp_connection_idle_seconds: float = SMTP_CONNECTION_IDLE_SECONDS
+    smtp_max_messages_per_connection: int = SMTP_MAX_MESSAGES_PER_CONNECTION
+    email_outbox_batch_size: int = EMAIL_OUTBOX_BATCH_SIZE
+    email_outbox_poll_seconds: float = EMAIL_OUTBOX_POLL_SECONDS
+    email_outbox_max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS
+    email_outbox_retry_base_seconds: float = EMAIL_OUTBOX_RETRY_BASE_SECONDS
+    email_outbox_lease_seconds: float = EMAIL_OUTBOX_LEASE_SECONDS
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,154 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE_RATE
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field.
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample_rate"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["DroppingQueueHandler"] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, object]:
+    return {
+        key: value
+        for key, value in record.__dict__.items()
+        if key not in _RESERVED_ATTRS and not key.startswith("_")
+    }
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text line with any `extra=` fields appended as key=value."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = _extra_fields(record)
+        if not fields:
+            return line
+        # Quote string values that contain spaces so the pairs stay splittable.
+        pairs = [
+            f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}"
+            for key, value in fields.items()
+        ]
+        # The queue handler has already folded any traceback into the message; keep fields on the first line.
+        head, newline, rest = line.partition("\n")
+        return f"{head} {' '.join(pairs)}{newline}{rest}"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg plus any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records (or any record logged with extra={"sample_rate": r}).
+    Applied before the record is queued, so dropped events cost one random() call.
+    """
+
+    def __init__(self, debug_rate: float):
+        super().__init__()
+        self.debug_rate = debug_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            if record.levelno > logging.DEBUG:
+                return True
+            rate = self.debug_rate
+        return rate >= 1 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_log_levels(spec: str) -> Dict[str, int]:
+    """Parse "app.api.chat=WARNING,httpx=WARNING" into {logger name: level}."""
+    levels: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        name, sep, level = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+
+def configure_logging() -> None:
+    """
+    Route all logging through a bounded queue drained by a background thread,
+    so request handlers never block on stderr.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE)))
+    _queue_handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root_level = logging.getLevelName(LOG_LEVEL.upper())
+    root.setLevel(root_level if isinstance(root_level, int) else logging.INFO)
+    for name, level in parse_log_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict[str, object]:
+    return {
+        "queue_size": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "queue_max": LOG_QUEUE_SIZE,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "debug_sample_rate": LOG_DEBUG_SAMPLE_RATE,
+    }
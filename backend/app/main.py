@@ -5,26 +5,60 @@ import logging
 import os
 from app.api import auth, chat, files, faq, documents
 from app.config import DATABASE_URL, UPLOAD_DIR
-from app.models.database import Base, engine
-from app.api.faq import seed_sample_faqs
+from app.models.database import engine, dispose_async_engine
+from app.models.migrations import run_migrations
+from app.api.faq import seed_sample_faqs, load_faq_index
+from app.services.rag_client import open_rag_client, close_rag_client, close_embedding_client
+from app.services.email_outbox import email_outbox_worker
+from app.services.document_jobs import document_job_worker
+from app.services.chat_analytics import chat_rollups
+from app.services.password_hasher import password_hasher
+from app.services.pdf_processor import pdf_extractor
+from app.services.local_retrieval import local_index_refresher
+from app.logging_config import configure_logging
 
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     logger.info(f"Database tables created successfully!")
-    
+
     # Create sample FAQs if not already exist
     seed_sample_faqs()
+    load_faq_index()
+
+    # Shared connection pool to the RAG service
+    await open_rag_client()
+
+    # Background sender for queued emails
+    email_outbox_worker.start()
+
+    # Background text extraction for uploaded documents
+    document_job_worker.start()
+
+    # Periodic writer for buffered analytics rollup increments
+    chat_rollups.start()
+
+    # Shared vector index + in-process BM25 index for local retrieval, built and refreshed in the background
+    local_index_refresher.start()
     
     yield
     # Shutdown
     logger.info("Application shutting down...")
+    await email_outbox_worker.stop()
+    await document_job_worker.stop()
+    await chat_rollups.stop()
+    await local_index_refresher.stop()
+    await close_rag_client()
+    await close_embedding_client()
+    await dispose_async_engine()
+    password_hasher.shutdown()
+    pdf_extractor.shutdown()
 
 app = FastAPI(
     title="CPE CHAT System API",
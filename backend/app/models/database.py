@@ -1,14 +1,71 @@
+from typing import AsyncIterator, Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
-from app.config import DATABASE_URL
+from app.config import DATABASE_URL, ASYNC_DATABASE_URL
+from app.services.db_pool import engine_options, sync_pool_metrics, async_pool_metrics
 
-engine = create_engine(DATABASE_URL, echo=False)
+# Sync engine: startup migrations, scripts, background workers and admin endpoints.
+engine = create_engine(DATABASE_URL, echo=False, **engine_options(DATABASE_URL, sync_pool_metrics))
+sync_pool_metrics.attach(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+_async_engine: Optional[AsyncEngine] = None
+_async_session_factory: Optional[async_sessionmaker] = None
+
+
+def async_database_url(url: str) -> str:
+    """postgresql://... -> postgresql+asyncpg://..., sqlite:///x.db -> sqlite+aiosqlite:///x.db"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    driver = _ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return parsed.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+
+def get_async_engine() -> AsyncEngine:
+    # Created on first use so scripts that only touch the sync engine don't need asyncpg installed.
+    global _async_engine, _async_session_factory
+    if _async_engine is None:
+        url = ASYNC_DATABASE_URL or async_database_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, echo=False, **engine_options(url, async_pool_metrics))
+        async_pool_metrics.attach(_async_engine.sync_engine)
+        _async_session_factory = async_sessionmaker(
+            _async_engine,
+            autoflush=False,
+            # Handlers read attributes after commit; reloading them would need another await.
+            expire_on_commit=False,
+        )
+    return _async_engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _async_session_factory()
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_session_factory = None
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,244 @@
+import fcntl
+import logging
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List, Tuple
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, inspect, null, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from app.config import EMBEDDING_STORAGE_DTYPE
+from app.models.database import Base
+from app.models.models import Answer, Chat, Embedding, OCRResult
+from app.services.chat_analytics import backfill_rollups
+from app.services.thread_summary import backfill_threads
+from app.services.thai_text import normalize_question_text
+from app.services.vector_codec import pack_vector
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key shared by every worker that runs migrations at startup
+MIGRATION_ADVISORY_LOCK_KEY = 0x63686174
+# conn.info key where Postgres migrations queue indexes to build after their transaction commits
+DEFERRED_INDEXES_KEY = "deferred_indexes"
+
+# ตารางบันทึกว่า migration ใดถูกรันไปแล้ว
+_migration_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _migration_metadata,
+    Column("version", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+@contextmanager
+def _migration_lock(engine: Engine) -> Iterator[None]:
+    """Serialize startup schema changes across worker processes (and hosts, on Postgres)."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_ADVISORY_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_ADVISORY_LOCK_KEY})
+        return
+
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        # In-memory SQLite is private to this process.
+        yield
+        return
+    with open(f"{database}.migrate.lock", "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _create_model_indexes(conn: Connection, *tables) -> None:
+    if conn.dialect.name == "postgresql":
+        # Plain CREATE INDEX blocks writes to the table for the whole build; run_migrations
+        # builds these with CREATE INDEX CONCURRENTLY once the migration's transaction commits.
+        conn.info.setdefault(DEFERRED_INDEXES_KEY, []).extend(
+            index for table in tables for index in table.indexes
+        )
+        return
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _create_indexes_concurrently(engine: Engine, indexes) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in indexes:
+            # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would skip.
+            invalid = conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": index.name}).first()
+            if invalid:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+            conn.execute(text(re.sub(r"^CREATE (UNIQUE )?INDEX ", r"\g<0>CONCURRENTLY ", ddl)))
+
+
+def _0001_chat_answer_indexes(conn: Connection) -> None:
+    # create_all only creates indexes for new tables, so existing databases get them here.
+    _create_model_indexes(conn, Chat.__table__, Answer.__table__)
+
+
+def _0002_chat_normalized_message(conn: Connection) -> None:
+    columns = {column["name"] for column in inspect(conn).get_columns("chats")}
+    if "normalized_message" not in columns:
+        conn.execute(text("ALTER TABLE chats ADD COLUMN normalized_message TEXT"))
+
+    # Backfill in id order so memory stays bounded regardless of table size.
+    chats = Chat.__table__
+    last_id = 0
+    batch_size = 5000
+    fill = (
+        update(chats)
+        .where(chats.c.id == bindparam("chat_id"))
+        .values(normalized_message=bindparam("normalized"))
+    )
+    while True:
+        rows = conn.execute(
+            select(chats.c.id, chats.c.message)
+            .where(chats.c.id > last_id, chats.c.normalized_message.is_(None))
+            .order_by(chats.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        conn.execute(fill, [
+            {"chat_id": row.id, "normalized": normalize_question_text(row.message)}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def _0003_analytics_rollups(conn: Connection) -> None:
+    # Tables come from create_all; seed them from existing chats (relies on 0002's normalized_message).
+    backfill_rollups(conn)
+
+
+def _0004_ocr_result_page_number(conn: Connection) -> None:
+    columns = {column["name"] for column in inspect(conn).get_columns("ocr_results")}
+    if "page_number" not in columns:
+        conn.execute(text("ALTER TABLE ocr_results ADD COLUMN page_number INTEGER"))
+    _create_model_indexes(conn, OCRResult.__table__)
+
+
+def _0005_embedding_binary_vectors(conn: Connection) -> None:
+    embeddings = Embedding.__table__
+    columns = {column["name"]: column for column in inspect(conn).get_columns("embeddings")}
+    if conn.dialect.name == "sqlite" and not columns["vector"]["nullable"]:
+        # SQLite cannot drop NOT NULL in place: rebuild the table with the new definition.
+        for index in inspect(conn).get_indexes("embeddings"):
+            conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+        conn.execute(text("ALTER TABLE embeddings RENAME TO embeddings_old"))
+        embeddings.create(bind=conn)
+        conn.execute(text(
+            "INSERT INTO embeddings (id, chunk_id, vector, embedding_api, created_at) "
+            "SELECT id, chunk_id, vector, embedding_api, created_at FROM embeddings_old"
+        ))
+        conn.execute(text("DROP TABLE embeddings_old"))
+    else:
+        for name in ("vector_blob", "dim", "dtype", "scale"):
+            if name not in columns:
+                column_type = embeddings.c[name].type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE embeddings ADD COLUMN {name} {column_type}"))
+        if not columns["vector"]["nullable"]:
+            conn.execute(text("ALTER TABLE embeddings ALTER COLUMN vector DROP NOT NULL"))
+    _create_model_indexes(conn, embeddings)
+
+    # Pack the JSON arrays in id order and clear them; the JSON copy is several times larger.
+    last_id = 0
+    batch_size = 2000
+    fill = (
+        update(embeddings)
+        .where(embeddings.c.id == bindparam("embedding_id"))
+        .values(
+            vector_blob=bindparam("blob"),
+            dim=bindparam("vector_dim"),
+            dtype=bindparam("vector_dtype"),
+            scale=bindparam("vector_scale"),
+            vector=null(),
+        )
+    )
+    while True:
+        rows = conn.execute(
+            select(embeddings.c.id, embeddings.c.vector)
+            .where(embeddings.c.id > last_id, embeddings.c.vector_blob.is_(None))
+            .order_by(embeddings.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            if not row.vector:
+                continue
+            blob, scale = pack_vector(row.vector, EMBEDDING_STORAGE_DTYPE)
+            params.append({
+                "embedding_id": row.id,
+                "blob": blob,
+                "vector_dim": len(row.vector),
+                "vector_dtype": EMBEDDING_STORAGE_DTYPE,
+                "vector_scale": scale,
+            })
+        if params:
+            conn.execute(fill, params)
+        last_id = rows[-1].id
+
+
+def _0006_thread_summaries(conn: Connection) -> None:
+    # Runs under the migration lock, so workers starting together cannot insert the same threads twice.
+    backfill_threads(conn)
+
+
+# (version, upgrade function) in the order they must run
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_chat_answer_indexes", _0001_chat_answer_indexes),
+    ("0002_chat_normalized_message", _0002_chat_normalized_message),
+    ("0003_analytics_rollups", _0003_analytics_rollups),
+    ("0004_ocr_result_page_number", _0004_ocr_result_page_number),
+    ("0005_embedding_binary_vectors", _0005_embedding_binary_vectors),
+    ("0006_thread_summaries", _0006_thread_summaries),
+]
+
+
+def run_migrations(engine: Engine) -> List[str]:
+    """
+    Create missing tables, then apply pending schema migrations.
+    Holds a cross-process lock throughout, so workers starting together run each migration once.
+    Each migration runs in its own transaction and is recorded in schema_migrations; on Postgres
+    its indexes are built concurrently before it is recorded (every migration here is re-runnable).
+    """
+    with _migration_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        _migration_metadata.create_all(bind=engine)
+        with engine.connect() as conn:
+            applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+        newly_applied = []
+        for version, upgrade in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info("Applying migration %s", version)
+            with engine.begin() as conn:
+                conn.info[DEFERRED_INDEXES_KEY] = []
+                upgrade(conn)
+                deferred_indexes = conn.info.pop(DEFERRED_INDEXES_KEY, [])
+                if not deferred_indexes:
+                    conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+            if deferred_indexes:
+                _create_indexes_concurrently(engine, deferred_indexes)
+                with engine.begin() as conn:
+                    conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+            newly_applied.append(version)
+        return newly_applied
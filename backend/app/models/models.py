@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Float, ForeignKey, Boolean, JSON, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.models.database import Base
@@ -22,6 +22,7 @@ class User(Base):
     # Relationships
     files = relationship("File", back_populates="user", cascade="all, delete-orphan")
     chats = relationship("Chat", back_populates="user", cascade="all, delete-orphan")
+    threads = relationship("Thread", back_populates="user", cascade="all, delete-orphan")
 
 # ตารางเก็บไฟล์ PDF
 class File(Base):
@@ -41,10 +42,15 @@ class File(Base):
 # ตารางผลลัพธ์ OCR
 class OCRResult(Base):
     __tablename__ = "ocr_results"
+    __table_args__ = (
+        # โหลดผลลัพธ์ของไฟล์เรียงตามหน้า
+        Index("ix_ocr_results_file_page", "file_id", "page_number"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(Integer, ForeignKey("files.id"), nullable=False)
     engine = Column(String, nullable=False)  # OCR engine ที่ใช้
+    page_number = Column(Integer, nullable=True)  # หน้าใน PDF (เริ่มที่ 1)
     text = Column(Text, nullable=False)
     processed_at = Column(DateTime, default=datetime.utcnow)
     
@@ -69,10 +75,19 @@ class Chunk(Base):
 # ตารางเก็บ Vector Embeddings
 class Embedding(Base):
     __tablename__ = "embeddings"
+    __table_args__ = (
+        # vector index อ่านแถวใหม่ต่อจาก id ล่าสุดของแต่ละ embedding_api
+        Index("ix_embeddings_api_id", "embedding_api", "id"),
+        Index("ix_embeddings_chunk", "chunk_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     chunk_id = Column(Integer, ForeignKey("chunks.id"), nullable=False)
-    vector = Column(JSON, nullable=False)  # เก็บ vector เป็น JSON array
+    vector = Column(JSON, nullable=True)  # รูปแบบเดิม (JSON array) ย้ายไป vector_blob แล้วใน migration 0005
+    vector_blob = Column(LargeBinary, nullable=True)  # vector แบบ packed little-endian (float32 หรือ int8)
+    dim = Column(Integer, nullable=True)  # จำนวนมิติของ vector
+    dtype = Column(String, nullable=True)  # "float32" | "int8"
+    scale = Column(Float, nullable=True)  # int8: ค่าจริง = ค่าที่เก็บ * scale
     embedding_api = Column(String, nullable=False)  # API ที่ใช้สร้าง embedding
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -82,11 +97,20 @@ class Embedding(Base):
 # ตารางแชท
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        # history / thread messages / thread delete
+        Index("ix_chats_user_thread_created", "user_id", "thread_id", "created_at"),
+        # last-active per user (/auth/users)
+        Index("ix_chats_user_created", "user_id", "created_at"),
+        # analytics cutoff and CSV export
+        Index("ix_chats_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     thread_id = Column(String, nullable=False)  # เพื่อจัดกลุ่มข้อความเป็น threads
     message = Column(Text, nullable=False)
+    normalized_message = Column(Text, nullable=True)  # คำถามที่ normalize แล้ว ใช้นับ top questions
     created_at = Column(DateTime, default=datetime.utcnow)
     context_chunk_id = Column(Integer, ForeignKey("chunks.id"), nullable=True)
     
@@ -94,9 +118,31 @@ class Chat(Base):
     user = relationship("User", back_populates="chats")
     answers = relationship("Answer", back_populates="chat", cascade="all, delete-orphan")
 
+# ตารางสรุป thread (ใช้แสดง sidebar โดยไม่ต้องคำนวณจาก chats ทุกครั้ง)
+class Thread(Base):
+    __tablename__ = "threads"
+    __table_args__ = (
+        UniqueConstraint("user_id", "thread_id", name="uq_threads_user_thread"),
+        Index("ix_threads_user_created", "user_id", "created_at", "thread_id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    thread_id = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_activity_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    message_count = Column(Integer, default=0, nullable=False)  # จำนวนคำถามใน thread
+    
+    # Relationships
+    user = relationship("User", back_populates="threads")
+
 # ตารางคำตอบจาก LLM
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (
+        Index("ix_answers_chat_created", "chat_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
@@ -107,6 +153,84 @@ class Answer(Base):
     # Relationships
     chat = relationship("Chat", back_populates="answers")
 
+# ตาราง rollup จำนวนคำถามรายชั่วโมง (ใช้ทำ dashboard analytics)
+class AnalyticsHourlyUsage(Base):
+    __tablename__ = "analytics_hourly_usage"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    bucket_start = Column(DateTime, unique=True, nullable=False)  # ต้นชั่วโมง (UTC)
+    question_count = Column(Integer, default=0, nullable=False)
+
+# ตาราง rollup จำนวนครั้งที่ถามคำถาม (normalize แล้ว) ต่อวัน
+class AnalyticsDailyQuestion(Base):
+    __tablename__ = "analytics_daily_questions"
+    __table_args__ = (
+        UniqueConstraint("day", "question_hash", name="uq_analytics_daily_questions_day_hash"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    question_hash = Column(String(40), nullable=False)  # sha1 ของ question ใช้เป็น key แทน text ยาวๆ
+    question = Column(Text, nullable=False)
+    question_count = Column(Integer, default=0, nullable=False)
+
+# ตาราง rollup ผู้ใช้ที่ถามคำถามในแต่ละวัน (ใช้นับ unique users)
+class AnalyticsDailyUser(Base):
+    __tablename__ = "analytics_daily_users"
+    __table_args__ = (
+        UniqueConstraint("day", "user_id", name="uq_analytics_daily_users_day_user"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    user_id = Column(Integer, nullable=False)
+
+# ตาราง outbox สำหรับอีเมลที่รอส่ง (worker ส่งเบื้องหลัง)
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        # worker claims due rows by status + next_attempt_at
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # verification, password_reset, delete_warning
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    html_body = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+# คิวงานประมวลผลเอกสารที่อัปโหลด (ดึงข้อความ/OCR)
+class DocumentJob(Base):
+    __tablename__ = "document_jobs"
+    __table_args__ = (
+        # worker claims due rows by status + next_attempt_at
+        Index("ix_document_jobs_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_document_jobs_file", "file_id"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, default="pending", nullable=False)  # pending, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    pages_total = Column(Integer, nullable=True)
+    pages_done = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    file = relationship("File")
+
 # ตารางคำถามที่ถามบ่อย (FAQ)
 class FAQ(Base):
     __tablename__ = "faqs"
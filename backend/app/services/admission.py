@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from app.services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a call cannot be admitted (queue full or queue deadline exceeded)."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps concurrent upstream calls and keeps a bounded FIFO wait queue.
+    Callers that find the queue full, or wait longer than their deadline, get AdmissionRejected.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds = Histogram()
+        self.service_seconds = Histogram()
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self._avg_service_seconds = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop (Python 3.9 binds at construction).
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def retry_after_seconds(self) -> int:
+        # Rough time for the current backlog to drain, bounded to something a client will honour.
+        per_slot = self._avg_service_seconds or 1.0
+        backlog = (self.waiting + self.active) / float(self.max_concurrent)
+        return int(min(60, max(1, math.ceil(per_slot * backlog))))
+
+    def is_saturated(self) -> bool:
+        return self.active >= self.max_concurrent and self.waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        semaphore = self._get_semaphore()
+        self.queue_depth.observe(self.waiting)
+        enqueued_at = time.monotonic()
+
+        if not semaphore.locked():
+            await semaphore.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                logger.warning("%s admission queue full (waiting=%s)", self.name, self.waiting)
+                raise AdmissionRejected("queue_full", self.retry_after_seconds())
+
+            deadline = self.queue_timeout if timeout is None else timeout
+            self.waiting += 1
+            try:
+                if deadline is not None and deadline > 0:
+                    await asyncio.wait_for(semaphore.acquire(), timeout=deadline)
+                else:
+                    await semaphore.acquire()
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                logger.warning("%s admission wait exceeded %.1fs", self.name, deadline)
+                raise AdmissionRejected("queue_timeout", self.retry_after_seconds())
+            finally:
+                self.waiting -= 1
+
+        started_at = time.monotonic()
+        self.wait_seconds.observe(started_at - enqueued_at)
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+            elapsed = time.monotonic() - started_at
+            self.service_seconds.observe(elapsed)
+            self._avg_service_seconds = elapsed if not self._avg_service_seconds else (
+                0.8 * self._avg_service_seconds + 0.2 * elapsed
+            )
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_seconds": self.queue_timeout,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "retry_after_seconds": self.retry_after_seconds(),
+            "queue_depth": self.queue_depth.snapshot(),
+            "wait_seconds": self.wait_seconds.snapshot(),
+            "service_seconds": self.service_seconds.snapshot(),
+        }
@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+from app.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_FUZZY_ENABLED,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_NGRAM_SIZE,
+    ANSWER_CACHE_STAMP_FILE,
+)
+
+CacheKey = Tuple[str, str]
+
+# Numbers, years and course codes ("ปี 2", "2567", "gen101") change the answer but barely move the
+# n-gram similarity, so near-duplicate matches must agree on them exactly.
+ANCHOR_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+THAI_DIGITS = str.maketrans("๐๑๒๓๔๕๖๗๘๙", "0123456789")
+
+
+class _CacheEntry:
+    __slots__ = ("answer", "expires_at", "grams", "anchors")
+
+    def __init__(
+        self,
+        answer: str,
+        expires_at: float,
+        grams: Optional[FrozenSet[str]],
+        anchors: Optional[FrozenSet[str]] = None,
+    ):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.grams = grams
+        self.anchors = anchors
+
+
+def char_ngrams(text: str, size: int) -> FrozenSet[str]:
+    # Thai is written without spaces between words, so compare on characters, not tokens.
+    compact = re.sub(r"\s+", "", text or "")
+    if not compact:
+        return frozenset()
+    if len(compact) <= size:
+        return frozenset([compact])
+    return frozenset(compact[i:i + size] for i in range(len(compact) - size + 1))
+
+
+def anchor_tokens(text: str) -> FrozenSet[str]:
+    """Latin words and numbers (Thai digits folded to ASCII) that a similar question must repeat verbatim."""
+    return frozenset(ANCHOR_TOKEN_RE.findall((text or "").lower().translate(THAI_DIGITS)))
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of RAG answers keyed by normalized question and domain.
+    An optional second tier matches near-duplicate phrasings by character n-gram Jaccard similarity,
+    only among entries with exactly the same numbers and Latin tokens.
+    invalidate_all() replaces a stamp file that every worker checks on get/set, so all of them
+    drop their entries when training documents change.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: float = 3600,
+        fuzzy_enabled: bool = True,
+        similarity_threshold: float = 0.85,
+        ngram_size: int = 3,
+        enabled: bool = True,
+        stamp_path: str = "",
+    ):
+        self.enabled = enabled
+        self.stamp_path = stamp_path
+        self._stamp_key: Optional[Tuple[int, int]] = self._read_stamp_key()
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.fuzzy_enabled = fuzzy_enabled
+        self.similarity_threshold = similarity_threshold
+        self.ngram_size = max(1, ngram_size)
+        self._entries: "OrderedDict[CacheKey, _CacheEntry]" = OrderedDict()
+        self._gram_index: Dict[str, Set[CacheKey]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _read_stamp_key(self) -> Optional[Tuple[int, int]]:
+        if not self.stamp_path:
+            return None
+        try:
+            stat = os.stat(self.stamp_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _check_stamp(self) -> None:
+        # Caller holds the lock. One stat() per lookup; the file is replaced, never edited in place.
+        if not self.stamp_path:
+            return
+        key = self._read_stamp_key()
+        if key != self._stamp_key:
+            self._stamp_key = key
+            self._clear_entries()
+
+    def _clear_entries(self) -> None:
+        self._entries.clear()
+        self._gram_index.clear()
+        self.invalidations += 1
+
+    @staticmethod
+    def _make_key(question: str, domain: Optional[str]) -> CacheKey:
+        return (question, (domain or "").strip().lower())
+
+    def _index(self, key: CacheKey, grams: FrozenSet[str]) -> None:
+        for gram in grams:
+            self._gram_index.setdefault(gram, set()).add(key)
+
+    def _unindex(self, key: CacheKey, grams: Optional[FrozenSet[str]]) -> None:
+        if not grams:
+            return
+        for gram in grams:
+            keys = self._gram_index.get(gram)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._gram_index[gram]
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry.grams)
+
+    def _find_similar(self, key: CacheKey, now: float) -> Optional[CacheKey]:
+        grams = char_ngrams(key[0], self.ngram_size)
+        if not grams:
+            return None
+        anchors = anchor_tokens(key[0])
+
+        overlaps: Counter = Counter()
+        for gram in grams:
+            for candidate in self._gram_index.get(gram, ()):
+                if candidate[1] == key[1]:
+                    overlaps[candidate] += 1
+
+        best_key = None
+        best_score = 0.0
+        for candidate, overlap in overlaps.items():
+            entry = self._entries.get(candidate)
+            if entry is None or entry.expires_at <= now or entry.anchors != anchors:
+                continue
+            score = overlap / float(len(grams) + len(entry.grams) - overlap)
+            if score > best_score:
+                best_key, best_score = candidate, score
+
+        if best_key is not None and best_score >= self.similarity_threshold:
+            return best_key
+        return None
+
+    def get(self, question: str, domain: Optional[str] = None, allow_similar: bool = True) -> Optional[str]:
+        if not self.enabled or not question:
+            return None
+
+        key = self._make_key(question, domain)
+        now = time.monotonic()
+        with self._lock:
+            self._check_stamp()
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+
+            if allow_similar and self.fuzzy_enabled:
+                similar_key = self._find_similar(key, now)
+                if similar_key is not None:
+                    self._entries.move_to_end(similar_key)
+                    self.similar_hits += 1
+                    return self._entries[similar_key].answer
+
+            self.misses += 1
+            return None
+
+    def set(self, question: str, answer: str, domain: Optional[str] = None, allow_similar: bool = True) -> None:
+        if not self.enabled or not question or not answer:
+            return
+
+        key = self._make_key(question, domain)
+        fuzzy = allow_similar and self.fuzzy_enabled
+        grams = char_ngrams(question, self.ngram_size) if fuzzy else None
+        anchors = anchor_tokens(question) if fuzzy else None
+        with self._lock:
+            self._check_stamp()
+            self._remove(key)
+            self._entries[key] = _CacheEntry(answer, time.monotonic() + self.ttl_seconds, grams, anchors)
+            if grams:
+                self._index(key, grams)
+
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop this process's entries only."""
+        with self._lock:
+            self._clear_entries()
+
+    def invalidate_all(self) -> None:
+        """Drop cached answers in every worker that shares stamp_path (blocking file write)."""
+        if self.stamp_path:
+            directory = os.path.dirname(os.path.abspath(self.stamp_path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.stamp_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as handle:
+                handle.write(str(time.time()))
+            # A new inode each time, so the change is seen even with coarse mtimes.
+            os.replace(tmp_path, self.stamp_path)
+        self.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.similar_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    fuzzy_enabled=ANSWER_CACHE_FUZZY_ENABLED,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ngram_size=ANSWER_CACHE_NGRAM_SIZE,
+    enabled=ANSWER_CACHE_ENABLED,
+    stamp_path=ANSWER_CACHE_STAMP_FILE,
+)
@@ -0,0 +1,111 @@
+import heapq
+import math
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 inverted index that supports incremental add/remove.
+    Documents are passed in already tokenized (see app.services.thai_text.tokenize).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._doc_terms: Dict[Hashable, Tuple[str, ...]] = {}
+        self._doc_len: Dict[Hashable, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._doc_len
+
+    @property
+    def avg_doc_len(self) -> float:
+        return (self._total_len / len(self._doc_len)) if self._doc_len else 0.0
+
+    def add(self, doc_id: Hashable, tokens: Iterable[str]) -> None:
+        if doc_id in self._doc_len:
+            self.remove(doc_id)
+
+        term_freq = Counter(tokens)
+        length = sum(term_freq.values())
+        for term, freq in term_freq.items():
+            self._postings.setdefault(term, {})[doc_id] = freq
+        self._doc_terms[doc_id] = tuple(term_freq.keys())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+
+    def remove(self, doc_id: Hashable) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_len.clear()
+        self._total_len = 0
+
+    def idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        n_docs = len(self._doc_len)
+        return math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+    def doc_terms(self, doc_id: Hashable) -> Tuple[str, ...]:
+        return self._doc_terms.get(doc_id, ())
+
+    def _term_score(self, term: str, doc_id: Hashable, idf: float, avg_len: float) -> float:
+        freq = self._postings[term].get(doc_id, 0)
+        if not freq:
+            return 0.0
+        norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[doc_id] / (avg_len or 1.0))
+        return idf * freq * (self.k1 + 1.0) / (freq + norm)
+
+    def search(
+        self,
+        tokens: Iterable[str],
+        top_k: int = 10,
+        candidates: Optional[set] = None,
+    ) -> List[Tuple[Hashable, float]]:
+        """Return up to top_k (doc_id, score) pairs; `candidates` restricts scoring to a subset."""
+        query_terms = set(tokens)
+        if not query_terms or not self._doc_len:
+            return []
+
+        avg_len = self.avg_doc_len
+        scores: Dict[Hashable, float] = {}
+        for term in query_terms:
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf(term)
+            for doc_id, freq in posting.items():
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[doc_id] / (avg_len or 1.0))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1.0) / (freq + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def score(self, tokens: Iterable[str], doc_id: Hashable) -> float:
+        if doc_id not in self._doc_len:
+            return 0.0
+        avg_len = self.avg_doc_len
+        return sum(
+            self._term_score(term, doc_id, self.idf(term), avg_len)
+            for term in set(tokens)
+            if term in self._postings
+        )
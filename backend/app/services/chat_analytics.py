@@ -0,0 +1,524 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, extract, func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import ANALYTICS_ROLLUP_FLUSH_SECONDS
+from app.models.database import SessionLocal
+from app.models.models import AnalyticsDailyQuestion, AnalyticsDailyUser, AnalyticsHourlyUsage, Chat
+
+logger = logging.getLogger(__name__)
+
+WEEKDAY_LABELS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _as_date_key(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return str(value)[:10]
+
+
+def empty_analytics(days: Optional[int]) -> Dict[str, object]:
+    return {
+        "total_questions": 0,
+        "unique_users": 0,
+        "top_questions": [],
+        "hourly_usage": [{"hour": h, "count": 0} for h in range(24)],
+        "daily_usage": [],
+        "weekday_usage": [
+            {"day": day, "count": 0}
+            for day in WEEKDAY_LABELS
+        ],
+        "peak_hour": {"hour": 0, "count": 0, "label": "00:00 - 00:59"},
+        "peak_day": {"date": None, "count": 0},
+        "generated_at": datetime.utcnow().isoformat(),
+        "applied_range_days": days
+    }
+
+
+def build_analytics_response(
+    days: Optional[int],
+    total_questions: int,
+    unique_users: int,
+    top_questions: List[Dict[str, object]],
+    hour_counts: Dict[int, int],
+    day_counts: Dict[str, int],
+    weekday_counts: Dict[int, int],
+) -> Dict[str, object]:
+    """Shape grouped counts into the /chat/analytics response."""
+    if not total_questions:
+        return empty_analytics(days)
+
+    daily_window_days = days if days is not None else 30
+    today = datetime.utcnow().date()
+    daily_usage = []
+    for offset in range(daily_window_days - 1, -1, -1):
+        date_key = (today - timedelta(days=offset)).isoformat()
+        daily_usage.append({"date": date_key, "count": day_counts.get(date_key, 0)})
+
+    # Ties resolve to the earliest hour/date, matching chronological first occurrence.
+    peak_hour, peak_hour_count = max(
+        sorted(hour_counts.items()), key=lambda item: item[1], default=(0, 0)
+    )
+    peak_day, peak_day_count = max(
+        sorted(day_counts.items()), key=lambda item: item[1], default=(None, 0)
+    )
+
+    return {
+        "total_questions": total_questions,
+        "unique_users": unique_users,
+        "top_questions": top_questions,
+        "hourly_usage": [{"hour": hour, "count": hour_counts.get(hour, 0)} for hour in range(24)],
+        "daily_usage": daily_usage,
+        "weekday_usage": [
+            {"day": WEEKDAY_LABELS[idx], "count": weekday_counts.get(idx, 0)}
+            for idx in range(7)
+        ],
+        "peak_hour": {
+            "hour": peak_hour,
+            "count": peak_hour_count,
+            "label": f"{peak_hour:02d}:00 - {peak_hour:02d}:59"
+        },
+        "peak_day": {
+            "date": peak_day,
+            "count": peak_day_count
+        },
+        "generated_at": datetime.utcnow().isoformat(),
+        "applied_range_days": days
+    }
+
+
+def _bucket_counts(db: Session, ts_column, count_expr, filters) -> Tuple[Dict[int, int], Dict[str, int], Dict[int, int]]:
+    """Group count_expr by hour-of-day, calendar day and weekday (0=Monday) of ts_column."""
+    filters = [ts_column.isnot(None), *filters]
+
+    hour_expr = extract("hour", ts_column)
+    hour_counts = {
+        int(hour): int(count)
+        for hour, count in db.query(hour_expr, count_expr).filter(*filters).group_by(hour_expr).all()
+    }
+
+    day_expr = func.date(ts_column)
+    day_counts = {
+        _as_date_key(day): int(count)
+        for day, count in db.query(day_expr, count_expr).filter(*filters).group_by(day_expr).all()
+    }
+
+    # dow is 0=Sunday on both PostgreSQL and SQLite; the response uses 0=Monday.
+    dow_expr = extract("dow", ts_column)
+    weekday_counts: Dict[int, int] = {}
+    for dow, count in db.query(dow_expr, count_expr).filter(*filters).group_by(dow_expr).all():
+        weekday_counts[(int(dow) + 6) % 7] = int(count)
+
+    return hour_counts, day_counts, weekday_counts
+
+
+def compute_chat_analytics(db: Session, days: Optional[int] = None, top_n: int = 10) -> Dict[str, object]:
+    """
+    Compute dashboard analytics with grouped SQL queries.
+    Each query returns at most one row per hour/day/weekday/question, so memory does not grow with chat count.
+    """
+    filters = []
+    if days is not None:
+        filters.append(Chat.created_at >= datetime.utcnow() - timedelta(days=days))
+
+    total_questions, unique_users = (
+        db.query(func.count(Chat.id), func.count(func.distinct(Chat.user_id)))
+        .filter(*filters)
+        .one()
+    )
+    if not total_questions:
+        return empty_analytics(days)
+
+    hour_counts, day_counts, weekday_counts = _bucket_counts(
+        db, Chat.created_at, func.count(Chat.id), filters
+    )
+
+    top_rows = (
+        db.query(Chat.normalized_message, func.count(Chat.id).label("count"))
+        .filter(Chat.normalized_message.isnot(None), Chat.normalized_message != "", *filters)
+        .group_by(Chat.normalized_message)
+        .order_by(func.count(Chat.id).desc(), func.min(Chat.created_at).asc())
+        .limit(top_n)
+        .all()
+    )
+    top_questions = [{"question": question, "count": count} for question, count in top_rows]
+
+    return build_analytics_response(
+        days,
+        total_questions,
+        unique_users,
+        top_questions,
+        hour_counts,
+        day_counts,
+        weekday_counts,
+    )
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(question.encode("utf-8")).hexdigest()
+
+
+def hour_bucket(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_counter(db: Session, model, key: Dict[str, object], extra: Dict[str, object], amount: int = 1) -> None:
+    # UPDATE first (the common case); INSERT in a savepoint and fall back to UPDATE if another writer won the race.
+    filters = [getattr(model, column) == value for column, value in key.items()]
+    updated = (
+        db.query(model)
+        .filter(*filters)
+        .update({model.question_count: model.question_count + amount}, synchronize_session=False)
+    )
+    if updated:
+        return
+    try:
+        with db.begin_nested():
+            db.add(model(**key, **extra, question_count=amount))
+    except IntegrityError:
+        db.query(model).filter(*filters).update(
+            {model.question_count: model.question_count + amount}, synchronize_session=False
+        )
+
+
+def _insert_daily_user(db: Session, day: date, user_id: int) -> None:
+    exists = (
+        db.query(AnalyticsDailyUser.id)
+        .filter(AnalyticsDailyUser.day == day, AnalyticsDailyUser.user_id == user_id)
+        .first()
+    )
+    if exists is not None:
+        return
+    try:
+        with db.begin_nested():
+            db.add(AnalyticsDailyUser(day=day, user_id=user_id))
+    except IntegrityError:
+        pass
+
+
+class RollupBuffer:
+    """
+    Rollup increments accumulated in memory and written by a periodic flush.
+    Every chat in an hour increments the same hourly row, so writing it per chat serializes all
+    chat commits on that row lock; buffered, each worker touches it once per flush_seconds.
+    Counts not yet flushed are lost if the process is killed; stop() flushes them on shutdown.
+    """
+
+    def __init__(self, flush_seconds: float = 5):
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._hours: Counter = Counter()
+        self._questions: Counter = Counter()
+        self._question_text: Dict[str, str] = {}
+        self._daily_users: Set[Tuple[date, int]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_questions = 0
+        self.failed_flushes = 0
+
+    def record(self, user_id: Optional[int], normalized_message: Optional[str], created_at: Optional[datetime] = None) -> None:
+        created_at = created_at or datetime.utcnow()
+        day = created_at.date()
+        with self._lock:
+            self._hours[hour_bucket(created_at)] += 1
+            if normalized_message:
+                digest = question_hash(normalized_message)
+                self._questions[(day, digest)] += 1
+                self._question_text.setdefault(digest, normalized_message)
+            if user_id is not None:
+                self._daily_users.add((day, user_id))
+
+    def _take(self):
+        with self._lock:
+            pending = (self._hours, self._questions, self._question_text, self._daily_users)
+            self._hours, self._questions, self._question_text, self._daily_users = Counter(), Counter(), {}, set()
+        return pending
+
+    def _restore(self, hours: Counter, questions: Counter, question_text: Dict[str, str], daily_users: Set) -> None:
+        with self._lock:
+            self._hours.update(hours)
+            self._questions.update(questions)
+            for digest, text in question_text.items():
+                self._question_text.setdefault(digest, text)
+            self._daily_users.update(daily_users)
+
+    def flush(self) -> int:
+        """Write pending increments in one transaction (blocking). Returns the number of questions flushed."""
+        hours, questions, question_text, daily_users = self._take()
+        if not hours:
+            return 0
+        db = SessionLocal()
+        try:
+            # Fixed key order so concurrent flushes from other workers cannot deadlock.
+            for bucket, count in sorted(hours.items()):
+                _upsert_counter(db, AnalyticsHourlyUsage, {"bucket_start": bucket}, {}, count)
+            for (day, digest), count in sorted(questions.items()):
+                _upsert_counter(
+                    db,
+                    AnalyticsDailyQuestion,
+                    {"day": day, "question_hash": digest},
+                    {"question": question_text[digest]},
+                    count,
+                )
+            for day, user_id in sorted(daily_users):
+                _insert_daily_user(db, day, user_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.failed_flushes += 1
+            self._restore(hours, questions, question_text, daily_users)
+            raise
+        finally:
+            db.close()
+        flushed = sum(hours.values())
+        self.flushes += 1
+        self.flushed_questions += flushed
+        return flushed
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        except Exception as e:
+            logger.error("Final analytics rollup flush failed: %s", e)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Analytics rollup flush failed: %s", e)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            pending = sum(self._hours.values())
+        return {
+            "flush_seconds": self.flush_seconds,
+            "pending_questions": pending,
+            "flushes": self.flushes,
+            "flushed_questions": self.flushed_questions,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+chat_rollups = RollupBuffer(flush_seconds=ANALYTICS_ROLLUP_FLUSH_SECONDS)
+
+
+def record_chat_rollup(
+    user_id: Optional[int],
+    normalized_message: Optional[str],
+    created_at: Optional[datetime] = None,
+) -> None:
+    """
+    Count one saved question in the analytics rollups (buffered; call after the chat commits).
+    Deleting chats later must go through subtract_chat_rollups.
+    """
+    chat_rollups.record(user_id, normalized_message, created_at)
+
+
+def subtract_chat_rollups(db: Session, *chat_filters, batch_size: int = 5000) -> int:
+    """
+    Take the chats matching chat_filters out of the rollups (call before deleting them; caller commits),
+    so the rollup path keeps matching compute_chat_analytics and deleted question text is purged.
+    Counts go through _upsert_counter with negative amounts: a chat still sitting in some worker's
+    RollupBuffer nets out when that buffer flushes. Returns the number of chats subtracted.
+    """
+    chats = Chat.__table__
+    hour_counts: Counter = Counter()
+    question_counts: Counter = Counter()
+    question_text: Dict[str, str] = {}
+    daily_users: Counter = Counter()
+    rows = db.execute(
+        select(chats.c.user_id, chats.c.normalized_message, chats.c.created_at)
+        .where(chats.c.created_at.isnot(None), *chat_filters)
+        .execution_options(yield_per=batch_size)
+    )
+    counted = 0
+    for batch in rows.partitions():
+        for row in batch:
+            day = row.created_at.date()
+            hour_counts[hour_bucket(row.created_at)] += 1
+            if row.normalized_message:
+                digest = question_hash(row.normalized_message)
+                question_counts[(day, digest)] += 1
+                question_text.setdefault(digest, row.normalized_message)
+            if row.user_id is not None:
+                daily_users[(day, row.user_id)] += 1
+        counted += len(batch)
+    if not counted:
+        return 0
+
+    for bucket, count in sorted(hour_counts.items()):
+        _upsert_counter(db, AnalyticsHourlyUsage, {"bucket_start": bucket}, {}, -count)
+    for (day, digest), count in sorted(question_counts.items()):
+        _upsert_counter(
+            db,
+            AnalyticsDailyQuestion,
+            {"day": day, "question_hash": digest},
+            {"question": question_text[digest]},
+            -count,
+        )
+    days = sorted({day for day, _ in question_counts})
+    if days:
+        db.execute(delete(AnalyticsDailyQuestion).where(
+            AnalyticsDailyQuestion.day.in_(days), AnalyticsDailyQuestion.question_count == 0
+        ))
+    # A user stays counted for a day only if they still have other chats on it.
+    for (day, user_id), deleting in sorted(daily_users.items()):
+        day_start = datetime.combine(day, datetime.min.time())
+        on_day = db.execute(
+            select(func.count(chats.c.id)).where(
+                chats.c.user_id == user_id,
+                chats.c.created_at >= day_start,
+                chats.c.created_at < day_start + timedelta(days=1),
+            )
+        ).scalar_one()
+        if on_day <= deleting:
+            db.execute(delete(AnalyticsDailyUser).where(
+                AnalyticsDailyUser.day == day, AnalyticsDailyUser.user_id == user_id
+            ))
+    return counted
+
+
+def backfill_rollups(conn: Connection, batch_size: int = 5000) -> int:
+    """Rebuild the rollup tables from chats when they are still empty. Returns the number of chats counted."""
+    hourly = AnalyticsHourlyUsage.__table__
+    if conn.execute(select(hourly.c.id).limit(1)).first() is not None:
+        return 0
+
+    chats = Chat.__table__
+    hour_counts: Counter = Counter()
+    question_counts: Counter = Counter()
+    question_text: Dict[str, str] = {}
+    daily_users = set()
+    counted = 0
+    last_id = 0
+    # Scan in id order so memory is bounded by the number of distinct buckets, not chats.
+    while True:
+        rows = conn.execute(
+            select(chats.c.id, chats.c.user_id, chats.c.normalized_message, chats.c.created_at)
+            .where(chats.c.id > last_id, chats.c.created_at.isnot(None))
+            .order_by(chats.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            day = row.created_at.date()
+            hour_counts[hour_bucket(row.created_at)] += 1
+            if row.normalized_message:
+                digest = question_hash(row.normalized_message)
+                question_counts[(day, digest)] += 1
+                question_text.setdefault(digest, row.normalized_message)
+            if row.user_id is not None:
+                daily_users[(day, row.user_id)] += 1
+        counted += len(rows)
+        last_id = rows[-1].id
+
+    def insert_batches(table, mappings) -> None:
+        batch = []
+        for mapping in mappings:
+            batch.append(mapping)
+            if len(batch) >= batch_size:
+                conn.execute(insert(table), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(table), batch)
+
+    insert_batches(hourly, (
+        {"bucket_start": bucket, "question_count": count}
+        for bucket, count in hour_counts.items()
+    ))
+    insert_batches(AnalyticsDailyQuestion.__table__, (
+        {"day": day, "question_hash": digest, "question": question_text[digest], "question_count": count}
+        for (day, digest), count in question_counts.items()
+    ))
+    insert_batches(AnalyticsDailyUser.__table__, (
+        {"day": day, "user_id": user_id}
+        for day, user_id in daily_users
+    ))
+    if counted:
+        logger.info("Backfilled analytics rollups from %s chats", counted)
+    return counted
+
+
+def compute_rollup_analytics(db: Session, days: Optional[int] = None, top_n: int = 10) -> Dict[str, object]:
+    """
+    Compute dashboard analytics from the rollup tables.
+    The window starts at the hour (hourly usage) or day (users, top questions) containing the cutoff.
+    """
+    hourly_filters = []
+    day_filters = []
+    question_filters = []
+    if days is not None:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        hourly_filters.append(AnalyticsHourlyUsage.bucket_start >= hour_bucket(cutoff))
+        day_filters.append(AnalyticsDailyUser.day >= cutoff.date())
+        question_filters.append(AnalyticsDailyQuestion.day >= cutoff.date())
+
+    total_questions = (
+        db.query(func.coalesce(func.sum(AnalyticsHourlyUsage.question_count), 0))
+        .filter(*hourly_filters)
+        .scalar()
+    )
+    if not total_questions:
+        return empty_analytics(days)
+
+    unique_users = (
+        db.query(func.count(func.distinct(AnalyticsDailyUser.user_id)))
+        .filter(*day_filters)
+        .scalar()
+    )
+
+    hour_counts, day_counts, weekday_counts = _bucket_counts(
+        db, AnalyticsHourlyUsage.bucket_start, func.sum(AnalyticsHourlyUsage.question_count), hourly_filters
+    )
+
+    count_expr = func.sum(AnalyticsDailyQuestion.question_count)
+    top_rows = (
+        db.query(func.min(AnalyticsDailyQuestion.question), count_expr)
+        .filter(*question_filters)
+        .group_by(AnalyticsDailyQuestion.question_hash)
+        .having(count_expr > 0)
+        .order_by(count_expr.desc(), func.min(AnalyticsDailyQuestion.day).asc())
+        .limit(top_n)
+        .all()
+    )
+    top_questions = [{"question": question, "count": int(count)} for question, count in top_rows]
+
+    return build_analytics_response(
+        days,
+        int(total_questions),
+        unique_users,
+        top_questions,
+        hour_counts,
+        day_counts,
+        weekday_counts,
+    )
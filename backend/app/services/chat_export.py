@@ -0,0 +1,222 @@
+import csv
+import io
+import json
+import logging
+import re
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.orm import Query, Session
+
+from app.models.database import SessionLocal
+from app.models.models import Answer, Chat, User
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_ROWS = 1000
+CSV_EXPORT_CHUNK_CHARS = 64 * 1024
+NDJSON_EXPORT_CHUNK_ROWS = 5000
+PARQUET_ROW_GROUP_ROWS = 50000
+
+# คอลัมน์ของ export แบบ NDJSON / Parquet (ลำดับตรงกับ select ใน chat_log_query)
+CHAT_LOG_SCHEMA = pa.schema([
+    ("chat_id", pa.int64()),
+    ("thread_id", pa.string()),
+    ("asked_at", pa.timestamp("us")),
+    ("user_id", pa.int64()),
+    ("user_name", pa.string()),
+    ("user_email", pa.string()),
+    ("question", pa.string()),
+    ("answer", pa.string()),
+    ("llm_provider", pa.string()),
+    ("answered_at", pa.timestamp("us")),
+])
+
+
+def normalize_csv_text(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    cleaned = re.sub(r"[\r\n\t]+", " ", value)
+    cleaned = re.sub(r"\s{2,}", " ", cleaned).strip()
+    return cleaned
+
+
+def safe_csv_cell(value: Optional[str]) -> str:
+    text = normalize_csv_text(value)
+    if text.startswith(("=", "+", "-", "@")):
+        return f"'{text}"
+    return text
+
+
+def chat_log_query(db: Session, cutoff: Optional[datetime], *columns) -> Query:
+    """Chat x User x Answer join (newest question first), streamed with a server-side cursor."""
+    query = (
+        db.query(*columns)
+        .select_from(Chat)
+        .outerjoin(User, Chat.user_id == User.id)
+        .outerjoin(Answer, Answer.chat_id == Chat.id)
+    )
+    if cutoff is not None:
+        query = query.filter(Chat.created_at >= cutoff)
+    return (
+        query.order_by(Chat.created_at.desc(), Answer.created_at.asc())
+        .execution_options(stream_results=True)
+        .yield_per(EXPORT_FETCH_ROWS)
+    )
+
+
+def _iter_chat_log_records(db: Session, cutoff: Optional[datetime]) -> Iterator[tuple]:
+    return iter(chat_log_query(
+        db,
+        cutoff,
+        Chat.id,
+        Chat.thread_id,
+        Chat.created_at,
+        Chat.user_id,
+        User.name,
+        User.email,
+        Chat.message,
+        Answer.answer,
+        Answer.llm_provider,
+        Answer.created_at,
+    ))
+
+
+def iter_chat_logs_csv(cutoff: Optional[datetime]) -> Iterator[bytes]:
+    """
+    Yield the chat log CSV in chunks of ~64K characters while paging through the join with a server-side cursor.
+    Runs in Starlette's threadpool with its own session (the request session is closed once the response starts).
+    """
+    db = SessionLocal()
+    try:
+        query = chat_log_query(db, cutoff, Chat.user_id, User.name, User.email, Chat.message, Answer.answer)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # Prefix UTF-8 BOM so Excel on Windows detects Thai text correctly.
+        buffer.write("\ufeff")
+        writer.writerow([
+            "user_id",
+            "user_name",
+            "user_email",
+            "question",
+            "answer"
+        ])
+
+        for user_id, user_name, user_email, message, answer_text in query:
+            writer.writerow([
+                user_id or "",
+                safe_csv_cell(user_name),
+                safe_csv_cell(user_email),
+                safe_csv_cell(message),
+                safe_csv_cell(answer_text)
+            ])
+            if buffer.tell() >= CSV_EXPORT_CHUNK_CHARS:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated download rather than a 500.
+        logger.error(f"Error streaming chat logs csv: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+def _to_iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() + "Z" if value else None
+
+
+def iter_chat_logs_ndjson_gzip(cutoff: Optional[datetime]) -> Iterator[bytes]:
+    """Yield the chat logs as gzip-compressed NDJSON (one JSON object per question/answer row)."""
+    db = SessionLocal()
+    names = CHAT_LOG_SCHEMA.names
+    # wbits=31 writes a gzip header/trailer so the output is a plain .gz file.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        lines: List[str] = []
+        for record in _iter_chat_log_records(db, cutoff):
+            row = dict(zip(names, record))
+            row["asked_at"] = _to_iso(row["asked_at"])
+            row["answered_at"] = _to_iso(row["answered_at"])
+            lines.append(json.dumps(row, ensure_ascii=False))
+            if len(lines) >= NDJSON_EXPORT_CHUNK_ROWS:
+                lines.append("")
+                chunk = compressor.compress("\n".join(lines).encode("utf-8"))
+                lines = []
+                if chunk:
+                    yield chunk
+        if lines:
+            lines.append("")
+            yield compressor.compress("\n".join(lines).encode("utf-8"))
+        yield compressor.flush()
+    except Exception as e:
+        logger.error(f"Error streaming chat logs ndjson: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that keeps written bytes until the caller drains them."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_chat_logs_parquet(cutoff: Optional[datetime]) -> Iterator[bytes]:
+    """
+    Yield the chat logs as a Parquet file, one row group per PARQUET_ROW_GROUP_ROWS rows.
+    Each row group is sent as soon as it is written; the footer follows the last one.
+    """
+    db = SessionLocal()
+    names = CHAT_LOG_SCHEMA.names
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, CHAT_LOG_SCHEMA, compression="zstd")
+    try:
+        columns: Dict[str, list] = {name: [] for name in names}
+        pending = 0
+        for record in _iter_chat_log_records(db, cutoff):
+            for name, value in zip(names, record):
+                columns[name].append(value)
+            pending += 1
+            if pending >= PARQUET_ROW_GROUP_ROWS:
+                writer.write_table(pa.Table.from_pydict(columns, schema=CHAT_LOG_SCHEMA))
+                columns = {name: [] for name in names}
+                pending = 0
+                yield sink.drain()
+        if pending:
+            writer.write_table(pa.Table.from_pydict(columns, schema=CHAT_LOG_SCHEMA))
+        writer.close()
+        yield sink.drain()
+    except Exception as e:
+        logger.error(f"Error streaming chat logs parquet: {str(e)}")
+        raise
+    finally:
+        # Also releases the native writer when the client disconnects mid-stream (close is idempotent).
+        writer.close()
+        db.close()
@@ -0,0 +1,197 @@
+import logging
+import re
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from app.config import (
+    CHUNK_MAX_CHARS,
+    CHUNK_OVERLAP_CHARS,
+    CHUNK_SECTION_MIN_CHARS,
+    CHUNK_INSERT_BATCH_SIZE,
+)
+from app.models.database import SessionLocal
+from app.models.models import Chunk, Embedding, File, OCRResult
+from app.services.document_ingest import TRAINING_CATEGORIES, category_for_path
+from app.services.pdf_processor import DocumentError
+
+logger = logging.getLogger(__name__)
+
+OCR_FETCH_ROWS = 200
+
+# Thai writes no spaces between words; a space between two Thai runs ends a clause or sentence.
+BOUNDARY_RE = re.compile(
+    r"\n\s*"                                                    # line / paragraph break
+    r"|(?<=[.!?;:])\s+"                                         # Latin-style sentence end
+    r"|(?<=[\u0e00-\u0e7f])[ \t\u00a0]+(?=[\u0e00-\u0e7f0-9(])"  # Thai clause break
+    r"|(?<=\u0e2f)\s+"                                          # after paiyannoi (ฯ, ฯลฯ)
+)
+# Headings that should open a new chunk: หมวด ๑, ข้อ 12, มาตรา ๓, 1.2, (3), ก. ...
+SECTION_RE = re.compile(
+    r"[ \t]*(?:(?:หมวด(?:ที่)?|ส่วนที่|บทที่|ข้อ|มาตรา|ภาคผนวก|chapter|section|article)\s*[0-9๐-๙]+"
+    r"|[0-9๐-๙]+(?:\.[0-9๐-๙]+)*[.)]\s|\([0-9๐-๙]+\)\s|[ก-ฮ][.)]\s)",
+    re.IGNORECASE,
+)
+# Marks that belong to the preceding consonant (above/below vowels, tone marks, sara aa/am, mai yamok)
+# and leading vowels that belong to the following one; a hard cut must not separate them.
+_ATTACHED_TO_PREVIOUS = set("ะัาำิีึืฺุูๅๆ็่้๊๋์ํ๎")
+_LEADING_VOWELS = set("เแโใไ")
+
+Span = Tuple[int, int]
+
+
+def _safe_cut(text: str, start: int, limit: int) -> int:
+    """Cut position in (start, limit]: the last whitespace near the limit, else a Thai-cluster-safe spot."""
+    if limit >= len(text):
+        return len(text)
+    window_start = start + (limit - start) * 3 // 4
+    for pos in range(limit, window_start, -1):
+        if text[pos - 1].isspace():
+            return pos
+    pos = limit
+    while pos > start + 1 and (text[pos] in _ATTACHED_TO_PREVIOUS or text[pos - 1] in _LEADING_VOWELS):
+        pos -= 1
+    return pos
+
+
+def split_units(text: str, max_unit_chars: int) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Yield (start, end, opens_section) sentence/clause spans covering `text`.
+    Spans longer than max_unit_chars (e.g. OCR output with no spaces) are hard-split.
+    """
+    start = 0
+    boundaries = [match.end() for match in BOUNDARY_RE.finditer(text)]
+    for end in boundaries + [len(text)]:
+        if end <= start:
+            continue
+        at_line_start = not text[text.rfind("\n", 0, start) + 1:start].strip()
+        opens_section = at_line_start and bool(SECTION_RE.match(text, start))
+        while end - start > max_unit_chars:
+            cut = _safe_cut(text, start, start + max_unit_chars)
+            yield start, cut, opens_section
+            start, opens_section = cut, False
+        yield start, end, opens_section
+        start = end
+
+
+def _trim(text: str, start: int, end: int) -> Optional[Span]:
+    piece = text[start:end]
+    stripped = piece.strip()
+    if not stripped:
+        return None
+    start += len(piece) - len(piece.lstrip())
+    return start, start + len(stripped)
+
+
+def chunk_text(
+    text: str,
+    max_chars: int = CHUNK_MAX_CHARS,
+    overlap_chars: int = CHUNK_OVERLAP_CHARS,
+    section_min_chars: int = CHUNK_SECTION_MIN_CHARS,
+) -> Iterator[Span]:
+    """
+    Pack sentence/clause units into chunks of at most max_chars, yielding (start, end) offsets into `text`.
+    Consecutive chunks share up to overlap_chars of trailing units, except across a section heading.
+    """
+    max_chars = max(1, max_chars)
+    overlap_chars = max(0, min(overlap_chars, max_chars // 2))
+    # Oversized units are cut small enough that the overlap can still carry whole pieces over.
+    max_unit_chars = overlap_chars if overlap_chars >= 50 else max_chars
+    current: List[Tuple[int, int, bool]] = []
+    for unit in split_units(text, max_unit_chars):
+        start, end, opens_section = unit
+        if current:
+            size = current[-1][1] - current[0][0]
+            if end - current[0][0] > max_chars or (opens_section and size >= section_min_chars):
+                span = _trim(text, current[0][0], current[-1][1])
+                if span:
+                    yield span
+                keep: List[Tuple[int, int, bool]] = []
+                if not opens_section:
+                    # Always drop the first unit so the next chunk is never a superset of this one.
+                    for previous in reversed(current[1:]):
+                        if current[-1][1] - previous[0] > overlap_chars:
+                            break
+                        keep.insert(0, previous)
+                current = keep
+                while current and end - current[0][0] > max_chars:
+                    current.pop(0)
+        current.append(unit)
+    if current:
+        span = _trim(text, current[0][0], current[-1][1])
+        if span:
+            yield span
+
+
+def iter_file_chunks(db: Session, file: File) -> Iterator[Dict[str, object]]:
+    """Stream Chunk rows for one file page by page; OCR rows are fetched in batches, never all at once."""
+    category = category_for_path(file.raw_path)
+    rows = db.execute(
+        select(OCRResult.id, OCRResult.page_number, OCRResult.text)
+        .where(OCRResult.file_id == file.id)
+        .order_by(OCRResult.page_number, OCRResult.id)
+        .execution_options(yield_per=OCR_FETCH_ROWS)
+    )
+    chunk_index = 0
+    for row in rows:
+        for start, end in chunk_text(row.text or ""):
+            yield {
+                "ocr_result_id": row.id,
+                "content": row.text[start:end],
+                "chunk_metadata": {
+                    "file_id": file.id,
+                    "filename": file.filename,
+                    "page": row.page_number,
+                    "category": category,
+                    "category_label": TRAINING_CATEGORIES.get(category),
+                    "start": start,
+                    "end": end,
+                    "chunk_index": chunk_index,
+                },
+            }
+            chunk_index += 1
+
+
+def _batched(items: Iterable[Dict[str, object]], size: int) -> Iterator[List[Dict[str, object]]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def clear_file_chunks(db: Session, file_id: int) -> None:
+    ocr_ids = select(OCRResult.id).where(OCRResult.file_id == file_id)
+    chunk_ids = select(Chunk.id).where(Chunk.ocr_result_id.in_(ocr_ids))
+    db.execute(delete(Embedding).where(Embedding.chunk_id.in_(chunk_ids)))
+    db.execute(delete(Chunk).where(Chunk.ocr_result_id.in_(ocr_ids)))
+
+
+def chunk_file(db: Session, file_id: int) -> int:
+    """Replace a file's chunks in one transaction, inserting CHUNK_INSERT_BATCH_SIZE rows per statement."""
+    file = db.get(File, file_id)
+    if file is None:
+        raise DocumentError(f"File {file_id} not found")
+    clear_file_chunks(db, file_id)
+    count = 0
+    for batch in _batched(iter_file_chunks(db, file), max(1, CHUNK_INSERT_BATCH_SIZE)):
+        db.execute(insert(Chunk), batch)
+        count += len(batch)
+    db.commit()
+    logger.info("Stored %s chunks for %s", count, file.filename)
+    return count
+
+
+def rechunk_file(file_id: int) -> int:
+    """chunk_file on its own session; called from a worker thread by the document job queue."""
+    db = SessionLocal()
+    try:
+        return chunk_file(db, file_id)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
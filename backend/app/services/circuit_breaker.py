@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed -> open after `failure_threshold` failures in a row; open -> half_open after
+    `recovery_timeout` seconds, where up to `half_open_max_calls` probes are let through.
+    A successful probe closes the circuit, a failed one opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = max(0.0, recovery_timeout)
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._opened_at_wall: Optional[datetime] = None
+        self._probes_started: List[float] = []
+        self._lock = threading.Lock()
+        self.total_failures = 0
+        self.total_successes = 0
+        self.rejected_calls = 0
+        self.times_opened = 0
+
+    def _refresh_state(self, now: float) -> None:
+        if self._state == STATE_OPEN and self._opened_at is not None:
+            if now - self._opened_at >= self.recovery_timeout:
+                self._state = STATE_HALF_OPEN
+                self._probes_started = []
+                logger.info("Circuit %s half-open, probing upstream", self.name)
+
+    def _open(self, now: float) -> None:
+        if self._state != STATE_OPEN:
+            self.times_opened += 1
+            logger.warning(
+                "Circuit %s opened after %s consecutive failures",
+                self.name,
+                self._consecutive_failures,
+            )
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._opened_at_wall = datetime.utcnow()
+        self._probes_started = []
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh_state(time.monotonic())
+            return self._state
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._refresh_state(now)
+            if self._state == STATE_CLOSED:
+                return True
+
+            if self._state == STATE_HALF_OPEN:
+                # A probe that never reported back (e.g. cancelled) frees its slot after recovery_timeout.
+                self._probes_started = [
+                    started for started in self._probes_started
+                    if now - started < max(self.recovery_timeout, 1.0)
+                ]
+                if len(self._probes_started) < self.half_open_max_calls:
+                    self._probes_started.append(now)
+                    return True
+
+            self.rejected_calls += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.total_successes += 1
+            self._consecutive_failures = 0
+            if self._state != STATE_CLOSED:
+                logger.info("Circuit %s closed, upstream recovered", self.name)
+            self._state = STATE_CLOSED
+            self._opened_at = None
+            self._opened_at_wall = None
+            self._probes_started = []
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.total_failures += 1
+            self._consecutive_failures += 1
+            self._refresh_state(now)
+            if self._state == STATE_HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._open(now)
+
+    def retry_after_seconds(self) -> float:
+        with self._lock:
+            if self._state != STATE_OPEN or self._opened_at is None:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> Dict[str, object]:
+        state = self.state
+        return {
+            "name": self.name,
+            "state": state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout_seconds": self.recovery_timeout,
+            "opened_at": self._opened_at_wall.isoformat() if self._opened_at_wall else None,
+            "retry_after_seconds": round(self.retry_after_seconds(), 1),
+            "times_opened": self.times_opened,
+            "rejected_calls": self.rejected_calls,
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+        }
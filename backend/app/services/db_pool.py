@@ -0,0 +1,132 @@
+import os
+import time
+from typing import Dict, Type
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool, QueuePool
+
+from app.config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_STATEMENT_TIMEOUT_MS,
+)
+from app.services.metrics import Histogram
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class PoolMetrics:
+    """Checkout latency, timeouts and usage for one engine's connection pool."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkout_wait = Histogram(POOL_WAIT_BUCKETS)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.invalidated = 0
+        self.peak_checked_out = 0
+        self._engine: Engine = None
+
+    def attach(self, engine: Engine) -> None:
+        """Listen on the engine's pool events (they carry over when the pool is recreated)."""
+        self._engine = engine
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        self.checkouts += 1
+        pool = self._engine.pool
+        if isinstance(pool, QueuePool):
+            self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        # Stale connections found by pre-ping (e.g. after a Postgres restart) land here.
+        self.invalidated += 1
+
+    def stats(self) -> Dict[str, object]:
+        pool = self._engine.pool if self._engine is not None else None
+        usage: Dict[str, object] = {"pool_class": type(pool).__name__ if pool is not None else None}
+        if isinstance(pool, QueuePool):
+            usage.update({
+                "pool_size": pool.size(),
+                "max_overflow": DB_MAX_OVERFLOW,  # every QueuePool here is built from pool_kwargs()
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+            })
+        usage.update({
+            "peak_checked_out": self.peak_checked_out,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "invalidated": self.invalidated,
+            "checkout_wait_seconds": self.checkout_wait.snapshot(),
+        })
+        return usage
+
+
+class _TimedPoolMixin:
+    metrics: PoolMetrics
+
+    def connect(self):
+        # Covers waiting for a free slot, opening an overflow connection and the pre-ping.
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.checkout_wait.observe(time.perf_counter() - started)
+
+
+def timed_pool_class(base: Type[Pool], metrics: PoolMetrics) -> Type[Pool]:
+    # A class per engine rather than an instance attribute: engine.dispose() rebuilds the pool from its class.
+    return type(f"Timed{base.__name__}", (_TimedPoolMixin, base), {"metrics": metrics})
+
+
+def engine_options(url: str, metrics: PoolMetrics) -> Dict[str, object]:
+    """create_engine()/create_async_engine() keyword arguments built from the DB_* settings."""
+    parsed = make_url(url)
+    pool_class = parsed.get_dialect().get_pool_class(parsed)
+    options: Dict[str, object] = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+    }
+    # In-memory sqlite uses a single shared connection; sizing only applies to queue pools.
+    if issubclass(pool_class, QueuePool):
+        options.update({
+            "poolclass": timed_pool_class(pool_class, metrics),
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        })
+    if DB_STATEMENT_TIMEOUT_MS > 0 and parsed.get_backend_name() == "postgresql":
+        if parsed.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+def max_connections_per_process() -> int:
+    # Sync + async engine; multiply by the uvicorn worker count to compare with Postgres max_connections.
+    return 2 * (DB_POOL_SIZE + max(0, DB_MAX_OVERFLOW))
+
+
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+
+
+def db_pool_stats() -> Dict[str, object]:
+    return {
+        "pid": os.getpid(),
+        "max_connections_per_process": max_connections_per_process(),
+        "pool_timeout_seconds": DB_POOL_TIMEOUT_SECONDS,
+        "statement_timeout_ms": DB_STATEMENT_TIMEOUT_MS,
+        "sync": sync_pool_metrics.stats(),
+        "async": async_pool_metrics.stats(),
+    }
@@ -0,0 +1,80 @@
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import AsyncSessionLocal
+from app.models.models import Chunk, Embedding, File, OCRResult
+from app.services.pdf_processor import DocumentError, pdf_extractor
+
+logger = logging.getLogger(__name__)
+
+PDF_FILETYPE = "application/pdf"
+
+# category key -> upload folder name
+TRAINING_CATEGORIES = {
+    "curriculum": "หลักสูตร",
+    "regulation": "ระเบียบ",
+    "course_structure": "โครงสร้างรายวิชา",
+}
+_CATEGORY_BY_FOLDER = {label: key for key, label in TRAINING_CATEGORIES.items()}
+
+# (db, pages_done, pages_total); runs inside the transaction that stores the pages.
+ProgressCallback = Callable[[AsyncSession, int, int], Awaitable[None]]
+
+
+def category_for_path(path: str) -> Optional[str]:
+    """Uploads are stored under UPLOAD_DIR/<category folder>/<file>, so the parent folder names the category."""
+    return _CATEGORY_BY_FOLDER.get(os.path.basename(os.path.dirname(path)))
+
+
+async def register_uploaded_file(db: AsyncSession, path: str, user_id: Optional[int]) -> File:
+    """Create the File row for a saved upload, or reuse it when the same path is uploaded again (caller commits)."""
+    file = (await db.execute(select(File).where(File.raw_path == path))).scalars().first()
+    if file is None:
+        file = File(filename=os.path.basename(path), filetype=PDF_FILETYPE, raw_path=path)
+        db.add(file)
+    file.user_id = user_id
+    file.uploaded_at = datetime.utcnow()
+    await db.flush()
+    return file
+
+
+async def clear_file_results(db: AsyncSession, file_id: int) -> None:
+    """Delete a file's OCR pages and everything derived from them (bulk deletes skip ORM cascades)."""
+    ocr_ids = select(OCRResult.id).where(OCRResult.file_id == file_id)
+    chunk_ids = select(Chunk.id).where(Chunk.ocr_result_id.in_(ocr_ids))
+    await db.execute(delete(Embedding).where(Embedding.chunk_id.in_(chunk_ids)))
+    await db.execute(delete(Chunk).where(Chunk.ocr_result_id.in_(ocr_ids)))
+    await db.execute(delete(OCRResult).where(OCRResult.file_id == file_id))
+
+
+async def ingest_file(file_id: int, on_progress: Optional[ProgressCallback] = None) -> int:
+    """Extract every page of a stored PDF into OCRResult rows (one per page). Returns the page count."""
+    async with AsyncSessionLocal() as db:
+        file = await db.get(File, file_id)
+        if file is None:
+            raise DocumentError(f"File {file_id} not found")
+        path = file.raw_path
+        page_count = await pdf_extractor.page_count(path)
+        await clear_file_results(db, file_id)
+        if on_progress is not None:
+            await on_progress(db, 0, page_count)
+        await db.commit()
+
+        pages_done = 0
+        async for batch in pdf_extractor.iter_pages(path, page_count):
+            db.add_all([
+                OCRResult(file_id=file_id, engine=page.engine, page_number=page.page_number, text=page.text)
+                for page in batch
+            ])
+            pages_done += len(batch)
+            if on_progress is not None:
+                await on_progress(db, pages_done, page_count)
+            await db.commit()
+    logger.info("Ingested %s pages from %s", page_count, path)
+    return page_count
+
@@ -0,0 +1,298 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import (
+    DOCUMENT_JOB_CONCURRENCY,
+    DOCUMENT_JOB_POLL_SECONDS,
+    DOCUMENT_JOB_MAX_ATTEMPTS,
+    DOCUMENT_JOB_RETRY_BASE_SECONDS,
+    DOCUMENT_JOB_LEASE_SECONDS,
+)
+from app.models.database import AsyncSessionLocal
+from app.models.models import DocumentJob
+from app.services.document_ingest import ingest_file
+from app.services.chunker import rechunk_file
+from app.services.pdf_processor import DocumentError
+from app.services.answer_cache import answer_cache
+
+logger = logging.getLogger(__name__)
+
+
+def is_permanent_document_error(error: Exception) -> bool:
+    # A corrupt/encrypted PDF or a missing file fails the same way on every retry.
+    return isinstance(error, DocumentError)
+
+
+async def enqueue_document_job(db: AsyncSession, file_id: int) -> DocumentJob:
+    """Queue processing for a file (caller commits). A job still pending for the same file is reused."""
+    job = (
+        await db.execute(
+            select(DocumentJob)
+            .where(DocumentJob.file_id == file_id, DocumentJob.status == "pending")
+            .order_by(DocumentJob.id.desc())
+        )
+    ).scalars().first()
+    if job is None:
+        job = DocumentJob(file_id=file_id, status="pending")
+        db.add(job)
+    job.attempts = 0
+    job.last_error = None
+    job.next_attempt_at = datetime.utcnow()
+    await db.flush()
+    event.listen(db.sync_session, "after_commit", _wake_worker_after_commit, once=True)
+    return job
+
+
+def _wake_worker_after_commit(session) -> None:
+    document_job_worker.wake()
+
+
+def job_progress(job: DocumentJob) -> Dict[str, object]:
+    return {
+        "job_id": job.id,
+        "file_id": job.file_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "pages_total": job.pages_total,
+        "pages_done": job.pages_done,
+        "progress": round(job.pages_done / job.pages_total, 4) if job.pages_total else (1.0 if job.status == "done" else 0.0),
+        "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class DocumentJobWorker:
+    """
+    Asyncio task that drains the document_jobs table, running up to `concurrency` ingestions at once.
+    Failed jobs are retried with exponential backoff until max_attempts; a heartbeat renews the lease.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        poll_seconds: float = 5,
+        max_attempts: int = 3,
+        retry_base_seconds: float = 30,
+        lease_seconds: float = 600,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        logger.info("Document job worker started (concurrency=%s)", self.concurrency)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        tasks = [self._task, *self._running]
+        for task in tasks:
+            task.cancel()
+        # Interrupted jobs stay "running" and are picked up again once their lease expires.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._running.clear()
+
+    def wake(self) -> None:
+        if self._loop is None or self._wake is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            free_slots = self.concurrency - len(self._running)
+            if free_slots > 0:
+                try:
+                    claimed = await self._claim(free_slots)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Claiming document jobs failed: %s", e)
+                    claimed = []
+                for job_id, file_id in claimed:
+                    task = asyncio.ensure_future(self._process(job_id, file_id))
+                    self._running.add(task)
+                    task.add_done_callback(self._job_finished)
+                if len(claimed) == free_slots:
+                    continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def _job_finished(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _claim(self, limit: int) -> List[tuple]:
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            # Jobs left "running" by a crashed or restarted worker go back to the queue after the lease.
+            await db.execute(
+                update(DocumentJob)
+                .where(
+                    DocumentJob.status == "running",
+                    DocumentJob.locked_at < now - timedelta(seconds=self.lease_seconds),
+                )
+                .values(status="pending", locked_at=None)
+            )
+            # Never run two jobs for the same file at once (a re-upload while the first is still going).
+            active = aliased(DocumentJob)
+            file_busy = (
+                select(active.id)
+                .where(active.file_id == DocumentJob.file_id, active.status == "running")
+                .exists()
+            )
+            jobs = (
+                await db.execute(
+                    select(DocumentJob)
+                    .where(DocumentJob.status == "pending", DocumentJob.next_attempt_at <= now, ~file_busy)
+                    .order_by(DocumentJob.next_attempt_at, DocumentJob.id)
+                    .limit(limit)
+                    .with_for_update(skip_locked=True)
+                )
+            ).scalars().all()
+            claimed = []
+            for job in jobs:
+                if any(file_id == job.file_id for _, file_id in claimed):
+                    continue
+                job.status = "running"
+                job.attempts += 1
+                job.locked_at = now
+                job.started_at = now
+                job.finished_at = None
+                job.pages_done = 0
+                claimed.append((job.id, job.file_id))
+            await db.commit()
+            return claimed
+
+    async def _process(self, job_id: int, file_id: int) -> None:
+        async def on_progress(db: AsyncSession, pages_done: int, pages_total: int) -> None:
+            await db.execute(
+                update(DocumentJob)
+                .where(DocumentJob.id == job_id)
+                .values(pages_done=pages_done, pages_total=pages_total, locked_at=datetime.utcnow())
+            )
+
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id))
+        try:
+            try:
+                await ingest_file(file_id, on_progress=on_progress)
+                # Chunking is CPU-bound regex work over the whole document; keep it off the event loop.
+                await asyncio.get_running_loop().run_in_executor(None, rechunk_file, file_id)
+            finally:
+                heartbeat.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._record_failure(job_id, e)
+            return
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(DocumentJob)
+                .where(DocumentJob.id == job_id)
+                .values(status="done", locked_at=None, last_error=None, finished_at=datetime.utcnow())
+            )
+            await db.commit()
+        self.completed += 1
+        logger.info("Document job %s (file %s) done", job_id, file_id)
+        # The new chunks can change answers: drop cached RAG responses in every worker.
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, answer_cache.invalidate_all)
+        except OSError as e:
+            logger.error("Answer cache invalidation failed: %s", e)
+
+    async def _heartbeat(self, job_id: int) -> None:
+        # Keep the lease fresh while a long OCR batch or rechunk_file runs without reporting progress.
+        interval = max(1.0, self.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(DocumentJob)
+                        .where(DocumentJob.id == job_id, DocumentJob.status == "running")
+                        .values(locked_at=datetime.utcnow())
+                    )
+                    await db.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Heartbeat for document job %s failed: %s", job_id, e)
+
+    async def _record_failure(self, job_id: int, error: Exception) -> None:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(DocumentJob, job_id)
+            if job is None:
+                return
+            job.last_error = str(error)[:1000]
+            job.locked_at = None
+            if is_permanent_document_error(error) or job.attempts >= self.max_attempts:
+                job.status = "failed"
+                job.finished_at = datetime.utcnow()
+                self.failed += 1
+                logger.error("Document job %s failed after %s attempts: %s", job_id, job.attempts, error)
+            else:
+                delay = self.retry_base_seconds * (2 ** (job.attempts - 1))
+                job.status = "pending"
+                job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                self.retried += 1
+                logger.warning("Document job %s failed (attempt %s), retrying in %.0fs: %s", job_id, job.attempts, delay, error)
+            await db.commit()
+
+    async def stats(self, db: AsyncSession) -> Dict[str, object]:
+        rows = await db.execute(select(DocumentJob.status, func.count(DocumentJob.id)).group_by(DocumentJob.status))
+        by_status = dict(rows.all())
+        return {
+            "running": self._task is not None,
+            "concurrency": self.concurrency,
+            "active": len(self._running),
+            "pending": by_status.get("pending", 0),
+            "in_progress": by_status.get("running", 0),
+            "done": by_status.get("done", 0),
+            "failed": by_status.get("failed", 0),
+            "completed_by_this_worker": self.completed,
+            "retried_by_this_worker": self.retried,
+            "failed_by_this_worker": self.failed,
+        }
+
+
+document_job_worker = DocumentJobWorker(
+    concurrency=DOCUMENT_JOB_CONCURRENCY,
+    poll_seconds=DOCUMENT_JOB_POLL_SECONDS,
+    max_attempts=DOCUMENT_JOB_MAX_ATTEMPTS,
+    retry_base_seconds=DOCUMENT_JOB_RETRY_BASE_SECONDS,
+    lease_seconds=DOCUMENT_JOB_LEASE_SECONDS,
+)
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.config import (
+    SMTP_HOST,
+    SMTP_PORT,
+    SMTP_USER,
+    SMTP_PASS,
+    SMTP_FROM,
+    SMTP_STARTTLS,
+    SMTP_AUTH_ENABLED,
+    SMTP_TIMEOUT_SECONDS,
+    SMTP_CONNECTION_IDLE_SECONDS,
+    SMTP_MAX_MESSAGES_PER_CONNECTION,
+    EMAIL_OUTBOX_BATCH_SIZE,
+    EMAIL_OUTBOX_POLL_SECONDS,
+    EMAIL_OUTBOX_MAX_ATTEMPTS,
+    EMAIL_OUTBOX_RETRY_BASE_SECONDS,
+    EMAIL_OUTBOX_LEASE_SECONDS,
+)
+from app.models.database import SessionLocal
+from app.models.models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# session.info flags: listener registered / emails queued since the last commit
+OUTBOX_LISTENER_KEY = "email_outbox_listener"
+OUTBOX_PENDING_KEY = "email_outbox_pending"
+
+# Gmail app passwords are often copied with spaces for readability.
+SMTP_PASS_NORMALIZED = SMTP_PASS.replace(" ", "") if SMTP_PASS else ""
+
+def is_permanent_smtp_error(error: Exception) -> bool:
+    # 5xx replies (unknown mailbox, rejected sender, bad credentials) will not succeed on retry; 4xx will.
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+def is_session_smtp_error(error: Exception) -> bool:
+    # Refusals of one message leave the session usable (smtplib has already sent RSET);
+    # anything else (disconnects, timeouts, auth) means the connection must be rebuilt.
+    return not isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError))
+
+
+def smtp_configured() -> bool:
+    if not SMTP_HOST:
+        return False
+    return not SMTP_AUTH_ENABLED or bool(SMTP_USER and SMTP_PASS_NORMALIZED)
+
+
+def build_html_message(to_email: str, subject: str, html_body: str) -> MIMEMultipart:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = subject
+    msg["From"] = SMTP_FROM
+    msg["To"] = to_email
+    msg.attach(MIMEText(html_body, "html"))
+    return msg
+
+
+def enqueue_email(db: Session, kind: str, to_email: str, subject: str, html_body: str) -> EmailOutbox:
+    """Add an email to the outbox (caller commits). The worker picks it up after the commit."""
+    email = EmailOutbox(
+        kind=kind,
+        to_email=to_email,
+        subject=subject,
+        html_body=html_body,
+        status="pending",
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(email)
+    if not smtp_configured():
+        logger.error("SMTP is not configured: %s email stays queued in the outbox until it is", kind)
+    db.info[OUTBOX_PENDING_KEY] = True
+    if not db.info.get(OUTBOX_LISTENER_KEY):
+        # One listener per session, however many emails it queues.
+        event.listen(db, "after_commit", _wake_worker_after_commit)
+        db.info[OUTBOX_LISTENER_KEY] = True
+    return email
+
+
+def _wake_worker_after_commit(session: Session) -> None:
+    if session.info.pop(OUTBOX_PENDING_KEY, False):
+        email_outbox_worker.wake()
+
+
+class SMTPConnection:
+    """
+    One authenticated SMTP session reused across sends.
+    Reconnects after the server drops it, after idle_seconds, or after max_messages sends.
+    """
+
+    def __init__(self, idle_seconds: float, max_messages: int):
+        self.idle_seconds = idle_seconds
+        self.max_messages = max(1, max_messages)
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._sent_on_connection = 0
+        self.connects = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_AUTH_ENABLED:
+            server.login(SMTP_USER, SMTP_PASS_NORMALIZED)
+        self.connects += 1
+        self._sent_on_connection = 0
+        return server
+
+    def _get(self) -> smtplib.SMTP:
+        stale = time.monotonic() - self._last_used > self.idle_seconds
+        if self._server is not None and (stale or self._sent_on_connection >= self.max_messages):
+            self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def send(self, msg: MIMEMultipart) -> None:
+        server = self._get()
+        try:
+            server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server timed out our idle session; retry once on a fresh connection.
+            self.close()
+            server = self._get()
+            server.send_message(msg)
+        self._sent_on_connection += 1
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
+
+
+class EmailOutboxWorker:
+    """
+    Background task that drains the email_outbox table in batches over a reused SMTP connection.
+    Failed sends are retried with exponential backoff until max_attempts.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        poll_seconds: float = 5,
+        max_attempts: int = 6,
+        retry_base_seconds: float = 30,
+        lease_seconds: float = 300,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self.connection = SMTPConnection(SMTP_CONNECTION_IDLE_SECONDS, SMTP_MAX_MESSAGES_PER_CONNECTION)
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        logger.info("Email outbox worker started (batch_size=%s)", self.batch_size)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._loop.run_in_executor(None, self.connection.close)
+
+    def wake(self) -> None:
+        # Safe from the event loop and from threadpool handlers.
+        if self._loop is None or self._wake is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Cleared before the batch so a wake() during it triggers the next pass immediately.
+            self._wake.clear()
+            try:
+                processed = await loop.run_in_executor(None, self.process_batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Email outbox batch failed: %s", e)
+                processed = 0
+            if processed >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim(self, db: Session) -> list:
+        now = datetime.utcnow()
+        # Rows left in "sending" by a crashed worker go back to the queue after the lease expires.
+        db.query(EmailOutbox).filter(
+            EmailOutbox.status == "sending",
+            EmailOutbox.locked_at < now - timedelta(seconds=self.lease_seconds),
+        ).update({EmailOutbox.status: "pending", EmailOutbox.locked_at: None}, synchronize_session=False)
+
+        rows = (
+            db.query(EmailOutbox)
+            .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for row in rows:
+            row.status = "sending"
+            row.locked_at = now
+        db.commit()
+        return rows
+
+    def process_batch(self) -> int:
+        """Send one batch of due emails. Runs in a worker thread; returns the number of rows handled."""
+        if not smtp_configured():
+            return 0
+        db = SessionLocal()
+        try:
+            rows = self._claim(db)
+            for row in rows:
+                if not self._renew_lease(db, row):
+                    logger.warning("Lease on email %s expired and it was reclaimed; not sending it here", row.id)
+                    continue
+                self._deliver(row)
+                db.commit()
+            if not rows:
+                self.connection.close_if_idle()
+            return len(rows)
+        finally:
+            db.close()
+
+    def _renew_lease(self, db: Session, row: EmailOutbox) -> bool:
+        """Restart the lease just before sending, so a slow batch never outlives it. False if it was lost."""
+        claimed_at = row.locked_at
+        renewed = (
+            db.query(EmailOutbox)
+            .filter(EmailOutbox.id == row.id, EmailOutbox.status == "sending", EmailOutbox.locked_at == claimed_at)
+            .update({EmailOutbox.locked_at: datetime.utcnow()}, synchronize_session=False)
+        )
+        db.commit()
+        return bool(renewed)
+
+    def _deliver(self, row: EmailOutbox) -> None:
+        row.attempts += 1
+        try:
+            self.connection.send(build_html_message(row.to_email, row.subject, row.html_body))
+        except Exception as e:
+            if is_session_smtp_error(e):
+                self.connection.close()
+            row.last_error = str(e)[:1000]
+            row.locked_at = None
+            if is_permanent_smtp_error(e) or row.attempts >= self.max_attempts:
+                row.status = "failed"
+                self.failed += 1
+                logger.error("Giving up on %s email %s after %s attempts: %s", row.kind, row.id, row.attempts, e)
+            else:
+                delay = self.retry_base_seconds * (2 ** (row.attempts - 1))
+                row.status = "pending"
+                row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                self.retried += 1
+                logger.warning("Email %s failed (attempt %s), retrying in %.0fs: %s", row.id, row.attempts, delay, e)
+            return
+
+        row.status = "sent"
+        row.sent_at = datetime.utcnow()
+        row.locked_at = None
+        row.last_error = None
+        self.sent += 1
+        logger.info("Sent %s email %s", row.kind, row.id)
+
+    def stats(self, db: Session) -> Dict[str, object]:
+        by_status = dict(db.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+        return {
+            "running": self._task is not None,
+            "smtp_configured": smtp_configured(),
+            "pending": by_status.get("pending", 0),
+            "sending": by_status.get("sending", 0),
+            "sent": by_status.get("sent", 0),
+            "failed": by_status.get("failed", 0),
+            "sent_by_this_worker": self.sent,
+            "retried_by_this_worker": self.retried,
+            "failed_by_this_worker": self.failed,
+            "smtp_connects": self.connection.connects,
+        }
+
+
+email_outbox_worker = EmailOutboxWorker(
+    batch_size=EMAIL_OUTBOX_BATCH_SIZE,
+    poll_seconds=EMAIL_OUTBOX_POLL_SECONDS,
+    max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+    retry_base_seconds=EMAIL_OUTBOX_RETRY_BASE_SECONDS,
+    lease_seconds=EMAIL_OUTBOX_LEASE_SECONDS,
+)
@@ -0,0 +1,115 @@
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.config import FAQ_MATCH_ENABLED, FAQ_MATCH_THRESHOLD
+from app.services.bm25_index import BM25Index
+from app.services.thai_text import tokenize
+
+logger = logging.getLogger(__name__)
+
+FAQ_LLM_PROVIDER = "faq_index"
+
+
+@dataclass
+class FAQMatch:
+    faq_id: int
+    question: str
+    answer: str
+    category: Optional[str]
+    score: float
+    confidence: float
+
+
+class FAQMatcher:
+    """
+    BM25 index over active FAQ questions used to answer common questions without calling RAG.
+
+    Confidence is the geometric mean of how much of the FAQ question the query covers
+    (BM25 score relative to the FAQ's self-score) and how much of the query the FAQ covers,
+    so short fragments and long unrelated questions both stay below the threshold.
+    """
+
+    def __init__(self, threshold: float = 0.8, enabled: bool = True):
+        self.threshold = threshold
+        self.enabled = enabled
+        self._index = BM25Index()
+        self._faqs: Dict[int, Tuple[str, str, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self.signature: Optional[Tuple[int, Optional[str]]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._faqs)
+
+    def upsert(self, faq_id: int, question: str, answer: str, category: Optional[str] = None) -> None:
+        with self._lock:
+            self._faqs[faq_id] = (question, answer, category)
+            self._index.add(faq_id, tokenize(question))
+
+    def remove(self, faq_id: int) -> None:
+        with self._lock:
+            self._faqs.pop(faq_id, None)
+            self._index.remove(faq_id)
+
+    def rebuild(self, faqs: Iterable[Tuple[int, str, str, Optional[str]]], signature=None) -> None:
+        with self._lock:
+            self._index.clear()
+            self._faqs.clear()
+            for faq_id, question, answer, category in faqs:
+                self._faqs[faq_id] = (question, answer, category)
+                self._index.add(faq_id, tokenize(question))
+            self.signature = signature
+        logger.info("FAQ index rebuilt with %s entries", len(self._faqs))
+
+    def match(self, text: str) -> Optional[FAQMatch]:
+        if not self.enabled or not text:
+            return None
+
+        tokens = tokenize(text)
+        if not tokens:
+            return None
+
+        with self._lock:
+            results = self._index.search(tokens, top_k=1)
+            if not results:
+                self.misses += 1
+                return None
+
+            faq_id, score = results[0]
+            doc_terms = self._index.doc_terms(faq_id)
+            self_score = self._index.score(doc_terms, faq_id)
+            query_terms = set(tokens)
+            query_coverage = len(query_terms.intersection(doc_terms)) / float(len(query_terms))
+            doc_coverage = min(1.0, score / self_score) if self_score > 0 else 0.0
+            confidence = math.sqrt(doc_coverage * query_coverage)
+
+            if confidence < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            question, answer, category = self._faqs[faq_id]
+            return FAQMatch(
+                faq_id=faq_id,
+                question=question,
+                answer=answer,
+                category=category,
+                score=score,
+                confidence=confidence,
+            )
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._faqs),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+faq_matcher = FAQMatcher(threshold=FAQ_MATCH_THRESHOLD, enabled=FAQ_MATCH_ENABLED)
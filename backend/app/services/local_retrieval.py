@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.config import (
+    VECTOR_INDEX_REFRESH_SECONDS,
+    LOCAL_RETRIEVAL_ENABLED,
+    LOCAL_RETRIEVAL_TOP_K,
+    LOCAL_RETRIEVAL_CANDIDATES,
+    LOCAL_RETRIEVAL_RRF_K,
+    LOCAL_RETRIEVAL_REFRESH_SECONDS,
+    EMBEDDING_SERVICE_URL,
+    VECTOR_INDEX_EMBEDDING_API,
+)
+from app.models.database import AsyncSessionLocal, SessionLocal
+from app.models.models import Chunk
+from app.services.document_ingest import TRAINING_CATEGORIES
+from app.services.rag_client import get_embedding_client
+from app.services.thai_text import tokenize
+from app.services.vector_index import load_vector_index, refresh_vector_index_if_stale, vector_index
+
+logger = logging.getLogger(__name__)
+
+# Category codes stored per chunk row; 0 = no category.
+CATEGORY_CODES = {key: code for code, key in enumerate(TRAINING_CATEGORIES, start=1)}
+_CATEGORY_BY_NAME = {
+    **{key.lower(): key for key in TRAINING_CATEGORIES},
+    **{label: key for key, label in TRAINING_CATEGORIES.items()},
+}
+
+
+def category_for_domain(domain: Optional[str]) -> Optional[str]:
+    """Map a chat `domain` (category key or its Thai folder label) to a category; anything else means no filter."""
+    if not domain:
+        return None
+    return _CATEGORY_BY_NAME.get(domain.strip().lower()) or _CATEGORY_BY_NAME.get(domain.strip())
+
+
+@dataclass
+class Passage:
+    chunk_id: int
+    text: str
+    filename: Optional[str]
+    page: Optional[int]
+    category: Optional[str]
+    score: float
+    bm25_rank: Optional[int]
+    vector_rank: Optional[int]
+
+
+class _Segment:
+    """CSR postings for a contiguous range of chunk rows: term id -> (row, term frequency)."""
+
+    def __init__(self, terms: np.ndarray, rows: np.ndarray, tf: np.ndarray):
+        order = np.argsort(terms, kind="stable")
+        terms, self.rows, self.tf = terms[order], rows[order], tf[order]
+        self.terms, starts = np.unique(terms, return_index=True)
+        self.ptr = np.append(starts, terms.shape[0]).astype(np.int64)
+
+    def term_column(self) -> np.ndarray:
+        return np.repeat(self.terms, np.diff(self.ptr))
+
+    def postings(self, term_id: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        pos = int(np.searchsorted(self.terms, term_id))
+        if pos >= self.terms.shape[0] or self.terms[pos] != term_id:
+            return None
+        start, stop = self.ptr[pos], self.ptr[pos + 1]
+        return self.rows[start:stop], self.tf[start:stop]
+
+    @property
+    def nbytes(self) -> int:
+        return self.terms.nbytes + self.ptr.nbytes + self.rows.nbytes + self.tf.nbytes
+
+
+class _LexicalSnapshot:
+    """
+    State the query path reads; a sync builds a new one and swaps it in.
+    Appends share (and only extend) the vocabulary, so ids the old snapshot knows never change.
+    """
+
+    def __init__(self, vocab: Optional[Dict[str, int]] = None):
+        self.vocab: Dict[str, int] = vocab if vocab is not None else {}
+        self.segments: List[_Segment] = []
+        self.segment_rows: List[int] = []
+        self.chunk_ids = np.empty(0, dtype=np.int64)
+        self.categories = np.empty(0, dtype=np.int8)
+        self.doc_len = np.empty(0, dtype=np.int32)
+        self.df = np.empty(0, dtype=np.int32)
+        self.total_len = 0
+        self.last_chunk_id = 0
+        self.rows_seen = 0
+        self.by_category: Dict[int, np.ndarray] = {}
+
+    @property
+    def count(self) -> int:
+        return int(self.chunk_ids.shape[0])
+
+
+class ChunkRetriever:
+    """
+    In-process hybrid retrieval over the chunks table.
+
+    Lexical side: Okapi BM25 (same scoring as BM25Index) over thai_text.tokenize, stored as numpy
+    CSR segments instead of dicts so a million chunks fit in memory; chunk text stays in the database.
+    Vector side: the shared vector_index. Both ranked lists are combined with reciprocal rank
+    fusion, optionally restricted to one document category.
+    """
+
+    def __init__(
+        self,
+        rrf_k: int = 60,
+        candidates: int = 50,
+        k1: float = 1.5,
+        b: float = 0.75,
+        segment_rows: int = 100000,
+        fetch_rows: int = 2000,
+    ):
+        self.rrf_k = rrf_k
+        self.candidates = max(1, candidates)
+        self.k1 = k1
+        self.b = b
+        self.segment_rows = max(1, segment_rows)
+        self.fetch_rows = max(1, fetch_rows)
+        self._snapshot = _LexicalSnapshot()
+        self._refresh_lock = threading.Lock()
+        # False until the first sync finishes; searches before that are answered "not ready".
+        self.ready = False
+        self.not_ready_searches = 0
+        self.rebuilds = 0
+        self.appends = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def __len__(self) -> int:
+        return self._snapshot.count
+
+    # ------------------------------------------------------------------ build
+
+    def extend(
+        self,
+        batches: Iterable[Sequence[Tuple[int, str, Optional[dict]]]],
+        base: Optional[_LexicalSnapshot] = None,
+    ) -> _LexicalSnapshot:
+        """
+        Build a snapshot with (chunk_id, content, chunk_metadata) rows appended to `base` (default: the
+        current one) and make it current. Postings are cut into segments of at most segment_rows chunks;
+        an under-filled last segment is merged with the new rows once per call.
+        """
+        base = base if base is not None else self._snapshot
+        snap = _LexicalSnapshot(base.vocab)
+        vocab = snap.vocab
+        snap.segments, snap.segment_rows = list(base.segments), list(base.segment_rows)
+        chunk_ids, lengths = array("q"), array("i")
+        categories = array("b")
+        terms, doc_rows, tfs = array("i"), array("i"), array("H")
+        added_df: List[np.ndarray] = []
+        tail: Optional[_Segment] = None
+        tail_rows = 0
+        if snap.segments and snap.segment_rows[-1] < self.segment_rows:
+            tail, tail_rows = snap.segments.pop(), snap.segment_rows.pop()
+
+        def cut_segment() -> None:
+            nonlocal tail, tail_rows, terms, doc_rows, tfs
+            parts = [
+                np.frombuffer(terms, dtype=np.int32),
+                np.frombuffer(doc_rows, dtype=np.int32),
+                np.frombuffer(tfs, dtype=np.uint16),
+            ]
+            # Each (term, row) pair appears once, so postings per term are that term's document frequency.
+            added_df.append(np.bincount(parts[0]))
+            if tail is not None:
+                parts = [
+                    np.concatenate([tail.term_column(), parts[0]]),
+                    np.concatenate([tail.rows, parts[1]]),
+                    np.concatenate([tail.tf, parts[2]]),
+                ]
+            if tail_rows:
+                snap.segments.append(_Segment(*parts))
+                snap.segment_rows.append(tail_rows)
+            tail, tail_rows = None, 0
+            terms, doc_rows, tfs = array("i"), array("i"), array("H")
+
+        row = base.count
+        for batch in batches:
+            for chunk_id, content, metadata in batch:
+                if tail_rows >= self.segment_rows:
+                    cut_segment()
+                counts = Counter(tokenize(content or ""))
+                for term, freq in counts.items():
+                    term_id = vocab.get(term)
+                    if term_id is None:
+                        term_id = vocab[term] = len(vocab)
+                    terms.append(term_id)
+                    doc_rows.append(row)
+                    tfs.append(min(freq, 65535))
+                chunk_ids.append(chunk_id)
+                categories.append(CATEGORY_CODES.get((metadata or {}).get("category"), 0))
+                lengths.append(sum(counts.values()))
+                row += 1
+                tail_rows += 1
+        cut_segment()
+
+        new_ids = np.frombuffer(chunk_ids, dtype=np.int64)
+        snap.chunk_ids = np.concatenate([base.chunk_ids, new_ids])
+        snap.categories = np.concatenate([base.categories, np.frombuffer(categories, dtype=np.int8)])
+        snap.doc_len = np.concatenate([base.doc_len, np.frombuffer(lengths, dtype=np.int32)])
+        snap.df = np.zeros(len(vocab), dtype=np.int32)
+        snap.df[:base.df.shape[0]] = base.df
+        for counts in added_df:
+            snap.df[:counts.shape[0]] += counts.astype(np.int32)
+        snap.total_len = base.total_len + int(sum(lengths))
+        snap.last_chunk_id = max(base.last_chunk_id, int(new_ids.max()) if new_ids.size else 0)
+        snap.rows_seen = base.rows_seen + int(new_ids.shape[0])
+        snap.by_category = {
+            code: np.sort(snap.chunk_ids[snap.categories == code]) for code in CATEGORY_CODES.values()
+        }
+        self._snapshot = snap
+        return snap
+
+    def _load(self, db: Session, base: _LexicalSnapshot) -> _LexicalSnapshot:
+        rows = db.execute(
+            select(Chunk.id, Chunk.content, Chunk.chunk_metadata)
+            .where(Chunk.id > base.last_chunk_id)
+            .order_by(Chunk.id)
+            .execution_options(yield_per=self.fetch_rows)
+        )
+        return self.extend(
+            ([(row.id, row.content, row.chunk_metadata) for row in batch] for batch in rows.partitions()),
+            base=base,
+        )
+
+    def sync(self, db: Session) -> bool:
+        """Index chunks added since the last sync; rebuild from scratch if any indexed chunk was deleted."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return False  # another thread is already syncing; keep serving the current snapshot
+        try:
+            current = self._snapshot
+            covered, newest = db.execute(
+                select(func.count(Chunk.id).filter(Chunk.id <= current.last_chunk_id), func.max(Chunk.id))
+            ).one()
+            if covered != current.rows_seen:
+                # Document re-processing deletes chunks; BM25 statistics need a clean rebuild.
+                self._load(db, _LexicalSnapshot())
+                self.rebuilds += 1
+                self.ready = True
+                logger.info("Chunk retriever rebuilt with %s chunks", len(self))
+                return True
+            if newest is not None and newest > current.last_chunk_id:
+                self._load(db, current)
+                self.appends += 1
+                self.ready = True
+                logger.info("Chunk retriever indexed %s new chunks", len(self) - current.count)
+                return True
+            self.ready = True
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    # ------------------------------------------------------------------ query
+
+    def bm25_search(self, text: str, k: int, category: Optional[str] = None) -> List[Tuple[int, float]]:
+        snap = self._snapshot
+        n_docs = snap.count
+        term_ids = {snap.vocab[t] for t in tokenize(text) if t in snap.vocab}
+        term_ids = [t for t in term_ids if t < snap.df.shape[0] and snap.df[t] > 0]
+        if not n_docs or not term_ids or k <= 0:
+            return []
+        code = CATEGORY_CODES.get(category) if category else None
+        avg_len = (snap.total_len / n_docs) or 1.0
+        row_parts, weight_parts = [], []
+        for term_id in term_ids:
+            df = int(snap.df[term_id])
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for segment in snap.segments:
+                hit = segment.postings(term_id)
+                if hit is None:
+                    continue
+                rows, tf = hit
+                if code is not None:
+                    keep = snap.categories[rows] == code
+                    rows, tf = rows[keep], tf[keep]
+                tf = tf.astype(np.float32)
+                norm = self.k1 * (1.0 - self.b + self.b * snap.doc_len[rows] / avg_len)
+                row_parts.append(rows)
+                weight_parts.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not row_parts:
+            return []
+        rows = np.concatenate(row_parts)
+        weights = np.concatenate(weight_parts)
+        if rows.shape[0] * 8 < n_docs:
+            # Few postings: aggregate over the touched rows instead of a dense array of every chunk.
+            touched, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+        else:
+            touched = None
+            scores = np.bincount(rows, weights=weights, minlength=n_docs)
+        take = min(k, scores.shape[0])
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        result_rows = touched[top] if touched is not None else top
+        return [
+            (int(snap.chunk_ids[row]), float(scores[i]))
+            for row, i in zip(result_rows, top)
+            if scores[i] > 0
+        ]
+
+    def search(
+        self,
+        text: str,
+        k: int = 5,
+        category: Optional[str] = None,
+        query_vector: Optional[Sequence[float]] = None,
+    ) -> List[Tuple[int, float, Optional[int], Optional[int]]]:
+        """
+        Reciprocal rank fusion of BM25 and vector candidates.
+        Returns (chunk_id, rrf score, bm25 rank, vector rank) best first; ranks are 1-based or None.
+        """
+        started = time.perf_counter()
+        depth = max(k, self.candidates)
+        lexical = self.bm25_search(text, depth, category)
+        semantic: List[Tuple[int, float]] = []
+        if query_vector is not None:
+            allowed = None
+            if category:
+                allowed = self._snapshot.by_category.get(CATEGORY_CODES.get(category), np.empty(0, dtype=np.int64))
+            try:
+                semantic = vector_index.search(query_vector, k=depth, chunk_ids=allowed)
+            except ValueError as e:
+                logger.warning(f"Vector search skipped: {str(e)}")
+
+        fused: Dict[int, List[object]] = {}
+        for ranking, slot in ((lexical, 2), (semantic, 3)):
+            for rank, (chunk_id, _) in enumerate(ranking, start=1):
+                entry = fused.setdefault(chunk_id, [chunk_id, 0.0, None, None])
+                if entry[slot] is None:
+                    entry[slot] = rank
+                    entry[1] += 1.0 / (self.rrf_k + rank)
+        results = sorted(fused.values(), key=lambda entry: (-entry[1], entry[0]))[:k]
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return [tuple(entry) for entry in results]
+
+    def stats(self) -> Dict[str, object]:
+        snap = self._snapshot
+        return {
+            "enabled": LOCAL_RETRIEVAL_ENABLED,
+            "ready": self.ready,
+            "chunks": snap.count,
+            "vocabulary": int(snap.df.shape[0]),
+            "segments": len(snap.segments),
+            "postings_bytes": sum(segment.nbytes for segment in snap.segments),
+            "vector_search": bool(EMBEDDING_SERVICE_URL),
+            "rebuilds": self.rebuilds,
+            "appends": self.appends,
+            "searches": self.searches,
+            "not_ready_searches": self.not_ready_searches,
+            "avg_search_ms": round(self.search_seconds * 1000 / self.searches, 3) if self.searches else None,
+        }
+
+
+chunk_retriever = ChunkRetriever(rrf_k=LOCAL_RETRIEVAL_RRF_K, candidates=LOCAL_RETRIEVAL_CANDIDATES)
+
+_retriever_checked_at = 0.0
+
+
+def load_chunk_retriever() -> None:
+    """Index chunks added since the last sync (first pass of LocalIndexRefresher, or scripts)."""
+    global _retriever_checked_at
+    db = SessionLocal()
+    try:
+        chunk_retriever.sync(db)
+        _retriever_checked_at = time.monotonic()
+    finally:
+        db.close()
+
+
+def refresh_chunk_retriever_if_stale() -> None:
+    """Pick up new or re-processed chunks, at most once per LOCAL_RETRIEVAL_REFRESH_SECONDS."""
+    global _retriever_checked_at
+    now = time.monotonic()
+    if now - _retriever_checked_at < LOCAL_RETRIEVAL_REFRESH_SECONDS:
+        return
+    _retriever_checked_at = now
+    load_chunk_retriever()
+
+
+class LocalIndexRefresher:
+    """
+    Background task that keeps the vector index and the chunk retriever in sync with the database.
+    The first pass runs right after startup and can take minutes on a large corpus; requests never
+    sync or rebuild, they search the current snapshots (see ChunkRetriever.ready).
+    """
+
+    def __init__(self, poll_seconds: float = 30):
+        self.poll_seconds = max(1.0, poll_seconds)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @staticmethod
+    def _sync(steps) -> None:
+        for name, step in steps:
+            try:
+                step()
+            except Exception as e:
+                logger.error(f"{name} sync failed: {str(e)}")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        # Vector index first: it is shared through files, so another worker has often built it already.
+        steps = (("Vector index", load_vector_index), ("Chunk retriever", load_chunk_retriever))
+        while True:
+            await loop.run_in_executor(None, self._sync, steps)
+            steps = (
+                ("Vector index", refresh_vector_index_if_stale),
+                ("Chunk retriever", refresh_chunk_retriever_if_stale),
+            )
+            await asyncio.sleep(self.poll_seconds)
+
+
+local_index_refresher = LocalIndexRefresher(
+    poll_seconds=min(VECTOR_INDEX_REFRESH_SECONDS, LOCAL_RETRIEVAL_REFRESH_SECONDS)
+)
+
+
+async def embed_query(text: str) -> Optional[List[float]]:
+    """Embed a question with EMBEDDING_SERVICE_URL (OpenAI-style or {"embedding": [...]}); None if unavailable."""
+    if not EMBEDDING_SERVICE_URL or not vector_index.stats()["vectors"]:
+        return None
+    try:
+        client = await get_embedding_client()
+        payload: Dict[str, object] = {"input": text}
+        if VECTOR_INDEX_EMBEDDING_API:
+            payload["model"] = VECTOR_INDEX_EMBEDDING_API
+        response = await client.post(EMBEDDING_SERVICE_URL, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        if isinstance(data, dict) and data.get("data"):
+            return data["data"][0]["embedding"]
+        if isinstance(data, dict) and data.get("embedding"):
+            return data["embedding"]
+        if isinstance(data, dict) and data.get("embeddings"):
+            return data["embeddings"][0]
+        logger.warning("Embedding service returned no embedding")
+    except Exception as e:
+        logger.warning(f"Query embedding failed: {str(e)}")
+    return None
+
+
+async def retrieve_passages(
+    question: str,
+    domain: Optional[str] = None,
+    k: Optional[int] = None,
+) -> List[Passage]:
+    """Top passages for a question from the local hybrid index, filtered to the domain's category."""
+    if not LOCAL_RETRIEVAL_ENABLED or not question or not question.strip():
+        return []
+    if not chunk_retriever.ready:
+        # The first BM25 build is still running in the background; callers treat this as no passages.
+        chunk_retriever.not_ready_searches += 1
+        return []
+    k = k or LOCAL_RETRIEVAL_TOP_K
+    category = category_for_domain(domain)
+    query_vector = await embed_query(question)
+    # Scoring is numpy work over the whole corpus; keep it off the event loop.
+    hits = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: chunk_retriever.search(question, k=k, category=category, query_vector=query_vector)
+    )
+    if not hits:
+        return []
+
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(Chunk.id, Chunk.content, Chunk.chunk_metadata).where(Chunk.id.in_([hit[0] for hit in hits]))
+        )
+        chunks = {row.id: row for row in rows}
+    passages = []
+    for chunk_id, score, bm25_rank, vector_rank in hits:
+        row = chunks.get(chunk_id)
+        if row is None:
+            continue  # deleted since the index was refreshed
+        metadata = row.chunk_metadata or {}
+        passages.append(Passage(
+            chunk_id=chunk_id,
+            text=row.content,
+            filename=metadata.get("filename"),
+            page=metadata.get("page"),
+            category=metadata.get("category"),
+            score=score,
+            bm25_rank=bm25_rank,
+            vector_rank=vector_rank,
+        ))
+    return passages
@@ -0,0 +1,42 @@
+import bisect
+import threading
+from typing import Dict, Sequence
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative bucket histogram (Prometheus-style `le` buckets) kept in process memory."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            cumulative = 0
+            buckets: Dict[str, int] = {}
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[f"le_{bound:g}"] = cumulative
+            buckets["le_inf"] = cumulative + self._counts[-1]
+            return {
+                "count": self._count,
+                "sum": round(self._sum, 6),
+                "avg": round(self._sum / self._count, 6) if self._count else 0.0,
+                "max": round(self._max, 6),
+                "buckets": buckets,
+            }
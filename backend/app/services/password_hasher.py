@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar
+
+from passlib.context import CryptContext
+
+from app.config import (
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_ARGON2_TIME_COST,
+    PASSWORD_ARGON2_MEMORY_COST,
+    PASSWORD_ARGON2_PARALLELISM,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# argon2 for new hashes; bcrypt kept so old hashes still verify (and get rehashed on login).
+# Changing the argon2 parameters marks existing argon2 hashes as needing an update too.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__rounds=PASSWORD_ARGON2_TIME_COST,
+    argon2__memory_cost=PASSWORD_ARGON2_MEMORY_COST,
+    argon2__parallelism=PASSWORD_ARGON2_PARALLELISM,
+)
+
+
+class PasswordHasher:
+    """
+    Runs passlib hashing on a dedicated thread pool so argon2/bcrypt never block the event loop.
+    max_workers caps how many hashes run at once; extra calls wait in the pool's queue.
+    workers=0 hashes inline on the caller (only useful for benchmarking).
+    """
+
+    def __init__(self, context: CryptContext, workers: int):
+        self.context = context
+        self.workers = max(0, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        if self.workers == 0:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Return (valid, new_hash); new_hash is set when the stored hash uses deprecated settings."""
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_WORKERS)
@@ -1,33 +1,158 @@
-import os
+import asyncio
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
 
-def process_pdf(filename, upload_folder=None):
+from PyPDF2 import PdfReader
+from PyPDF2.errors import PdfReadError
+
+from app.config import (
+    PDF_INGEST_WORKERS,
+    PDF_PAGES_PER_TASK,
+    PDF_OCR_ENABLED,
+    PDF_OCR_MIN_CHARS,
+    PDF_OCR_DPI,
+    PDF_OCR_LANG,
+)
+
+logger = logging.getLogger(__name__)
+
+TEXT_ENGINE = "pypdf2"
+OCR_ENGINE = "tesseract"
+
+
+@dataclass(frozen=True)
+class PageText:
+    page_number: int  # 1-based
+    text: str
+    engine: str
+
+
+class DocumentError(Exception):
+    """The document itself cannot be processed (missing, corrupt or encrypted); retrying will not help."""
+
+
+def count_pages(path: str) -> int:
+    try:
+        reader = PdfReader(path, strict=False)
+        if reader.is_encrypted:
+            raise DocumentError(f"{path} is encrypted")
+        return len(reader.pages)
+    except (PdfReadError, FileNotFoundError) as e:
+        raise DocumentError(f"Cannot read {path}: {e}") from e
+
+
+def ocr_page(path: str, page_number: int, dpi: int, lang: str) -> Optional[str]:
+    """Rasterize one page with pdf2image and OCR it; None when poppler/tesseract are unavailable."""
+    try:
+        import pytesseract
+        from pdf2image import convert_from_path
+    except ImportError:
+        return None
+    try:
+        images = convert_from_path(path, dpi=dpi, first_page=page_number, last_page=page_number)
+        return "\n".join(pytesseract.image_to_string(image, lang=lang) for image in images)
+    except Exception as e:
+        logger.warning("OCR failed for %s page %s: %s", path, page_number, e)
+        return None
+
+
+def extract_page_range(
+    path: str,
+    start: int,
+    stop: int,
+    ocr_enabled: bool = PDF_OCR_ENABLED,
+    ocr_min_chars: int = PDF_OCR_MIN_CHARS,
+    ocr_dpi: int = PDF_OCR_DPI,
+    ocr_lang: str = PDF_OCR_LANG,
+) -> List[PageText]:
     """
-    Placeholder for PDF processing. 
-    Will implement PyPDF2 extraction after core system is running.
+    Extract pages [start, stop) (0-based). Runs in a pool process, so it opens the PDF itself;
+    pages with almost no text layer (scans) fall back to OCR.
     """
-    return f"PDF processing placeholder for {filename}"
-
-class PDFProcessor:
-    def __init__(self, upload_folder):
-        self.upload_folder = upload_folder
-
-    def process_pdf(self, filename):
-        """Process PDF file and extract text"""
-        # TODO: Implement actual PDF processing with PyPDF2
-        # For now, just return a placeholder
-        return f"Processed {filename}"
-
-    def save_pdf(self, file):
-        """Save uploaded PDF file"""
-        file_path = os.path.join(self.upload_folder, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
-        return file_path
-
-    def delete_pdf(self, filename):
-        """Delete PDF file"""
-        file_path = os.path.join(self.upload_folder, filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        else:
-            raise FileNotFoundError(f"The file {filename} does not exist.")
\ No newline at end of file
+    reader = PdfReader(path, strict=False)
+    pages = []
+    for index in range(start, stop):
+        try:
+            text = (reader.pages[index].extract_text() or "").strip()
+        except Exception as e:
+            logger.warning("Text extraction failed for %s page %s: %s", path, index + 1, e)
+            text = ""
+        engine = TEXT_ENGINE
+        if ocr_enabled and len(text) < ocr_min_chars:
+            ocr_text = ocr_page(path, index + 1, ocr_dpi, ocr_lang)
+            if ocr_text and len(ocr_text.strip()) > len(text):
+                text, engine = ocr_text.strip(), OCR_ENGINE
+        pages.append(PageText(page_number=index + 1, text=text, engine=engine))
+    return pages
+
+
+class PDFExtractor:
+    """
+    Fans the pages of a PDF out across a process pool in batches of up to pages_per_task,
+    so text extraction and OCR of one large document use every core.
+    """
+
+    def __init__(self, workers: int, pages_per_task: int):
+        self.workers = max(1, workers)
+        self.pages_per_task = max(1, pages_per_task)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the server process already runs threads (logging, hashing, DB pools).
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _submit(self, func, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM during OCR); start a fresh pool for the next call.
+            self.shutdown()
+            raise
+
+    async def page_count(self, path: str) -> int:
+        return await self._submit(count_pages, path)
+
+    def batch_size(self, page_count: int) -> int:
+        # Small documents still spread over all workers; large ones cap the batch at pages_per_task.
+        return max(1, min(self.pages_per_task, math.ceil(page_count / self.workers)))
+
+    async def iter_pages(self, path: str, page_count: Optional[int] = None) -> AsyncIterator[List[PageText]]:
+        """Yield each batch of extracted pages as soon as it finishes (not in page order)."""
+        if page_count is None:
+            page_count = await self.page_count(path)
+        size = self.batch_size(page_count)
+        tasks = [
+            asyncio.ensure_future(self._submit(extract_page_range, path, start, min(start + size, page_count)))
+            for start in range(0, page_count, size)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def extract(self, path: str) -> List[PageText]:
+        pages: List[PageText] = []
+        async for batch in self.iter_pages(path):
+            pages.extend(batch)
+        return sorted(pages, key=lambda page: page.page_number)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pdf_extractor = PDFExtractor(PDF_INGEST_WORKERS, PDF_PAGES_PER_TASK)
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.config import AUTH_PRINCIPAL_CACHE_TTL_SECONDS, AUTH_PRINCIPAL_CACHE_MAX_ENTRIES
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Read-only snapshot of the authenticated user, safe to share across requests."""
+
+    id: int
+    name: str
+    email: str
+    role: str
+    is_verified: bool
+
+    @classmethod
+    def from_user(cls, user) -> "UserPrincipal":
+        return cls(
+            id=user.id,
+            name=user.name,
+            email=user.email,
+            role=user.role,
+            is_verified=bool(user.is_verified),
+        )
+
+
+class PrincipalCache:
+    """
+    TTL + LRU cache for get_current_user: token -> user id (bounded by the JWT exp) and user id -> principal.
+    Writers that change a user call invalidate_user; other worker processes pick up the change within the TTL.
+    """
+
+    def __init__(self, ttl_seconds: float = 60, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.enabled = ttl_seconds > 0
+        self.max_entries = max(1, max_entries)
+        self._tokens: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._principals: "OrderedDict[int, Tuple[UserPrincipal, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.token_hits = 0
+        self.token_misses = 0
+        self.principal_hits = 0
+        self.principal_misses = 0
+        self.invalidations = 0
+
+    def _put(self, entries: OrderedDict, key, value) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def get_user_id(self, token: str) -> Optional[int]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                self.token_misses += 1
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._tokens[token]
+                self.token_misses += 1
+                return None
+            self._tokens.move_to_end(token)
+            self.token_hits += 1
+            return user_id
+
+    def set_user_id(self, token: str, user_id: int, token_exp: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+        # Never keep a token past its own exp, so expired tokens are still rejected by jwt.decode.
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+        with self._lock:
+            self._put(self._tokens, token, (user_id, expires_at))
+
+    def get_principal(self, user_id: int) -> Optional[UserPrincipal]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._principals.get(user_id)
+            if entry is None:
+                self.principal_misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                del self._principals[user_id]
+                self.principal_misses += 1
+                return None
+            self._principals.move_to_end(user_id)
+            self.principal_hits += 1
+            return principal
+
+    def set_principal(self, principal: UserPrincipal) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._put(self._principals, principal.id, (principal, time.time() + self.ttl_seconds))
+
+    def invalidate_user(self, user_id: int) -> None:
+        # Token entries only map to an id; dropping the principal forces a fresh users lookup.
+        with self._lock:
+            self._principals.pop(user_id, None)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tokens.clear()
+            self._principals.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+                "tokens": len(self._tokens),
+                "principals": len(self._principals),
+                "token_hits": self.token_hits,
+                "token_misses": self.token_misses,
+                "principal_hits": self.principal_hits,
+                "principal_misses": self.principal_misses,
+                "invalidations": self.invalidations,
+            }
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=AUTH_PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=AUTH_PRINCIPAL_CACHE_MAX_ENTRIES,
+)
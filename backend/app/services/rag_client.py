@@ -0,0 +1,93 @@
+import logging
+from typing import Optional
+
+import httpx
+
+from app.config import (
+    RAG_SERVICE_URL,
+    RAG_POOL_MAX_CONNECTIONS,
+    RAG_POOL_MAX_KEEPALIVE,
+    RAG_POOL_KEEPALIVE_EXPIRY_SECONDS,
+    RAG_CONNECT_TIMEOUT_SECONDS,
+    EMBEDDING_SERVICE_TIMEOUT_SECONDS,
+    EMBEDDING_POOL_MAX_CONNECTIONS,
+    EMBEDDING_POOL_MAX_KEEPALIVE,
+)
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+_embedding_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=max(1, RAG_POOL_MAX_CONNECTIONS),
+        max_keepalive_connections=max(0, RAG_POOL_MAX_KEEPALIVE),
+        keepalive_expiry=RAG_POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    # Read timeout is set per attempt by the caller; only the connect phase is bounded here.
+    timeout = httpx.Timeout(None, connect=RAG_CONNECT_TIMEOUT_SECONDS)
+    return httpx.AsyncClient(
+        base_url=RAG_SERVICE_URL,
+        limits=limits,
+        timeout=timeout,
+        headers={"Content-Type": "application/json"},
+    )
+
+
+async def open_rag_client() -> httpx.AsyncClient:
+    """Open the shared connection pool to the RAG service (called from lifespan)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+        logger.info(
+            "RAG client opened: url=%s max_connections=%s max_keepalive=%s",
+            RAG_SERVICE_URL,
+            RAG_POOL_MAX_CONNECTIONS,
+            RAG_POOL_MAX_KEEPALIVE,
+        )
+    return _client
+
+
+async def close_rag_client() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("RAG client closed")
+    _client = None
+
+
+async def get_rag_client() -> httpx.AsyncClient:
+    """Return the shared client, opening it lazily when running outside the app lifespan."""
+    if _client is None or _client.is_closed:
+        return await open_rag_client()
+    return _client
+
+
+def _build_embedding_client() -> httpx.AsyncClient:
+    # Own pool and timeout: slow embedding calls must not hold RAG connections, and vice versa.
+    limits = httpx.Limits(
+        max_connections=max(1, EMBEDDING_POOL_MAX_CONNECTIONS),
+        max_keepalive_connections=max(0, EMBEDDING_POOL_MAX_KEEPALIVE),
+        keepalive_expiry=RAG_POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    timeout = httpx.Timeout(EMBEDDING_SERVICE_TIMEOUT_SECONDS, connect=min(RAG_CONNECT_TIMEOUT_SECONDS, EMBEDDING_SERVICE_TIMEOUT_SECONDS))
+    return httpx.AsyncClient(limits=limits, timeout=timeout, headers={"Content-Type": "application/json"})
+
+
+async def get_embedding_client() -> httpx.AsyncClient:
+    """Return the query-embedding client, opening it on first use."""
+    global _embedding_client
+    if _embedding_client is None or _embedding_client.is_closed:
+        _embedding_client = _build_embedding_client()
+        logger.info("Embedding client opened: max_connections=%s", EMBEDDING_POOL_MAX_CONNECTIONS)
+    return _embedding_client
+
+
+async def close_embedding_client() -> None:
+    global _embedding_client
+    if _embedding_client is not None and not _embedding_client.is_closed:
+        await _embedding_client.aclose()
+        logger.info("Embedding client closed")
+    _embedding_client = None
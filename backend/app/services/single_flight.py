@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent async calls that share a key.
+    The first caller starts the work; callers arriving while it is still running
+    await the same task and receive its result (no result is kept afterwards).
+    The shared task is cancelled only when every caller waiting on it has gone away.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.debug("%s: joined in-flight call", self.name)
+        else:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.leaders += 1
+
+        # Shield so one caller disconnecting does not cancel the shared upstream call for the others.
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            remaining = self._waiters[task] - 1
+            if remaining:
+                self._waiters[task] = remaining
+            else:
+                del self._waiters[task]
+                if not task.done():
+                    # Last waiter left (client disconnects): nobody needs the upstream call any more.
+                    self.abandoned += 1
+                    self._forget(key, task)
+                    task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
@@ -0,0 +1,31 @@
+import re
+from typing import List
+
+# Thai script block (consonants, vowels, tone marks, digits)
+THAI_RUN_RE = re.compile(r"[\u0e00-\u0e7f]+")
+TOKEN_RUN_RE = re.compile(r"[\u0e00-\u0e7f]+|[a-z0-9]+(?:\.[0-9]+)*")
+THAI_NGRAM_SIZE = 2
+
+
+def normalize_question_text(text: str) -> str:
+    normalized = (text or "").strip().lower()
+    normalized = re.sub(r"\s+", " ", normalized)
+    return normalized
+
+
+def tokenize(text: str, ngram_size: int = THAI_NGRAM_SIZE) -> List[str]:
+    """
+    Tokenize mixed Thai/English text for lexical matching.
+    Thai has no spaces between words, so Thai runs become overlapping character n-grams;
+    Latin words and numbers (e.g. "tetet", "18", "gen101") are kept whole.
+    """
+    tokens: List[str] = []
+    for run in TOKEN_RUN_RE.findall((text or "").lower()):
+        if THAI_RUN_RE.fullmatch(run):
+            if len(run) <= ngram_size:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + ngram_size] for i in range(len(run) - ngram_size + 1))
+        else:
+            tokens.append(run)
+    return tokens
@@ -0,0 +1,107 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import Chat, Thread
+
+logger = logging.getLogger(__name__)
+
+
+def make_thread_title(first_message: Optional[str]) -> str:
+    if not first_message:
+        return "Untitled"
+    return first_message[:50] + "..." if len(first_message) > 50 else first_message
+
+
+def touch_thread(db: Session, user_id: int, thread_id: str, message: str, created_at: Optional[datetime] = None) -> None:
+    """
+    Record one new question in the thread summary (caller commits).
+    Creates the row on the first message; later messages bump last_activity_at and message_count.
+    """
+    created_at = created_at or datetime.utcnow()
+    updated = (
+        db.query(Thread)
+        .filter(Thread.user_id == user_id, Thread.thread_id == thread_id)
+        .update(
+            {
+                Thread.last_activity_at: created_at,
+                Thread.message_count: Thread.message_count + 1,
+            },
+            synchronize_session=False,
+        )
+    )
+    if updated:
+        return
+
+    try:
+        with db.begin_nested():
+            db.add(Thread(
+                user_id=user_id,
+                thread_id=thread_id,
+                title=make_thread_title(message),
+                created_at=created_at,
+                last_activity_at=created_at,
+                message_count=1,
+            ))
+    except IntegrityError:
+        # Another request created the row concurrently; count this message against it.
+        db.query(Thread).filter(Thread.user_id == user_id, Thread.thread_id == thread_id).update(
+            {
+                Thread.last_activity_at: created_at,
+                Thread.message_count: Thread.message_count + 1,
+            },
+            synchronize_session=False,
+        )
+
+
+def backfill_threads(conn: Connection, batch_size: int = 5000) -> int:
+    """
+    Build thread summaries from existing chats when the threads table is still empty.
+    Grouped rows are streamed batch_size at a time, so memory does not grow with the number of threads.
+    """
+    threads = Thread.__table__
+    if conn.execute(select(threads.c.id).limit(1)).first() is not None:
+        return 0
+
+    chats = Chat.__table__
+    grouped = (
+        select(
+            chats.c.user_id,
+            chats.c.thread_id,
+            func.min(chats.c.id).label("first_chat_id"),
+            func.min(chats.c.created_at).label("created_at"),
+            func.max(chats.c.created_at).label("last_activity_at"),
+            func.count(chats.c.id).label("message_count"),
+        )
+        .where(chats.c.user_id.isnot(None))
+        .group_by(chats.c.user_id, chats.c.thread_id)
+        .subquery()
+    )
+    first_chat = chats.alias("first_chat")
+    rows = conn.execution_options(yield_per=batch_size).execute(
+        select(grouped, first_chat.c.message).join(first_chat, first_chat.c.id == grouped.c.first_chat_id)
+    )
+
+    created = 0
+    for batch in rows.partitions():
+        conn.execute(insert(threads), [
+            {
+                "user_id": row.user_id,
+                "thread_id": row.thread_id,
+                "title": make_thread_title(row.message),
+                "created_at": row.created_at or datetime.utcnow(),
+                "last_activity_at": row.last_activity_at or row.created_at or datetime.utcnow(),
+                "message_count": row.message_count,
+            }
+            for row in batch
+        ])
+        created += len(batch)
+
+    if created:
+        logger.info("Backfilled %s thread summaries from chats", created)
+    return created
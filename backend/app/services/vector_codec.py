@@ -0,0 +1,36 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+FLOAT32 = "float32"
+INT8 = "int8"
+SUPPORTED_DTYPES = (FLOAT32, INT8)
+
+# Stored byte order is fixed so blobs read the same on any host.
+_NUMPY_DTYPES = {FLOAT32: np.dtype("<f4"), INT8: np.dtype("i1")}
+
+
+def pack_vector(values: Sequence[float], dtype: str = FLOAT32) -> Tuple[bytes, Optional[float]]:
+    """
+    Encode an embedding as a compact blob: 4 bytes per dimension for float32, 1 for int8.
+    int8 uses symmetric per-vector quantization and returns the scale needed to decode it.
+    """
+    if dtype not in _NUMPY_DTYPES:
+        raise ValueError(f"Unsupported vector dtype '{dtype}'")
+    vector = np.asarray(values, dtype=np.float32)
+    if dtype == FLOAT32:
+        return vector.astype(_NUMPY_DTYPES[FLOAT32]).tobytes(), None
+    peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    quantized = np.clip(np.rint(vector / scale), -127, 127).astype(_NUMPY_DTYPES[INT8])
+    return quantized.tobytes(), scale
+
+
+def unpack_vector(blob: bytes, dtype: str = FLOAT32, scale: Optional[float] = None) -> np.ndarray:
+    """Decode a blob from pack_vector back to a float32 array."""
+    if dtype not in _NUMPY_DTYPES:
+        raise ValueError(f"Unsupported vector dtype '{dtype}'")
+    vector = np.frombuffer(blob, dtype=_NUMPY_DTYPES[dtype]).astype(np.float32)
+    if dtype == INT8:
+        vector *= scale if scale else 1.0
+    return vector
@@ -0,0 +1,488 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.config import (
+    EMBEDDING_STORAGE_DTYPE,
+    VECTOR_INDEX_DIR,
+    VECTOR_INDEX_EMBEDDING_API,
+    VECTOR_INDEX_REFRESH_SECONDS,
+    VECTOR_INDEX_BUILD_BATCH_SIZE,
+)
+from app.models.database import SessionLocal
+from app.models.models import Embedding
+from app.services.vector_codec import FLOAT32, INT8, SUPPORTED_DTYPES, pack_vector, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+# Rows scored per matmul; keeps the float32 working set of an int8 block around 16 MiB.
+SEARCH_BLOCK_BYTES = 16 * 1024 * 1024
+MASK_CACHE_SIZE = 8
+RELOAD_ATTEMPTS = 3
+
+
+def store_embeddings(
+    db: Session,
+    items: Iterable[Tuple[int, Sequence[float]]],
+    embedding_api: str,
+    dtype: str = EMBEDDING_STORAGE_DTYPE,
+    batch_size: int = 1000,
+) -> int:
+    """Insert (chunk_id, vector) pairs as packed blobs, batch_size rows per statement (caller commits)."""
+    count = 0
+    batch: List[Dict[str, object]] = []
+    for chunk_id, values in items:
+        blob, scale = pack_vector(values, dtype)
+        batch.append({
+            "chunk_id": chunk_id,
+            "vector_blob": blob,
+            "dim": len(values),
+            "dtype": dtype,
+            "scale": scale,
+            "embedding_api": embedding_api,
+            "created_at": datetime.utcnow(),
+        })
+        if len(batch) >= batch_size:
+            db.execute(insert(Embedding), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(Embedding), batch)
+        count += len(batch)
+    return count
+
+
+class _Snapshot:
+    """One generation of the index as mapped by this process; replaced wholesale, never mutated."""
+
+    def __init__(self, directory: str, manifest: Dict[str, object]):
+        self.manifest = manifest
+        self.count = int(manifest["count"])
+        self.dim = int(manifest["dim"])
+        self.dtype = str(manifest["dtype"])
+        generation = int(manifest["generation"])
+        if self.count == 0:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            self.chunk_ids = np.empty(0, dtype=np.int64)
+            self.scales = None
+            return
+        # Read-only memmaps: every worker on the host shares the same page-cache pages.
+        self.vectors = np.memmap(
+            os.path.join(directory, f"vectors-{generation}.bin"),
+            dtype=np.float32 if self.dtype == FLOAT32 else np.int8,
+            mode="r",
+            shape=(self.count, self.dim),
+        )
+        self.chunk_ids = np.memmap(
+            os.path.join(directory, f"chunk_ids-{generation}.bin"), dtype=np.int64, mode="r", shape=(self.count,)
+        )
+        self.scales = None
+        if self.dtype == INT8:
+            self.scales = np.memmap(
+                os.path.join(directory, f"scales-{generation}.bin"), dtype=np.float32, mode="r", shape=(self.count,)
+            )
+
+    @property
+    def nbytes(self) -> int:
+        total = self.vectors.nbytes + self.chunk_ids.nbytes
+        return total + (self.scales.nbytes if self.scales is not None else 0)
+
+
+class VectorIndex:
+    """
+    Unit-normalized embedding matrix for cosine top-k search over chunks.
+    The matrix lives in flat files under `directory` and is opened with np.memmap, so all uvicorn
+    workers share one copy. New Embedding rows are appended in place; deleted rows (a re-processed
+    document) trigger a full rebuild into a new generation. Rows are assumed immutable once inserted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        embedding_api: str = "",
+        dtype: str = FLOAT32,
+        build_batch_size: int = 5000,
+    ):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported vector index dtype '{dtype}'")
+        self.directory = directory
+        self.embedding_api = embedding_api
+        self.dtype = dtype
+        self.build_batch_size = max(1, build_batch_size)
+        self._snapshot: Optional[_Snapshot] = None
+        self._manifest_key: Optional[Tuple[int, int]] = None
+        self._reload_lock = threading.Lock()
+        self._masks: List[Tuple[object, _Snapshot, np.ndarray]] = []
+        self.rebuilds = 0
+        self.appends = 0
+        self.skipped_rows = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.last_sync_at: Optional[float] = None
+
+    # ------------------------------------------------------------------ files
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        # Serializes builders across worker processes; readers never take it.
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> Optional[Dict[str, object]]:
+        try:
+            with open(self._path(MANIFEST_FILE), "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("Vector index manifest is unreadable; rebuilding")
+            return None
+
+    def _write_manifest(self, manifest: Dict[str, object]) -> None:
+        tmp_path = self._path(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        # Readers pick up the new row count only after the data it covers is on disk.
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+
+    def _data_files(self, generation: int) -> Dict[str, str]:
+        files = {
+            "vectors": self._path(f"vectors-{generation}.bin"),
+            "chunk_ids": self._path(f"chunk_ids-{generation}.bin"),
+        }
+        if self.dtype == INT8:
+            files["scales"] = self._path(f"scales-{generation}.bin")
+        return files
+
+    def _remove_old_generations(self, generation: int) -> None:
+        # The previous generation stays until the next rebuild: another worker may have read the
+        # old manifest and not yet mapped its files. Processes already mapping a file keep it alive.
+        keep = {f"-{generation}.bin", f"-{generation - 1}.bin"}
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin") and not any(name.endswith(suffix) for suffix in keep):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    # ------------------------------------------------------------------ build
+
+    def _embedding_filter(self):
+        conditions = [Embedding.vector_blob.isnot(None)]
+        if self.embedding_api:
+            conditions.append(Embedding.embedding_api == self.embedding_api)
+        return conditions
+
+    def _encode_rows(self, rows: List[object], dim: int) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], int]:
+        chunk_ids: List[int] = []
+        vectors: List[np.ndarray] = []
+        skipped = 0
+        for row in rows:
+            vector = unpack_vector(row.vector_blob, row.dtype or FLOAT32, row.scale)
+            if vector.shape[0] != dim:
+                skipped += 1
+                continue
+            chunk_ids.append(row.chunk_id)
+            vectors.append(vector)
+        if not vectors:
+            return np.empty((0, dim), np.float32), np.empty(0, np.int64), None, skipped
+        matrix = np.vstack(vectors)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        scales = None
+        if self.dtype == INT8:
+            peaks = np.max(np.abs(matrix), axis=1)
+            scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+            matrix = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return matrix, np.asarray(chunk_ids, dtype=np.int64), scales, skipped
+
+    def _write_rows(self, db: Session, manifest: Dict[str, object], after_id: int) -> Dict[str, object]:
+        """Append every embedding with id > after_id to the generation named in `manifest`."""
+        files = self._data_files(int(manifest["generation"]))
+        itemsizes = {"vectors": (1 if self.dtype == INT8 else 4) * int(manifest["dim"] or 0), "chunk_ids": 8, "scales": 4}
+        rows = db.execute(
+            select(Embedding.id, Embedding.chunk_id, Embedding.vector_blob, Embedding.dim, Embedding.dtype, Embedding.scale)
+            .where(*self._embedding_filter(), Embedding.id > after_id)
+            .order_by(Embedding.id)
+            .execution_options(yield_per=self.build_batch_size)
+        )
+        handles = {}
+        try:
+            for key, path in files.items():
+                handle = open(path, "r+b" if os.path.exists(path) else "w+b")
+                # Drop bytes left past the published row count by an interrupted append.
+                handle.truncate(int(manifest["count"]) * itemsizes[key])
+                handle.seek(0, os.SEEK_END)
+                handles[key] = handle
+            for batch in rows.partitions():
+                if not manifest["dim"]:
+                    manifest["dim"] = batch[0].dim or len(batch[0].vector_blob) // (1 if batch[0].dtype == INT8 else 4)
+                    itemsizes["vectors"] = (1 if self.dtype == INT8 else 4) * int(manifest["dim"])
+                matrix, chunk_ids, scales, skipped = self._encode_rows(batch, int(manifest["dim"]))
+                handles["vectors"].write(matrix.tobytes())
+                handles["chunk_ids"].write(chunk_ids.tobytes())
+                if scales is not None:
+                    handles["scales"].write(scales.tobytes())
+                manifest["count"] = int(manifest["count"]) + len(chunk_ids)
+                manifest["rows_seen"] = int(manifest["rows_seen"]) + len(batch)
+                manifest["last_embedding_id"] = int(batch[-1].id)
+                self.skipped_rows += skipped
+            for handle in handles.values():
+                handle.flush()
+                os.fsync(handle.fileno())
+        finally:
+            for handle in handles.values():
+                handle.close()
+        manifest["updated_at"] = datetime.utcnow().isoformat()
+        return manifest
+
+    def _rebuild(self, db: Session, previous: Optional[Dict[str, object]]) -> None:
+        generation = int(previous["generation"]) + 1 if previous else 1
+        manifest = {
+            "generation": generation,
+            "dtype": self.dtype,
+            "embedding_api": self.embedding_api,
+            "dim": 0,
+            "count": 0,
+            "rows_seen": 0,
+            "last_embedding_id": 0,
+        }
+        for path in self._data_files(generation).values():
+            if os.path.exists(path):
+                os.remove(path)
+        manifest = self._write_rows(db, manifest, after_id=0)
+        self._write_manifest(manifest)
+        self._remove_old_generations(generation)
+        self.rebuilds += 1
+        logger.info("Vector index rebuilt: %s vectors (dim=%s, %s)", manifest["count"], manifest["dim"], self.dtype)
+
+    def sync(self, db: Session) -> bool:
+        """Bring the on-disk index up to date with the embeddings table. Returns True if it changed."""
+        with self._file_lock():
+            manifest = self._read_manifest()
+            stale_layout = (
+                manifest is None
+                or manifest.get("dtype") != self.dtype
+                or manifest.get("embedding_api") != self.embedding_api
+                or (
+                    int(manifest["count"]) > 0
+                    and any(not os.path.exists(path) for path in self._data_files(int(manifest["generation"])).values())
+                )
+            )
+            if stale_layout:
+                self._rebuild(db, manifest)
+                changed = True
+            else:
+                last_id = int(manifest["last_embedding_id"])
+                covered, newest = db.execute(
+                    select(
+                        func.count(Embedding.id).filter(Embedding.id <= last_id),
+                        func.max(Embedding.id),
+                    ).where(*self._embedding_filter())
+                ).one()
+                if covered != int(manifest["rows_seen"]):
+                    # Rows were deleted (documents re-processed): compact into a fresh generation.
+                    self._rebuild(db, manifest)
+                    changed = True
+                elif newest is not None and newest > last_id:
+                    added_from = int(manifest["count"])
+                    self._write_manifest(self._write_rows(db, manifest, after_id=last_id))
+                    self.appends += 1
+                    logger.info("Vector index appended %s vectors", int(manifest["count"]) - added_from)
+                    changed = True
+                else:
+                    changed = False
+        self.last_sync_at = time.time()
+        self._reload_if_changed()
+        return changed
+
+    # ------------------------------------------------------------------ query
+
+    def _reload_if_changed(self) -> None:
+        try:
+            stat = os.stat(self._path(MANIFEST_FILE))
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key == self._manifest_key:
+            return
+        with self._reload_lock:
+            if key == self._manifest_key:
+                return
+            for attempt in range(RELOAD_ATTEMPTS):
+                manifest = self._read_manifest()
+                if manifest is None or manifest.get("dtype") != self.dtype:
+                    return
+                try:
+                    self._snapshot = _Snapshot(self.directory, manifest)
+                except FileNotFoundError:
+                    # Another worker rebuilt and cleaned up between reading the manifest and mapping:
+                    # re-read it, or keep serving the current snapshot until the next query.
+                    if attempt + 1 == RELOAD_ATTEMPTS:
+                        logger.warning("Vector index generation %s vanished while loading", manifest.get("generation"))
+                        return
+                    continue
+                self._manifest_key = key
+                return
+
+    def _row_mask(self, snapshot: _Snapshot, chunk_ids: Iterable[int]) -> np.ndarray:
+        # Category filters pass the same array on every query; keep its row mask per snapshot.
+        for cached_ids, cached_snapshot, mask in self._masks:
+            if cached_ids is chunk_ids and cached_snapshot is snapshot:
+                return mask
+        allowed = np.unique(np.asarray(chunk_ids if isinstance(chunk_ids, np.ndarray) else list(chunk_ids), dtype=np.int64))
+        if allowed.size == 0:
+            return np.zeros(snapshot.count, dtype=bool)
+        found = allowed[np.minimum(np.searchsorted(allowed, snapshot.chunk_ids), allowed.size - 1)]
+        mask = found == snapshot.chunk_ids
+        if isinstance(chunk_ids, np.ndarray):
+            self._masks = [(chunk_ids, snapshot, mask)] + self._masks[:MASK_CACHE_SIZE - 1]
+        return mask
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 10,
+        chunk_ids: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Top-k (chunk_id, cosine similarity) pairs, best first.
+        `chunk_ids` restricts the search to those chunks (e.g. one category's documents).
+        """
+        self._reload_if_changed()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.count == 0 or k <= 0:
+            return []
+        started = time.perf_counter()
+        vector = np.asarray(query, dtype=np.float32).ravel()
+        if vector.shape[0] != snapshot.dim:
+            raise ValueError(f"Query has {vector.shape[0]} dimensions, index has {snapshot.dim}")
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            return []
+        vector = vector / norm
+        mask = None
+        if chunk_ids is not None:
+            mask = self._row_mask(snapshot, chunk_ids)
+            if not mask.any():
+                return []
+
+        block_rows = max(1024, SEARCH_BLOCK_BYTES // (snapshot.dim * 4))
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, snapshot.count, block_rows):
+            stop = min(start + block_rows, snapshot.count)
+            block = snapshot.vectors[start:stop]
+            rows = None
+            if mask is not None:
+                # Only score the rows the filter allows.
+                rows = np.flatnonzero(mask[start:stop])
+                if rows.size == 0:
+                    continue
+                block = block[rows]
+            if snapshot.scales is not None:
+                scales = snapshot.scales[start:stop]
+                scores = (block.astype(np.float32) @ vector) * (scales[rows] if rows is not None else scales)
+            else:
+                scores = block @ vector
+            take = min(k, scores.shape[0])
+            top = np.argpartition(-scores, take - 1)[:take]
+            best_rows = np.concatenate([best_rows, (rows[top] if rows is not None else top) + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if best_scores.shape[0] > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores, kind="stable")
+        results = [
+            (int(snapshot.chunk_ids[best_rows[i]]), float(best_scores[i]))
+            for i in order
+            if np.isfinite(best_scores[i])
+        ]
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> Dict[str, object]:
+        snapshot = self._snapshot
+        return {
+            "directory": os.path.abspath(self.directory),
+            "dtype": self.dtype,
+            "embedding_api": self.embedding_api or None,
+            "loaded": snapshot is not None,
+            "generation": snapshot.manifest.get("generation") if snapshot else None,
+            "vectors": snapshot.count if snapshot else 0,
+            "dim": snapshot.dim if snapshot else None,
+            "mapped_bytes": snapshot.nbytes if snapshot else 0,
+            "last_embedding_id": snapshot.manifest.get("last_embedding_id") if snapshot else None,
+            "rebuilds_by_this_worker": self.rebuilds,
+            "appends_by_this_worker": self.appends,
+            "skipped_rows": self.skipped_rows,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_seconds * 1000 / self.searches, 3) if self.searches else None,
+        }
+
+
+vector_index = VectorIndex(
+    VECTOR_INDEX_DIR,
+    embedding_api=VECTOR_INDEX_EMBEDDING_API,
+    dtype=EMBEDDING_STORAGE_DTYPE,
+    build_batch_size=VECTOR_INDEX_BUILD_BATCH_SIZE,
+)
+
+_vector_index_checked_at = 0.0
+
+
+def load_vector_index() -> None:
+    """Sync the index with the embeddings table and map it (first pass of the background refresher)."""
+    global _vector_index_checked_at
+    db = SessionLocal()
+    try:
+        vector_index.sync(db)
+        _vector_index_checked_at = time.monotonic()
+    finally:
+        db.close()
+
+
+def refresh_vector_index_if_stale() -> None:
+    """Pick up new Embedding rows, at most once per VECTOR_INDEX_REFRESH_SECONDS."""
+    global _vector_index_checked_at
+    now = time.monotonic()
+    if now - _vector_index_checked_at < VECTOR_INDEX_REFRESH_SECONDS:
+        return
+    _vector_index_checked_at = now
+    load_vector_index()
+
+
+def search_chunks(
+    query: Sequence[float],
+    k: int = 10,
+    chunk_ids: Optional[Iterable[int]] = None,
+) -> List[Tuple[int, float]]:
+    """
+    Cosine top-k over chunk embeddings; CPU-bound, so async callers should run it in an executor.
+    Never syncs: LocalIndexRefresher keeps the index current in the background.
+    """
+    return vector_index.search(query, k=k, chunk_ids=chunk_ids)
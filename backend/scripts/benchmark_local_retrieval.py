@@ -0,0 +1,186 @@
+"""
+Benchmark the in-process hybrid retriever (BM25 + vector, fused with RRF) at a given corpus size.
+
+Seeds a scratch database with synthetic Thai-like chunks and random embeddings, builds the chunk
+retriever and the memory-mapped vector index from it the same way the app does at startup, then
+times BM25-only, vector-only, hybrid and hybrid + category-filter queries (median / p95 latency).
+
+WARNING: the target database is modified (rows inserted) and VECTOR_INDEX_DIR is overwritten.
+Point it at a throwaway database, never at production.
+
+Usage (from backend/):
+    python scripts/benchmark_local_retrieval.py --database-url sqlite:///bench_retrieval_10k.db --chunks 10000
+    python scripts/benchmark_local_retrieval.py --database-url sqlite:///bench_retrieval_1m.db --chunks 1000000 --dtype int8
+"""
+import argparse
+import os
+import resource
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BENCH_EMBEDDING_API = "bench"
+CATEGORIES = ["curriculum", "regulation", "course_structure"]
+THAI_CONSONANTS = "กขคงจฉชซญดตถทธนบปผพฟภมยรลวศษสหอฮ"
+THAI_VOWELS = ["ะ", "า", "ิ", "ี", "ุ", "ู", "ั", "ำ", "", "เ", "แ", "โ"]
+
+
+def load_app(database_url: str, index_dir: str, dtype: str) -> None:
+    # app.config reads the environment at import time.
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["VECTOR_INDEX_DIR"] = index_dir
+    os.environ["VECTOR_INDEX_EMBEDDING_API"] = BENCH_EMBEDDING_API
+    os.environ["EMBEDDING_STORAGE_DTYPE"] = dtype
+
+
+def make_vocabulary(size: int, rng: np.random.Generator):
+    words = set()
+    while len(words) < size:
+        syllables = []
+        for _ in range(rng.integers(1, 4)):
+            vowel = THAI_VOWELS[rng.integers(len(THAI_VOWELS))]
+            consonant = THAI_CONSONANTS[rng.integers(len(THAI_CONSONANTS))]
+            syllables.append(vowel + consonant if vowel in "เแโ" else consonant + vowel)
+        words.add("".join(syllables))
+    words = sorted(words)
+    rng.shuffle(words)
+    # Zipf-like word frequencies so a few terms have very long posting lists, as in real text.
+    weights = 1.0 / np.arange(1, size + 1)
+    return words, weights / weights.sum()
+
+
+def synthetic_text(words, word_ids) -> str:
+    # Thai runs words together; a space every few words marks a clause break.
+    return " ".join("".join(words[i] for i in word_ids[start:start + 6]) for start in range(0, len(word_ids), 6))
+
+
+def seed(args, rng: np.random.Generator, words, probabilities) -> None:
+    from sqlalchemy import func, insert, select
+    from app.models.database import SessionLocal
+    from app.models.models import Chunk, File, OCRResult
+    from app.services.vector_index import store_embeddings
+
+    db = SessionLocal()
+    try:
+        existing = db.execute(select(func.count(Chunk.id))).scalar()
+        if existing >= args.chunks:
+            print(f"Database already has {existing} chunks, skipping seed")
+            return
+        file = File(filename="bench.pdf", filetype="application/pdf", raw_path="bench/bench.pdf")
+        db.add(file)
+        db.flush()
+        page = OCRResult(file_id=file.id, engine="bench", page_number=1, text="")
+        db.add(page)
+        db.flush()
+        next_id = (db.execute(select(func.max(Chunk.id))).scalar() or 0) + 1
+        target = args.chunks - existing
+        started = time.perf_counter()
+        inserted = 0
+        while inserted < target:
+            size = min(args.batch_size, target - inserted)
+            word_ids = rng.choice(len(words), size=(size, args.chunk_words), p=probabilities)
+            ids = list(range(next_id + inserted, next_id + inserted + size))
+            db.execute(insert(Chunk), [
+                {
+                    "id": chunk_id,
+                    "ocr_result_id": page.id,
+                    "content": synthetic_text(words, word_ids[i]),
+                    "chunk_metadata": {"file_id": file.id, "filename": "bench.pdf", "page": 1, "category": CATEGORIES[chunk_id % 3]},
+                    "created_at": datetime.utcnow(),
+                }
+                for i, chunk_id in enumerate(ids)
+            ])
+            vectors = rng.standard_normal((size, args.dim), dtype=np.float32)
+            store_embeddings(db, zip(ids, vectors), BENCH_EMBEDDING_API, dtype=args.dtype, batch_size=args.batch_size)
+            db.commit()
+            inserted += size
+            print(f"  seeded {inserted}/{target} chunks ({time.perf_counter() - started:.0f}s)", end="\r")
+        print()
+    finally:
+        db.close()
+
+
+def timed(fn, queries, repeat: int):
+    fn(*queries[0])  # warm up (page cache, lazy imports)
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            fn(*query)
+            samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="scratch database to seed and benchmark")
+    parser.add_argument("--chunks", type=int, default=10_000)
+    parser.add_argument("--chunk-words", type=int, default=60, help="synthetic words per chunk (~300-400 Thai chars)")
+    parser.add_argument("--vocabulary", type=int, default=30_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float32", "int8"], default="float32")
+    parser.add_argument("--index-dir", default="bench_vector_index")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    load_app(args.database_url, args.index_dir, args.dtype)
+    from app.models.database import Base, SessionLocal, engine
+    from app.services.local_retrieval import ChunkRetriever
+    from app.services.vector_index import vector_index
+
+    Base.metadata.create_all(bind=engine)
+    rng = np.random.default_rng(42)
+    words, probabilities = make_vocabulary(args.vocabulary, rng)
+    print(f"Seeding {args.chunks} chunks (dim={args.dim}, {args.dtype})...")
+    seed(args, rng, words, probabilities)
+
+    retriever = ChunkRetriever()
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        retriever.sync(db)
+        bm25_build = time.perf_counter() - started
+        started = time.perf_counter()
+        vector_index.sync(db)
+        vector_build = time.perf_counter() - started
+    finally:
+        db.close()
+    lexical, vectors = retriever.stats(), vector_index.stats()
+    print(f"BM25 index:   {lexical['chunks']} chunks, {lexical['segments']} segments, "
+          f"{lexical['postings_bytes'] / 2**20:.0f} MiB postings, built in {bm25_build:.1f}s")
+    print(f"Vector index: {vectors['vectors']} vectors, {vectors['mapped_bytes'] / 2**20:.0f} MiB mapped, "
+          f"built in {vector_build:.1f}s")
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+    texts = [
+        " ".join(words[i] for i in rng.choice(len(words), size=rng.integers(2, 6), p=probabilities))
+        for _ in range(args.queries)
+    ]
+    query_vectors = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    depth = retriever.candidates
+    cases = {
+        "bm25 only": lambda text, vector: retriever.bm25_search(text, depth),
+        "vector only": lambda text, vector: vector_index.search(vector, k=depth),
+        "hybrid rrf": lambda text, vector: retriever.search(text, k=args.k, query_vector=vector),
+        "hybrid rrf + category": lambda text, vector: retriever.search(
+            text, k=args.k, category="regulation", query_vector=vector
+        ),
+    }
+    queries = list(zip(texts, query_vectors))
+    print(f"\n{'query':<24}{'median ms':>12}{'p95 ms':>12}")
+    for name, fn in cases.items():
+        median, p95 = timed(fn, queries, args.repeat)
+        print(f"{name:<24}{median:>12.2f}{p95:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
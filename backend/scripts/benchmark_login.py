@@ -0,0 +1,151 @@
+"""
+Benchmark /auth/login throughput under concurrency and how much it stalls the event loop.
+
+Each mode runs in its own process with PASSWORD_HASH_WORKERS set (0 = hash inline on the
+event loop, the old behaviour). While logins run, a probe hits /health every few ms; its
+latency shows how much other traffic (chat) is starved by password hashing.
+
+Usage (from backend/):
+    python scripts/benchmark_login.py --logins 200 --concurrency 50 --workers 0,4
+    python scripts/benchmark_login.py --database-url sqlite:///bench_login.db --workers 0,2,8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_single(database_url: str, n_users: int, n_logins: int, concurrency: int) -> dict:
+    # app modules read their settings at import time, so import after the environment is set.
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import httpx
+    from app.main import app
+    from app.models.database import Base, SessionLocal, engine
+    from app.models.models import User
+    from app.services.password_hasher import password_hasher, pwd_context
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        existing = db.query(User).filter(User.email.like("loginbench%")).count()
+        if existing < n_users:
+            hashed = pwd_context.hash(BENCH_PASSWORD)
+            db.bulk_insert_mappings(User, [
+                {
+                    "name": f"login bench {i}",
+                    "email": f"loginbench{i}@gmail.com",
+                    "hashed_password": hashed,
+                    "role": "user",
+                    "is_verified": True,
+                }
+                for i in range(existing, n_users)
+            ])
+            db.commit()
+    finally:
+        db.close()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        login_latencies = []
+        probe_latencies = []
+        failures = 0
+        done = asyncio.Event()
+
+        async def login(i: int) -> None:
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/auth/login", json={
+                    "email": f"loginbench{i % n_users}@gmail.com",
+                    "password": BENCH_PASSWORD,
+                })
+                login_latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+
+        async def probe() -> None:
+            # Measured from when the probe wanted to fire, so a blocked event loop shows up as latency.
+            while not done.is_set():
+                due = time.perf_counter() + 0.005
+                await asyncio.sleep(0.005)
+                await client.get("/health")
+                probe_latencies.append(time.perf_counter() - due)
+
+        probe_task = asyncio.ensure_future(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(n_logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+    password_hasher.shutdown()
+
+    return {
+        "workers": password_hasher.workers,
+        "logins": n_logins,
+        "failures": failures,
+        "elapsed_s": elapsed,
+        "logins_per_s": n_logins / elapsed if elapsed else 0.0,
+        "login_p50_ms": statistics.median(login_latencies) * 1000,
+        "login_p95_ms": percentile(login_latencies, 0.95) * 1000,
+        "probe_p50_ms": statistics.median(probe_latencies) * 1000 if probe_latencies else 0.0,
+        "probe_max_ms": max(probe_latencies) * 1000 if probe_latencies else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:///bench_login.db", help="scratch database (users are inserted)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", default="0,4", help="comma-separated PASSWORD_HASH_WORKERS values to compare")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = asyncio.run(run_single(args.database_url, args.users, args.logins, args.concurrency))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for workers in [w.strip() for w in args.workers.split(",") if w.strip()]:
+        env = dict(os.environ, PASSWORD_HASH_WORKERS=workers)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--single",
+             "--database-url", args.database_url, "--users", str(args.users),
+             "--logins", str(args.logins), "--concurrency", str(args.concurrency)],
+            env=env, capture_output=True, text=True,
+        )
+        if output.returncode != 0:
+            sys.exit(f"workers={workers} run failed:\n{output.stderr}")
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print(f"{args.logins} logins, concurrency {args.concurrency}, cpus {os.cpu_count()}")
+    print(f"{'workers':>8}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'probe p50':>11}{'probe max':>11}{'fail':>6}")
+    for r in results:
+        mode = "inline" if r["workers"] == 0 else str(r["workers"])
+        print(
+            f"{mode:>8}{r['logins_per_s']:>10.1f}{r['login_p50_ms']:>10.0f}{r['login_p95_ms']:>10.0f}"
+            f"{r['probe_p50_ms']:>11.1f}{r['probe_max_ms']:>11.0f}{r['failures']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
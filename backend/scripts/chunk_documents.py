@@ -0,0 +1,45 @@
+"""
+Re-chunk already extracted documents, e.g. after changing CHUNK_MAX_CHARS / CHUNK_OVERLAP_CHARS.
+
+Files are processed one at a time; each file's chunks (and their embeddings) are replaced
+in a single transaction, so an interrupted run leaves every file either old or new.
+
+Usage (from backend/):
+    python scripts/chunk_documents.py              # every file with OCR results
+    python scripts/chunk_documents.py --file-id 3 --file-id 7
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import select  # noqa: E402
+
+from app.models.database import SessionLocal  # noqa: E402
+from app.models.models import OCRResult  # noqa: E402
+from app.services.chunker import chunk_file  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file-id", type=int, action="append", help="only these files (repeatable)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        file_ids = args.file_id or db.execute(select(OCRResult.file_id).distinct().order_by(OCRResult.file_id)).scalars().all()
+        total = 0
+        started = time.perf_counter()
+        for file_id in file_ids:
+            count = chunk_file(db, file_id)
+            total += count
+            print(f"file {file_id}: {count} chunks")
+        print(f"{total} chunks from {len(file_ids)} files in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()